@@ -0,0 +1,140 @@
+"""
+Latency benchmark for the GUI backend's read endpoints.
+
+Builds a synthetic notes database and times `/hierarchy` and `/answers/{id}`
+against two setups:
+
+  before  - the legacy schema: rollback journal, default pragmas, no secondary indexes
+  after   - the schema and connection profile applied by `init_db`
+
+Each setup is measured idle and while a background writer keeps committing
+small transactions (as `analyze_notes` or a crawl does).
+
+Usage:
+    python benchmarks/bench_backend.py [--pages 20000] [--requests 200]
+"""
+import argparse
+import os
+import shutil
+import sqlite3
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'cli'))
+# Importing the CLI module must not prompt for credentials
+os.environ.setdefault("NOTION_TOKEN", "benchmark")
+os.environ.setdefault("GEMINI_API_KEY", "benchmark")
+
+from fastapi.testclient import TestClient
+import gui_backend
+import notion_cli
+
+LEGACY_SCHEMA = [
+    '''CREATE TABLE pages (id TEXT PRIMARY KEY, parent_id TEXT, created_time TEXT,
+       last_edited_time TEXT, content TEXT, content_length INTEGER)''',
+    '''CREATE TABLE gemini_analysis (note_id TEXT, questions_version TEXT, model TEXT,
+       date_executed TEXT, answers_json TEXT, PRIMARY KEY (note_id, questions_version, model))''',
+]
+
+
+def populate(conn, n_pages):
+    rows = []
+    for i in range(n_pages):
+        parent = None if i < 10 else f"page{(i - 10) // 8}"
+        content = f"# Note {i}\n\n" + "lorem ipsum " * 50
+        rows.append((f"page{i}", parent, f"2024-01-01T00:{i % 60:02d}:00.000Z",
+                     f"2024-06-01T00:{i % 60:02d}:00.000Z", content, len(content)))
+    conn.executemany("""INSERT INTO pages (id, parent_id, created_time, last_edited_time, content, content_length)
+                        VALUES (?, ?, ?, ?, ?, ?)""", rows)
+    answers = '{"q1": "Answer one", "q2": "Answer two"}'
+    conn.executemany("INSERT INTO gemini_analysis (note_id, questions_version, model, date_executed, answers_json) "
+                     "VALUES (?, ?, ?, ?, ?)",
+                     [(f"page{i}", "v4", "gemini-2.0-flash", "2024-06-02", answers) for i in range(0, n_pages, 2)])
+    conn.commit()
+
+
+def build_db(path, profile, n_pages):
+    if profile == "before":
+        conn = sqlite3.connect(path)
+        for stmt in LEGACY_SCHEMA:
+            conn.execute(stmt)
+    else:
+        notion_cli.DB_PATH = path
+        conn = notion_cli.init_db()
+    populate(conn, n_pages)
+    conn.close()
+
+
+def writer_loop(path, stop):
+    conn = sqlite3.connect(path, timeout=30)
+    i = 0
+    while not stop.is_set():
+        conn.execute("UPDATE pages SET last_edited_time = ? WHERE id = 'page0'", (str(i),))
+        time.sleep(0.002)  # work done while holding the write transaction
+        conn.commit()
+        i += 1
+    conn.close()
+
+
+def time_requests(client, path_fn, n):
+    samples = []
+    for i in range(n):
+        start = time.perf_counter()
+        resp = client.get(path_fn(i))
+        samples.append((time.perf_counter() - start) * 1000)
+        assert resp.status_code == 200, resp.text
+    samples.sort()
+    return statistics.median(samples), samples[int(len(samples) * 0.95) - 1]
+
+
+def run(profile, n_pages, n_requests, tmp_dir):
+    path = os.path.join(tmp_dir, f"{profile}.db")
+    build_db(path, profile, n_pages)
+    gui_backend.DB_PATH = path
+    client = TestClient(gui_backend.app)
+    endpoints = {
+        "/hierarchy": lambda i: "/hierarchy",
+        "/answers/{id}": lambda i: f"/answers/page{(i * 7919) % n_pages}",
+    }
+    results = {}
+    for label, path_fn in endpoints.items():
+        count = max(5, n_requests // 20) if label == "/hierarchy" else n_requests
+        results[(label, "idle")] = time_requests(client, path_fn, count)
+        stop = threading.Event()
+        writer = threading.Thread(target=writer_loop, args=(path, stop))
+        writer.start()
+        try:
+            results[(label, "with writer")] = time_requests(client, path_fn, count)
+        finally:
+            stop.set()
+            writer.join()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, default=20000)
+    parser.add_argument("--requests", type=int, default=200)
+    args = parser.parse_args()
+
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        before = run("before", args.pages, args.requests, tmp_dir)
+        after = run("after", args.pages, args.requests, tmp_dir)
+    finally:
+        shutil.rmtree(tmp_dir)
+
+    print(f"{args.pages} pages; latency in ms (median / p95)")
+    print(f"{'endpoint':<16}{'load':<14}{'before':>18}{'after':>18}")
+    for key in before:
+        b, a = before[key], after[key]
+        print(f"{key[0]:<16}{key[1]:<14}{b[0]:>9.2f} /{b[1]:>7.2f}{a[0]:>9.2f} /{a[1]:>7.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,292 @@
+import hashlib
+import json
+import re
+from datetime import datetime
+
+WHITESPACE_RE = re.compile(r"\s+")
+
+def normalize_content(text):
+    """Collapse whitespace so re-exports and trailing-space edits hash the same."""
+    return WHITESPACE_RE.sub(" ", text or "").strip()
+
+def content_hash(text):
+    return hashlib.sha256(normalize_content(text).encode("utf-8")).hexdigest()
+
+def questions_hash(instructions, questions):
+    """Hash of the prompt definition, so edited questions invalidate results even under the same version."""
+    payload = json.dumps([instructions, questions], ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+def question_hash(question):
+    """Hash of one question's text; answers carry over between versions that share it."""
+    return hashlib.sha256(normalize_content(question).encode("utf-8")).hexdigest()
+
+def parse_timestamp(value):
+    """Aware datetime for an ISO timestamp (naive ones are local time), or None for 'NA' and the like."""
+    try:
+        moment = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except (AttributeError, ValueError):
+        return None
+    return moment if moment.tzinfo else moment.astimezone()
+
+def is_current(result, question_count, last_edited_time):
+    """
+    Whether a result stored without cache state can stand for the note's
+    current content: it answers all `question_count` questions and was
+    produced no earlier than the note's last edit.
+    """
+    if any(f"q{i+1}" not in result for i in range(question_count)):
+        return False
+    executed = parse_timestamp(result.get("date_executed"))
+    edited = parse_timestamp(last_edited_time)
+    return executed is not None and edited is not None and executed >= edited
+
+CACHE_SCHEMA = [
+    # One Gemini result per distinct (content, questions, model)
+    '''CREATE TABLE IF NOT EXISTS analysis_cache (
+        content_hash TEXT,
+        questions_hash TEXT,
+        model TEXT,
+        result_json TEXT,
+        created_at TEXT,
+        PRIMARY KEY (content_hash, questions_hash, model)
+    )''',
+    # What each note's current analysis was computed from
+    '''CREATE TABLE IF NOT EXISTS note_analysis_state (
+        note_id TEXT,
+        questions_version TEXT,
+        model TEXT,
+        content_hash TEXT,
+        questions_hash TEXT,
+        PRIMARY KEY (note_id, questions_version, model)
+    )''',
+]
+
+QUESTION_ANSWERS_SCHEMA = [
+    # One answer per (content, question text, model), shared by every questions version that asks it
+    '''CREATE TABLE IF NOT EXISTS question_answers (
+        content_hash TEXT,
+        question_hash TEXT,
+        model TEXT,
+        answer_json TEXT,
+        created_at TEXT,
+        PRIMARY KEY (content_hash, question_hash, model)
+    )''',
+]
+
+class AnalysisCache:
+    """
+    Gemini results keyed by (normalized content hash, questions hash, model).
+
+    `status()` tells what a note's stored analysis was computed from; `get()`
+    returns a result computed for identical content under any note ID. Every
+    stored result is also split into per-question answers keyed by question
+    text, so `get_answers()` can fill in the questions a new version kept.
+    Counters track how many notes were up to date, served from the cache or
+    sent to Gemini, the answers carried forward and the prompt tokens avoided.
+    """
+    def __init__(self, conn, questions_version, instructions, questions, model):
+        self.conn = conn
+        self.questions_version = questions_version
+        self.questions = questions
+        self.questions_hash = questions_hash(instructions, questions)
+        self.question_hashes = [question_hash(q) for q in questions]
+        self.model = model
+        self.up_to_date = 0
+        self.hits = 0
+        self.misses = 0
+        self.answers_reused = 0
+        self.tokens_saved = 0
+
+    def status(self, note_id):
+        """(content hash, questions hash) the note was last analyzed from, or None if never."""
+        c = self.conn.cursor()
+        c.execute('''SELECT content_hash, questions_hash FROM note_analysis_state
+                     WHERE note_id = ? AND questions_version = ? AND model = ?''',
+                  (note_id, self.questions_version, self.model))
+        return c.fetchone()
+
+    def get(self, content_hash):
+        c = self.conn.cursor()
+        c.execute('''SELECT result_json FROM analysis_cache
+                     WHERE content_hash = ? AND questions_hash = ? AND model = ?''',
+                  (content_hash, self.questions_hash, self.model))
+        row = c.fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put(self, content_hash, result):
+        self.conn.execute('''INSERT OR REPLACE INTO analysis_cache
+                             (content_hash, questions_hash, model, result_json, created_at)
+                             VALUES (?, ?, ?, ?, ?)''',
+                          (content_hash, self.questions_hash, self.model,
+                           json.dumps(result, ensure_ascii=False), datetime.now().isoformat()))
+        self.put_answers(content_hash, self.questions, result)
+
+    def put_answers(self, content_hash, questions, result):
+        """Store the answers `result` ("q1".."qN") gives to `questions`, which may be another version's."""
+        now = datetime.now().isoformat()
+        rows = [(content_hash, question_hash(q), self.model, json.dumps(result[f"q{i+1}"], ensure_ascii=False), now)
+                for i, q in enumerate(questions) if f"q{i+1}" in result]
+        self.conn.executemany('''INSERT OR REPLACE INTO question_answers
+                                 (content_hash, question_hash, model, answer_json, created_at)
+                                 VALUES (?, ?, ?, ?, ?)''', rows)
+
+    def get_answers(self, content_hash):
+        """Stored answers for this content, as {question index: answer} over the current questions."""
+        c = self.conn.cursor()
+        c.execute('''SELECT question_hash, answer_json FROM question_answers
+                     WHERE content_hash = ? AND model = ?''', (content_hash, self.model))
+        by_hash = {row[0]: json.loads(row[1]) for row in c.fetchall()}
+        return {i: by_hash[h] for i, h in enumerate(self.question_hashes) if h in by_hash}
+
+    def mark(self, note_id, content_hash):
+        """Record that `note_id` now holds the analysis of `content_hash`."""
+        self.conn.execute('''INSERT OR REPLACE INTO note_analysis_state
+                             (note_id, questions_version, model, content_hash, questions_hash)
+                             VALUES (?, ?, ?, ?, ?)''',
+                          (note_id, self.questions_version, self.model, content_hash, self.questions_hash))
+
+    def record_hit(self, prompt_tokens):
+        self.hits += 1
+        self.tokens_saved += prompt_tokens
+
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def report(self):
+        print(f"Analysis cache: {self.up_to_date} notes up to date, {self.hits} cache hits, "
+              f"{self.misses} sent to Gemini (hit rate {self.hit_rate():.0%}, "
+              f"{self.answers_reused} answers carried forward, ~{self.tokens_saved} prompt tokens saved).")
+
+class AnalysisQueue:
+    """
+    What analyze_notes still has to send to Gemini, after the cache answered what it could.
+
+    `pending()` skips notes that are up to date, adopts untracked results that
+    are still current (see `is_current`), serves results computed for the same
+    content from the cache, and carries forward answers to questions an
+    earlier version already asked. Notes with the same content as one already
+    queued wait for its result. `finish()` stores a Gemini result for the note
+    and everything waiting on it.
+
+    `sink` stores results per note: `stored(note_id)` returns the current
+    version's stored result, `find(note_id, version)` also looks at JSON files
+    from older runs, and `save(note_id, result)` stores one.
+    `load_questions(version)` returns an earlier version's question list.
+    """
+    def __init__(self, cache, sink, version_label, estimate_tokens, prompt_overhead,
+                 earlier_versions=(), load_questions=None):
+        self.cache = cache
+        self.sink = sink
+        self.version_label = version_label
+        self.estimate_tokens = estimate_tokens
+        self.prompt_overhead = prompt_overhead
+        self.earlier_versions = list(earlier_versions)
+        self.load_questions = load_questions
+        self.earlier_questions = {}
+        # Notes waiting on a Gemini call for the same content: hash -> [note_id, ...]
+        self.in_flight = {}
+        self.note_hashes = {}
+        # Answers already known for notes sent with only their new/changed questions
+        self.partial_answers = {}
+
+    def metadata(self):
+        return {"questions_version": self.version_label, "model": self.cache.model,
+                "date_executed": datetime.now().isoformat()}
+
+    def assemble(self, answers, metadata):
+        result = {f"q{i+1}": answers[i] for i in sorted(answers)}
+        result.update(metadata)
+        return result
+
+    def import_earlier_answers(self, note_id, digest, last_edited_time):
+        """Store per question the answers earlier versions' outputs give for this content."""
+        for version in self.earlier_versions:
+            if version not in self.earlier_questions:
+                self.earlier_questions[version] = self.load_questions(version)
+            questions = self.earlier_questions[version]
+            previous = AnalysisCache(self.cache.conn, version, "", questions, self.cache.model).status(note_id)
+            if previous is not None and previous[0] != digest:
+                continue  # analyzed from older content
+            existing = self.sink.find(note_id, version)
+            if existing is None:
+                continue
+            if previous is None and not is_current(existing, len(questions), last_edited_time):
+                continue  # no record of what it was computed from, and it may predate the last edit
+            self.cache.put_answers(digest, questions, existing)
+
+    def store(self, note_id, digest, result):
+        self.sink.save(note_id, result)
+        self.cache.mark(note_id, digest)
+
+    def pending(self, notes):
+        """
+        Yield (note_id, content, question indices to ask or None for all) for
+        the `(note_id, content, content hash, last_edited_time)` notes that need Gemini.
+        """
+        cache = self.cache
+        question_count = len(cache.questions)
+        for note_id, content, digest, last_edited_time in notes:
+            prompt_tokens = self.estimate_tokens(content) + self.prompt_overhead
+            status = cache.status(note_id)
+            if status == (digest, cache.questions_hash) and self.sink.stored(note_id) is not None:
+                cache.up_to_date += 1
+                continue
+            if status is None:
+                # Result stored before the cache existed: trust it if complete and not older than the last edit
+                existing = self.sink.find(note_id)
+                if existing is not None and is_current(existing, question_count, last_edited_time):
+                    self.store(note_id, digest, existing)
+                    if cache.get(digest) is None:
+                        cache.put(digest, existing)
+                    cache.up_to_date += 1
+                    continue
+            cached = cache.get(digest)
+            if cached is not None:
+                self.store(note_id, digest, cached)
+                cache.record_hit(prompt_tokens)
+                continue
+            if digest in self.in_flight:
+                # Same content as a note already queued: reuse its result when it lands
+                self.in_flight[digest].append(note_id)
+                cache.record_hit(prompt_tokens)
+                continue
+            answers = cache.get_answers(digest)
+            if len(answers) < question_count and self.earlier_versions:
+                self.import_earlier_answers(note_id, digest, last_edited_time)
+                answers = cache.get_answers(digest)
+            cache.answers_reused += len(answers)
+            if len(answers) == question_count:
+                # Every question was answered for this content under an earlier version
+                result = self.assemble(answers, self.metadata())
+                cache.put(digest, result)
+                self.store(note_id, digest, result)
+                cache.record_hit(prompt_tokens)
+                continue
+            missing = None
+            if answers:
+                missing = [i for i in range(question_count) if i not in answers]
+                self.partial_answers[note_id] = answers
+                cache.tokens_saved += self.estimate_tokens("".join(cache.questions[i] for i in answers))
+            self.in_flight[digest] = [note_id]
+            self.note_hashes[note_id] = digest
+            cache.misses += 1
+            yield note_id, content, missing
+
+    def finish(self, note_id, result):
+        """Store Gemini's result for `note_id` and the notes waiting on the same content."""
+        digest = self.note_hashes.pop(note_id, None)
+        waiting = self.in_flight.pop(digest, [note_id])
+        known = self.partial_answers.pop(note_id, None)
+        # Only save result if it's a successful analysis (no error key)
+        if "error" in result:
+            print(f"Skipping note {note_id} due to API error: {result.get('error')}")
+            return
+        if known is not None:
+            answers = dict(known)
+            answers.update({i: result[f"q{i+1}"] for i in range(len(self.cache.questions)) if f"q{i+1}" in result})
+            result = self.assemble(answers, {k: v for k, v in result.items() if not re.fullmatch(r"q\d+", k)})
+        self.cache.put(digest, result)
+        for waiting_id in waiting:
+            self.store(waiting_id, digest, result)
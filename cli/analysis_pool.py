@@ -0,0 +1,153 @@
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+# Fallback pause when a quota error carries no usable retryDelay
+DEFAULT_RETRY_DELAY = 10.0
+
+def is_quota_error(result):
+    return result.get("status_code") == 429
+
+class AIMDController:
+    """
+    Additive-increase / multiplicative-decrease limit on concurrent Gemini calls.
+
+    A quota error (`RESOURCE_EXHAUSTED`) halves the limit and pauses new
+    calls for the server's `retryDelay`. Calls already in flight when that
+    happens belong to the same burst: their quota errors only extend the
+    pause, so one burst counts as a single quota event. `acquire` returns the
+    generation a call starts in, which `release` uses to tell bursts apart.
+    After `limit` successes in a row the limit grows by one again, up to
+    `max_concurrency`. After `max_consecutive_throttles` quota events with no
+    success in between the quota is treated as exhausted for this run.
+    """
+    def __init__(self, max_concurrency, min_concurrency=1, decrease=0.5, max_consecutive_throttles=20):
+        self.max_concurrency = max(1, max_concurrency)
+        self.min_concurrency = max(1, min(min_concurrency, self.max_concurrency))
+        self.limit = float(self.max_concurrency)
+        self.decrease = decrease
+        self.max_consecutive_throttles = max_consecutive_throttles
+        self.in_flight = 0
+        self.successes = 0
+        self.consecutive_throttles = 0
+        self.paused_until = 0.0
+        # Bumped on every quota event; calls started before it are part of the last burst
+        self.generation = 1
+        self.exhausted = False
+        self.cond = threading.Condition()
+
+    def acquire(self):
+        """Block until a call may start; returns its generation, or None once the quota is exhausted."""
+        with self.cond:
+            while True:
+                if self.exhausted:
+                    return None
+                pause = self.paused_until - time.monotonic()
+                if pause > 0:
+                    self.cond.wait(pause)
+                elif self.in_flight >= int(self.limit):
+                    self.cond.wait()
+                else:
+                    self.in_flight += 1
+                    return self.generation
+
+    def try_acquire(self):
+        """Take a slot only if one is free right now; lets a call borrow spare slots without waiting."""
+        with self.cond:
+            if self.exhausted or self.paused_until > time.monotonic() or self.in_flight >= int(self.limit):
+                return False
+            self.in_flight += 1
+            return True
+
+    def give_back(self):
+        """Return a slot taken with try_acquire; the call holding the main slot reports the outcome."""
+        with self.cond:
+            self.in_flight -= 1
+            self.cond.notify_all()
+
+    def release(self, throttled=False, retry_delay=None, generation=None):
+        with self.cond:
+            self.in_flight -= 1
+            if throttled:
+                delay = DEFAULT_RETRY_DELAY if retry_delay is None else retry_delay
+                self.paused_until = max(self.paused_until, time.monotonic() + delay)
+                self.successes = 0
+                if generation is not None and generation < self.generation:
+                    # Started before the last quota event: same burst, already accounted for
+                    self.cond.notify_all()
+                    return
+                self.generation += 1
+                self.consecutive_throttles += 1
+                self.limit = max(self.min_concurrency, self.limit * self.decrease)
+                if self.consecutive_throttles >= self.max_consecutive_throttles:
+                    self.exhausted = True
+                print(f"Gemini quota exceeded. Concurrency limit {int(self.limit)}, "
+                      f"retrying after {delay:g} seconds...")
+            else:
+                self.consecutive_throttles = 0
+                self.successes += 1
+                if self.successes >= int(self.limit) and self.limit < self.max_concurrency:
+                    self.limit = min(self.max_concurrency, self.limit + 1)
+                    self.successes = 0
+            self.cond.notify_all()
+
+def run_analysis(notes, analyze, on_result, concurrency=1, controller=None):
+    """
+    Analyze `(note_id, content)` pairs with up to `concurrency` calls in flight.
+
+    `analyze(content, controller)` returns a result dict as `call_gemini_api`
+    does; quota errors are retried after the suggested delay instead of failing
+    the note. The controller is passed so a call can borrow spare slots for
+    work of its own (see `analyze_long_note`).
+    `on_result(note_id, result)` runs in the calling thread as each note
+    finishes, in completion order; it may return more `(note_id, content)`
+    items (e.g. notes a batch reply left out), which are queued ahead of the
+    remaining notes. Returns the number of notes completed;
+    stops early (leaving the remaining notes untouched) if the quota is exhausted.
+    """
+    controller = controller or AIMDController(concurrency)
+
+    def task(content):
+        while True:
+            generation = controller.acquire()
+            if generation is None:
+                return None
+            result = None
+            try:
+                result = analyze(content, controller)
+            finally:
+                throttled = result is not None and is_quota_error(result)
+                controller.release(throttled, result.get("retry_delay") if throttled else None, generation)
+            if not throttled:
+                return result
+
+    completed = 0
+    notes = iter(notes)
+    requeued = deque()
+    pending = {}
+    pool = ThreadPoolExecutor(max_workers=max(1, concurrency))
+    try:
+        while True:
+            # Keep a bounded number of notes queued so results stream out as they finish
+            while len(pending) < 2 * max(1, concurrency) and not controller.exhausted:
+                note = requeued.popleft() if requeued else next(notes, None)
+                if note is None:
+                    break
+                note_id, content = note
+                pending[pool.submit(task, content)] = note_id
+            if not pending:
+                break
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                note_id = pending.pop(future)
+                result = future.result()
+                if result is None:
+                    continue
+                requeued.extend(on_result(note_id, result) or ())
+                completed += 1
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
+    if controller.exhausted:
+        print("Gemini API quota exhausted. Halting further analysis.")
+    return completed
@@ -0,0 +1,112 @@
+"""
+Offline stand-in for `google.genai.Client`, used when GEMINI_FAKE=1 and in tests.
+
+It implements the calls gemini_utils makes (`models.generate_content` and
+`caches.create/update/get/delete`), answers every question in the prompt with
+a placeholder, and reports token usage the way the API does, including
+`cached_content_token_count` for calls that reference a cached prefix.
+"""
+import itertools
+import json
+import re
+import threading
+import time
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+from google.genai.errors import ClientError
+
+QUESTION_KEY_RE = re.compile(r'"q(\d+)"')
+NOTE_KEY_RE = re.compile(r"^### Note (\S+)$", re.MULTILINE)
+
+# Like the API, refuse to cache prompts shorter than this
+FAKE_CACHE_MIN_TOKENS = 4096
+
+def fake_token_count(text):
+    return len(text) // 4 + 1
+
+def parse_ttl(ttl):
+    return float(str(ttl).rstrip("s"))
+
+def client_error(code, status, message):
+    error = ClientError(code, {"error": {"code": code, "status": status, "message": message}})
+    error.code = code  # also when tests replace ClientError with a plain Exception
+    return error
+
+class FakeCaches:
+    def __init__(self, clock=time.time, min_tokens=FAKE_CACHE_MIN_TOKENS):
+        self.clock = clock
+        self.min_tokens = min_tokens
+        self.entries = {}
+        self.counter = itertools.count(1)
+        self.lock = threading.Lock()
+        self.created = 0
+        self.updated = 0
+
+    def _entry(self, name):
+        entry = self.entries.get(name)
+        if entry is None or entry["expires_at"] <= self.clock():
+            self.entries.pop(name, None)
+            raise client_error(404, "NOT_FOUND", f"CachedContent not found: {name}")
+        return entry
+
+    def _view(self, name, entry):
+        expire_time = datetime.fromtimestamp(entry["expires_at"], tz=timezone.utc)
+        return SimpleNamespace(name=name, model=entry["model"], expire_time=expire_time,
+                               usage_metadata=SimpleNamespace(total_token_count=entry["tokens"]))
+
+    def create(self, model, config):
+        text = "\n".join([config.get("system_instruction") or ""] + list(config.get("contents") or []))
+        if fake_token_count(text) < self.min_tokens:
+            raise client_error(400, "INVALID_ARGUMENT",
+                               f"Cached content is too small. min_total_token_count={self.min_tokens}")
+        with self.lock:
+            name = f"cachedContents/fake-{next(self.counter)}"
+            self.entries[name] = {"model": model, "text": text, "tokens": fake_token_count(text),
+                                  "expires_at": self.clock() + parse_ttl(config.get("ttl", "3600s"))}
+            self.created += 1
+            return self._view(name, self.entries[name])
+
+    def update(self, name, config):
+        with self.lock:
+            entry = self._entry(name)
+            entry["expires_at"] = self.clock() + parse_ttl(config["ttl"])
+            self.updated += 1
+            return self._view(name, entry)
+
+    def get(self, name):
+        with self.lock:
+            return self._view(name, self._entry(name))
+
+    def delete(self, name):
+        with self.lock:
+            self.entries.pop(name, None)
+
+class FakeModels:
+    def __init__(self, caches):
+        self.caches = caches
+        self.calls = []
+
+    def generate_content(self, model, contents, config=None):
+        prompt = contents if isinstance(contents, str) else "\n".join(contents)
+        cached_text = ""
+        cached_name = (config or {}).get("cached_content")
+        if cached_name:
+            with self.caches.lock:
+                cached_text = self.caches._entry(cached_name)["text"]
+        self.calls.append({"model": model, "contents": prompt, "cached_content": cached_name})
+        full_prompt = cached_text + "\n" + prompt
+        n_questions = max((int(n) for n in QUESTION_KEY_RE.findall(full_prompt)), default=1)
+        answers = {f"q{i}": f"Fake answer {i}" for i in range(1, n_questions + 1)}
+        note_ids = NOTE_KEY_RE.findall(prompt)
+        payload = {note_id: answers for note_id in note_ids} if note_ids else answers
+        cached_tokens = fake_token_count(cached_text) if cached_text else 0
+        usage = SimpleNamespace(prompt_token_count=cached_tokens + fake_token_count(prompt),
+                                cached_content_token_count=cached_tokens,
+                                candidates_token_count=fake_token_count(json.dumps(payload)))
+        return SimpleNamespace(text=json.dumps(payload), usage_metadata=usage)
+
+class FakeGeminiClient:
+    def __init__(self, clock=time.time, cache_min_tokens=FAKE_CACHE_MIN_TOKENS):
+        self.caches = FakeCaches(clock, cache_min_tokens)
+        self.models = FakeModels(self.caches)
@@ -4,39 +4,458 @@ from google import genai
 from dotenv import load_dotenv
 from datetime import datetime
 import time
+import re
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from google.genai.errors import ClientError
 
 load_dotenv()
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 
-client = genai.Client(api_key=GEMINI_API_KEY)
+if os.getenv("GEMINI_FAKE"):
+    # Offline runs: answers are placeholders, but caching and token accounting behave like the API
+    from fake_gemini import FakeGeminiClient
+    client = FakeGeminiClient()
+else:
+    client = genai.Client(api_key=GEMINI_API_KEY)
 
 # Directory containing the questions JSON files
 QUESTIONS_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'questions'))
 
 MODEL_NAME = "gemini-2.0-flash"
 
+# Context caching: the instructions + questions prefix is stored once per
+# question set and referenced by name, so each call only sends the note.
+# Set GEMINI_CONTEXT_CACHE=0 to always send full prompts.
+CONTEXT_CACHE_ENABLED = os.getenv("GEMINI_CONTEXT_CACHE", "1") != "0"
+CONTEXT_CACHE_TTL_SECONDS = 3600
+# Extend a handle's TTL when less than this is left
+CONTEXT_CACHE_REFRESH_SECONDS = 300
+# The API refuses to cache less than this many tokens, so shorter prefixes go uncached
+CONTEXT_CACHE_MIN_TOKENS = 4096
+# After a transient caching error (quota, 5xx, network), send full prompts this long before trying again
+CONTEXT_CACHE_RETRY_SECONDS = 60
+
+# Batched prompts: note tokens packed per request, and a cap on notes per
+# request so the combined answers stay well inside the model's output limit
+BATCH_TOKEN_BUDGET = 6000
+BATCH_MAX_NOTES = 10
+
+# Notes above CHUNK_THRESHOLD_TOKENS are split into chunks of at most
+# CHUNK_TOKENS, answered per chunk (map, up to CHUNK_CONCURRENCY at a time) and merged (reduce)
+CHUNK_THRESHOLD_TOKENS = 12000
+CHUNK_TOKENS = 6000
+CHUNK_CONCURRENCY = 4
+
+class QuestionSet:
+    """
+    One parsed questions_v{N}.json, with the prompt fragments that depend only
+    on the questions (numbered list, single-note frame, cacheable prefix)
+    rendered once. The prompt builders read these instead of re-rendering.
+    """
+    def __init__(self, instructions, questions, questions_version):
+        self.instructions = instructions
+        self.questions = list(questions)
+        self.questions_version = questions_version
+        self.numbered = render_numbered_questions(self.questions)
+        self.frame = render_prompt_frame(instructions, self.numbered, len(self.questions))
+        self.prefix = render_prompt_prefix(instructions, self.numbered, len(self.questions))
+
+    def subset(self, indices):
+        """The same set asking only the questions at `indices` (0-based), renumbered from 1."""
+        return QuestionSet(self.instructions, [self.questions[i] for i in indices], self.questions_version)
+
+class QuestionRegistry:
+    """
+    In-process cache of question sets, one entry per questions_v{N}.json.
+
+    Each entry is keyed by the file's mtime and size, so edits on disk are
+    picked up on the next lookup without re-parsing unchanged files on every
+    call. Files that cannot be stat'ed are read every time.
+    """
+    def __init__(self, questions_dir=QUESTIONS_DIR):
+        self.questions_dir = questions_dir
+        self.entries = {}
+        self.lock = threading.Lock()
+
+    def path(self, version):
+        return os.path.join(self.questions_dir, f"questions_v{version}.json")
+
+    def get(self, version=None):
+        version = str(version) if version is not None else "1"
+        path = self.path(version)
+        try:
+            st = os.stat(path)
+            fingerprint = (st.st_mtime_ns, st.st_size)
+        except (OSError, TypeError, ValueError):
+            fingerprint = None
+        with self.lock:
+            cached = self.entries.get(version)
+            if fingerprint is not None and cached is not None and cached[0] == fingerprint:
+                return cached[1]
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        question_set = QuestionSet(data["instructions"], data["questions"], data.get("version", f"v{version}"))
+        if fingerprint is not None:
+            with self.lock:
+                self.entries[version] = (fingerprint, question_set)
+        return question_set
+
+    def versions(self):
+        """File versions present on disk, oldest first (e.g. ["1", "2", "4"])."""
+        try:
+            names = os.listdir(self.questions_dir)
+        except OSError:
+            return []
+        found = [m.group(1) for m in (re.fullmatch(r"questions_v(\d+)\.json", name) for name in names) if m]
+        return sorted(found, key=int)
+
+    def latest_version(self):
+        versions = self.versions()
+        return versions[-1] if versions else "1"
+
+def render_numbered_questions(questions):
+    return "\n".join([f"{i+1}. {q}" for i, q in enumerate(questions)])
+
+QUESTION_REGISTRY = QuestionRegistry()
+
 def load_questions(version=None):
-    # Determine questions file
-    if version is None:
-        version = "1"  # default
-    questions_file = os.path.join(QUESTIONS_DIR, f"questions_v{version}.json")
-    with open(questions_file, "r", encoding="utf-8") as f:
-        data = json.load(f)
-    instructions = data["instructions"]
-    questions = data["questions"]
-    questions_version = data.get("version", f"v{version}")
-    return instructions, questions, questions_version
-
-def build_prompt(note_content, instructions, questions):
-    numbered = "\n".join([f"{i+1}. {q}" for i, q in enumerate(questions)])
-    prompt = f"""
+    question_set = QUESTION_REGISTRY.get(version)
+    return question_set.instructions, question_set.questions, question_set.questions_version
+
+def latest_questions_version():
+    return QUESTION_REGISTRY.latest_version()
+
+def question_versions():
+    return QUESTION_REGISTRY.versions()
+
+def render_prompt_frame(instructions, numbered, count):
+    """Text before and after the note in `build_prompt`."""
+    head = f"""
+{instructions}
+
+Questions:\n{numbered}\n\nInput note:\n"""
+    tail = f"""\n\nOutput format:\n```json\n{{\n  \"q1\": \"Answer to question 1\",\n  ...\n  \"q{count}\": \"Answer to question {count}\"\n}}\n```
+"""
+    return head, tail
+
+def render_prompt_prefix(instructions, numbered, count):
+    return f"""
 {instructions}
 
-Questions:\n{numbered}\n\nInput note:\n{note_content}\n\nOutput format:\n```json\n{{\n  \"q1\": \"Answer to question 1\",\n  ...\n  \"q12\": \"Answer to question 12\"\n}}\n```
+Questions:\n{numbered}\n\nOutput format:\n```json\n{{\n  \"q1\": \"Answer to question 1\",\n  ...\n  \"q{count}\": \"Answer to question {count}\"\n}}\n```\n\nThe note to analyze is given in the next message.
+"""
+
+def build_prompt(note_content, question_set):
+    head, tail = question_set.frame
+    return head + note_content + tail
+
+def build_prompt_prefix(question_set):
+    """The part of `build_prompt` shared by every note; stored as cached content."""
+    return question_set.prefix
+
+def build_note_message(note_content):
+    return f"Input note:\n{note_content}"
+
+class TokenUsage:
+    """Thread-safe running totals of prompt tokens served from cached content vs sent uncached."""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.cached_tokens = 0
+        self.uncached_tokens = 0
+        self.output_tokens = 0
+
+    def add(self, response):
+        usage = getattr(response, "usage_metadata", None)
+        prompt_tokens = getattr(usage, "prompt_token_count", None)
+        if not isinstance(prompt_tokens, int):
+            return
+        cached = getattr(usage, "cached_content_token_count", None)
+        cached = cached if isinstance(cached, int) else 0
+        output = getattr(usage, "candidates_token_count", None)
+        with self.lock:
+            self.requests += 1
+            self.cached_tokens += cached
+            self.uncached_tokens += prompt_tokens - cached
+            self.output_tokens += output if isinstance(output, int) else 0
+
+    def report(self):
+        total = self.cached_tokens + self.uncached_tokens
+        share = self.cached_tokens / total if total else 0.0
+        print(f"Gemini prompt tokens: {self.uncached_tokens} uncached, {self.cached_tokens} from cached content "
+              f"({share:.0%}) over {self.requests} requests; {self.output_tokens} output tokens.")
+
+TOKEN_USAGE = TokenUsage()
+
+def is_cached_content_error(error):
+    # Expired or deleted handles come back as NOT_FOUND / PERMISSION_DENIED mentioning the cached content
+    return "cachedcontent" in str(error).lower().replace(" ", "")
+
+def is_permanent_cache_error(error):
+    # A 4xx refusal (e.g. INVALID_ARGUMENT for a prefix the model can't cache) won't change on retry
+    code = getattr(error, "code", None)
+    return isinstance(error, ClientError) and isinstance(code, int) and 400 <= code < 500 and code not in (408, 429)
+
+class ContextCache:
+    """
+    One cached-content handle per distinct prompt prefix (i.e. per question set).
+
+    Handles are created on first use with a TTL of `ttl_seconds` and extended
+    when less than `refresh_seconds` remain. Prefixes under `min_tokens` are
+    never sent for caching. If the API refuses a prefix it is remembered as
+    uncacheable; after a transient error caching is retried `retry_seconds`
+    later. Either way callers fall back to full prompts. Create and update
+    calls run outside the lock, one per prefix at a time, while other threads
+    keep using the current handle or send full prompts.
+    """
+    def __init__(self, ttl_seconds=CONTEXT_CACHE_TTL_SECONDS, refresh_seconds=CONTEXT_CACHE_REFRESH_SECONDS,
+                 min_tokens=CONTEXT_CACHE_MIN_TOKENS, retry_seconds=CONTEXT_CACHE_RETRY_SECONDS, clock=time.time):
+        self.ttl_seconds = ttl_seconds
+        self.refresh_seconds = refresh_seconds
+        self.min_tokens = min_tokens
+        self.retry_seconds = retry_seconds
+        self.clock = clock
+        # prefix hash -> (handle name, expiry), or (None, time to retry caching)
+        self.handles = {}
+        self.renewing = set()
+        self.lock = threading.Lock()
+
+    def handle(self, prefix):
+        """Name of the cached content holding `prefix`, or None to send the prompt uncached."""
+        if estimate_tokens(prefix) < self.min_tokens:
+            return None
+        key = hashlib.sha256(prefix.encode("utf-8")).hexdigest()
+        with self.lock:
+            now = self.clock()
+            name, until = self.handles.get(key, (None, 0.0))
+            if name is None and until > now:
+                return None
+            if name is not None and until - now > self.refresh_seconds:
+                return name
+            current = name if name is not None and until > now else None
+            if key in self.renewing:
+                return current
+            self.renewing.add(key)
+        try:
+            return self.renew(key, prefix, current)
+        finally:
+            with self.lock:
+                self.renewing.discard(key)
+
+    def renew(self, key, prefix, name):
+        ttl = f"{self.ttl_seconds}s"
+        if name is not None:
+            try:
+                client.caches.update(name=name, config={"ttl": ttl})
+                return self.store(key, name, self.clock() + self.ttl_seconds)
+            except Exception as e:
+                print(f"Could not refresh Gemini context cache {name} ({e}); creating a new one.")
+        try:
+            cached = client.caches.create(model=MODEL_NAME, config={
+                "display_name": f"notion-explorer-{key[:12]}",
+                "contents": [prefix],
+                "ttl": ttl,
+            })
+        except Exception as e:
+            if is_permanent_cache_error(e):
+                print(f"Gemini context caching unavailable, sending full prompts: {e}")
+                return self.store(key, None, float("inf"))
+            print(f"Gemini context caching failed, sending full prompts for {self.retry_seconds}s: {e}")
+            return self.store(key, None, self.clock() + self.retry_seconds)
+        return self.store(key, cached.name, self.clock() + self.ttl_seconds)
+
+    def store(self, key, name, until):
+        with self.lock:
+            self.handles[key] = (name, until)
+        return name
+
+    def invalidate(self, prefix):
+        key = hashlib.sha256(prefix.encode("utf-8")).hexdigest()
+        with self.lock:
+            if self.handles.get(key, (None,))[0] is not None:
+                del self.handles[key]
+
+CONTEXT_CACHE = ContextCache()
+
+def generate_for_note(note_content, question_set):
+    """Run one single-note prompt, through the cached prefix when available."""
+    handle = CONTEXT_CACHE.handle(build_prompt_prefix(question_set)) if CONTEXT_CACHE_ENABLED else None
+    if handle:
+        try:
+            response = client.models.generate_content(
+                model=MODEL_NAME,
+                contents=build_note_message(note_content),
+                config={"cached_content": handle},
+            )
+            TOKEN_USAGE.add(response)
+            return response
+        except ClientError as e:
+            if not is_cached_content_error(e):
+                raise
+            # The handle expired or was deleted server-side: drop it and send this call in full
+            CONTEXT_CACHE.invalidate(build_prompt_prefix(question_set))
+    response = client.models.generate_content(
+        model=MODEL_NAME,
+        contents=build_prompt(note_content, question_set),
+    )
+    TOKEN_USAGE.add(response)
+    return response
+
+def estimate_tokens(text):
+    # Rough count (~4 characters per token), good enough for packing batches
+    return len(text) // 4 + 1
+
+def pack_batches(notes, token_budget=BATCH_TOKEN_BUDGET, max_notes=BATCH_MAX_NOTES):
+    """
+    Greedily group `(note_id, content)` pairs into batches.
+
+    Notes are taken in order and added to the current batch until the next one
+    would exceed `token_budget` or `max_notes`. A note larger than the budget
+    becomes a batch of its own.
+    """
+    batch = []
+    batch_tokens = 0
+    for note_id, content in notes:
+        tokens = estimate_tokens(content)
+        if batch and (batch_tokens + tokens > token_budget or len(batch) >= max_notes):
+            yield batch
+            batch = []
+            batch_tokens = 0
+        batch.append((note_id, content))
+        batch_tokens += tokens
+    if batch:
+        yield batch
+
+def build_batch_prompt(notes, question_set):
+    count = len(question_set.questions)
+    note_blocks = "\n\n".join([f"### Note {note_id}\n{content}" for note_id, content in notes])
+    first_id = notes[0][0]
+    prompt = f"""
+{question_set.instructions}
+
+Answer the questions separately for each of the {len(notes)} notes below. Treat every note on its own.
+
+Questions:\n{question_set.numbered}\n\nInput notes:\n{note_blocks}\n\nOutput format: one JSON object keyed by note ID, with one entry per note:\n```json\n{{\n  \"{first_id}\": {{\"q1\": \"Answer to question 1\", ..., \"q{count}\": \"Answer to question {count}\"}},\n  ...\n}}\n```
 """
     return prompt
 
+def parse_response_json(text):
+    text = text.strip()
+    if text.startswith('```json'):
+        text = text[len('```json'):].strip()
+    if text.endswith('```'):
+        text = text[:-3].strip()
+    return json.loads(text)
+
+HEADING_RE = re.compile(r"(?m)^(?=#{1,6}\s)")
+PARAGRAPH_RE = re.compile(r"\n\s*\n")
+
+def split_into_chunks(text, max_tokens=None):
+    """
+    Split markdown into chunks of at most `max_tokens` (estimated).
+
+    Splits before headings first, then between paragraphs for sections that
+    are still too long, and only cuts inside a paragraph as a last resort.
+    Consecutive pieces are merged back together while they fit.
+    """
+    max_tokens = max_tokens or CHUNK_TOKENS
+    # Longest slice whose estimate stays within max_tokens
+    max_chars = max(1, (max_tokens - 1) * 4)
+    pieces = []
+    for section in HEADING_RE.split(text):
+        if not section.strip():
+            continue
+        if estimate_tokens(section) <= max_tokens:
+            pieces.append(section.strip("\n"))
+            continue
+        for paragraph in PARAGRAPH_RE.split(section):
+            if not paragraph.strip():
+                continue
+            if estimate_tokens(paragraph) <= max_tokens:
+                pieces.append(paragraph.strip("\n"))
+            else:
+                pieces.extend(paragraph[i:i + max_chars] for i in range(0, len(paragraph), max_chars))
+    chunks = []
+    current = []
+    current_tokens = 0
+    for piece in pieces:
+        tokens = estimate_tokens(piece)
+        if current and current_tokens + tokens > max_tokens:
+            chunks.append("\n\n".join(current))
+            current = []
+            current_tokens = 0
+        current.append(piece)
+        current_tokens += tokens
+    if current:
+        chunks.append("\n\n".join(current))
+    return chunks
+
+def build_reduce_prompt(question_set, partial_answers, n_chunks):
+    _, tail = question_set.frame
+    return f"""
+{question_set.instructions}
+
+The note was too long to analyze at once, so it was split into {n_chunks} consecutive parts and each question was answered for each part separately. Merge the partial answers into a single answer per question for the whole note: drop parts that say the question is not addressed, remove repetition, and keep the answer style the instructions ask for.
+
+Questions:\n{question_set.numbered}\n\nPartial answers (one list per question, in note order):\n```json\n{json.dumps(partial_answers, ensure_ascii=False, indent=1)}\n```""" + tail
+
+def analyze_long_note(note_content, question_set, chunk_tokens=None, controller=None):
+    """
+    Map-reduce analysis for notes too long for one request.
+
+    Each chunk is answered with the usual prompt (so it shares the cached
+    prefix), then one reduce call merges the per-chunk answers into the
+    q1..qN schema. If the reduce reply cannot be parsed, the partial answers
+    are joined per question instead. Gemini ClientErrors propagate.
+
+    With a run_analysis `controller`, chunks beyond the first only run in
+    parallel on slots borrowed from it while they are free, so a long note
+    never puts more calls in flight than the current limit allows.
+    """
+    chunks = split_into_chunks(note_content, chunk_tokens or CHUNK_TOKENS)
+
+    def map_chunk(numbered_chunk):
+        i, chunk = numbered_chunk
+        response = generate_for_note(f"[Part {i+1} of {len(chunks)} of a longer note]\n{chunk}", question_set)
+        try:
+            partial = parse_response_json(response.text)
+            return partial if isinstance(partial, dict) else {}
+        except Exception as e:
+            print(f"Could not parse answers for part {i+1} of {len(chunks)}: {e}")
+            return {}
+
+    borrowed = 0
+    if controller is None:
+        workers = min(CHUNK_CONCURRENCY, len(chunks))
+    else:
+        while 1 + borrowed < min(CHUNK_CONCURRENCY, len(chunks)) and controller.try_acquire():
+            borrowed += 1
+        workers = 1 + borrowed
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            partials = list(pool.map(map_chunk, enumerate(chunks)))
+    finally:
+        for _ in range(borrowed):
+            controller.give_back()
+    keys = [f"q{k+1}" for k in range(len(question_set.questions))]
+    partial_answers = {key: [p[key] for p in partials if p.get(key) not in (None, "")] for key in keys}
+
+    response = client.models.generate_content(
+        model=MODEL_NAME,
+        contents=build_reduce_prompt(question_set, partial_answers, len(chunks)),
+    )
+    TOKEN_USAGE.add(response)
+    try:
+        result = parse_response_json(response.text)
+        if isinstance(result, dict) and all(key in result for key in keys):
+            return result
+    except Exception:
+        pass
+    print(f"Could not parse merged answers for a {len(chunks)}-part note; joining the partial answers.")
+    return {key: "\n\n".join(str(answer) for answer in answers) for key, answers in partial_answers.items()}
+
 # Helper to parse retryDelay like '7s' or '2.5s'
 def parse_retry_delay(retry_delay_str):
     if not retry_delay_str:
@@ -51,61 +470,121 @@ def parse_retry_delay(retry_delay_str):
     except (ValueError, TypeError):
         return 10.0  # Default fallback
 
-def call_gemini_api(note_content, questions_version="1", max_attempts=10):
-    instructions, questions, version_str = load_questions(questions_version)
-    prompt = build_prompt(note_content, instructions, questions)
+def client_error_result(e, version_str):
+    """Structured error record for a Gemini ClientError (quota errors carry status_code 429)."""
+    error_message = str(e)
+    print(f"Gemini API error: {error_message}")
     
-    try:
-        response = client.models.generate_content(
-            model=MODEL_NAME,
-            contents=prompt,
-        )
-    except ClientError as e:
-        error_message = str(e)
-        print(f"Gemini API error: {error_message}")
-        
-        # Check if this is a quota/rate limit error
-        if "429" in error_message and "RESOURCE_EXHAUSTED" in error_message:
-            # Extract the retry delay suggestion if available
-            retry_delay = "unknown"
-            if hasattr(e, 'response_json') and e.response_json:
-                details = e.response_json.get('error', {}).get('details', [])
-                for detail in details:
-                    if '@type' in detail and 'RetryInfo' in detail['@type']:
-                        retry_delay = detail.get('retryDelay', 'unknown')
-            
-            # Create a structured error response
-            return {
-                "error": "API quota exceeded",
-                "message": f"Gemini API quota exceeded. Suggested retry delay: {retry_delay}",
-                "status_code": 429,
-                "questions_version": version_str,
-                "model": MODEL_NAME,
-                "date_executed": datetime.now().isoformat()
-            }
+    # Check if this is a quota/rate limit error
+    if "429" in error_message and "RESOURCE_EXHAUSTED" in error_message:
+        # Extract the retry delay suggestion if available
+        retry_delay = "unknown"
+        if hasattr(e, 'response_json') and e.response_json:
+            details = e.response_json.get('error', {}).get('details', [])
+            for detail in details:
+                if '@type' in detail and 'RetryInfo' in detail['@type']:
+                    retry_delay = detail.get('retryDelay', 'unknown')
         
-        # For other errors, return a structured error response
+        # Create a structured error response
         return {
-            "error": "API error",
-            "message": error_message,
+            "error": "API quota exceeded",
+            "message": f"Gemini API quota exceeded. Suggested retry delay: {retry_delay}",
+            "status_code": 429,
+            "retry_delay": parse_retry_delay(retry_delay if retry_delay != "unknown" else None),
             "questions_version": version_str,
             "model": MODEL_NAME,
             "date_executed": datetime.now().isoformat()
         }
     
-    # Process successful response
+    # For other errors, return a structured error response
+    return {
+        "error": "API error",
+        "message": error_message,
+        "questions_version": version_str,
+        "model": MODEL_NAME,
+        "date_executed": datetime.now().isoformat()
+    }
+
+def call_gemini_api(note_content, questions_version="1", max_attempts=10, question_indices=None, controller=None):
+    """
+    Analyze one note. With `question_indices` (0-based), only those questions
+    are asked, and the answers keep their positions in the full question list
+    (e.g. asking questions 3 and 7 returns "q3" and "q7"). `controller` is
+    the run_analysis controller long notes borrow chunk slots from.
+    """
+    question_set = QUESTION_REGISTRY.get(questions_version)
+    version_str = question_set.questions_version
+    if question_indices is not None:
+        question_set = question_set.subset(question_indices)
+    
     try:
-        text = response.text.strip()
-        if text.startswith('```json'):
-            text = text[len('```json'):].strip()
-        if text.endswith('```'):
-            text = text[:-3].strip()
-        result = json.loads(text)
-    except Exception as e:
-        result = {"error": f"Failed to parse Gemini response: {e}", "raw": response.text}
+        if estimate_tokens(note_content) > CHUNK_THRESHOLD_TOKENS:
+            result = analyze_long_note(note_content, question_set, controller=controller)
+        else:
+            response = generate_for_note(note_content, question_set)
+            # Process successful response
+            try:
+                result = parse_response_json(response.text)
+            except Exception as e:
+                result = {"error": f"Failed to parse Gemini response: {e}", "raw": response.text}
+    except ClientError as e:
+        return client_error_result(e, version_str)
+    if question_indices is not None and "error" not in result:
+        result = {f"q{i+1}": result[f"q{k+1}"] for k, i in enumerate(question_indices) if f"q{k+1}" in result}
     
     # Always include version info, model, and execution date in output
     result["questions_version"] = version_str
     result["model"] = MODEL_NAME
     result["date_executed"] = datetime.now().isoformat()
     return result
+
+def call_gemini_api_batch(notes, questions_version="1"):
+    """
+    Analyze several `(note_id, content)` pairs with a single prompt.
+
+    Returns `{note_id: result}` with the same per-note records (and metadata)
+    as `call_gemini_api`. Notes missing from the reply or with an invalid
+    answer object are left out, so the caller can queue them as single-note
+    calls under its quota control. If the batch request itself hits the quota,
+    the quota error dict is returned unchanged so the caller can retry the
+    whole batch.
+    """
+    if len(notes) == 1:
+        note_id, content = notes[0]
+        result = call_gemini_api(content, questions_version)
+        return result if result.get("status_code") == 429 else {note_id: result}
+
+    question_set = QUESTION_REGISTRY.get(questions_version)
+    version_str = question_set.questions_version
+    prompt = build_batch_prompt(notes, question_set)
+    expected_keys = {f"q{i+1}" for i in range(len(question_set.questions))}
+    answers = {}
+    try:
+        response = client.models.generate_content(
+            model=MODEL_NAME,
+            contents=prompt,
+        )
+        TOKEN_USAGE.add(response)
+        answers = parse_response_json(response.text)
+        if not isinstance(answers, dict):
+            answers = {}
+    except ClientError as e:
+        error = client_error_result(e, version_str)
+        if error.get("status_code") == 429:
+            return error
+    except Exception as e:
+        print(f"Failed to parse Gemini batch response: {e}")
+
+    results = {}
+    date_executed = datetime.now().isoformat()
+    for note_id, content in notes:
+        answer = answers.get(note_id)
+        if not (isinstance(answer, dict) and expected_keys <= set(answer)):
+            print(f"Batch answer for note {note_id} missing or invalid, retrying it on its own.")
+            continue
+        result = dict(answer)
+        result["questions_version"] = version_str
+        result["model"] = MODEL_NAME
+        result["date_executed"] = date_executed
+        results[note_id] = result
+    return results
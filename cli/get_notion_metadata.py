@@ -1,8 +1,7 @@
 import os
-import requests
 import sqlite3
-import time
 from dotenv import load_dotenv
+from notion_api import NotionClient, TokenBucket, NOTION_REQUESTS_PER_SECOND, NOTION_BURST_SIZE
 
 # Load environment variables from .env if present
 load_dotenv()
@@ -22,6 +21,12 @@ HEADERS = {
 
 DB_PATH = "notion_pages.db"
 
+NOTION_CLIENT = NotionClient(
+    NOTION_TOKEN,
+    pool_size=int(os.getenv("NOTION_POOL_SIZE", "10")),
+    rate_limiter=TokenBucket(NOTION_REQUESTS_PER_SECOND, NOTION_BURST_SIZE),
+)
+
 def init_db():
     conn = sqlite3.connect(DB_PATH)
     c = conn.cursor()
@@ -46,15 +51,7 @@ def get_page_from_db(conn, page_id):
     return c.fetchone()
 
 def request_with_rate_limit(url, headers, params=None):
-    while True:
-        resp = requests.get(url, headers=headers, params=params)
-        if resp.status_code == 429:
-            retry_after = int(resp.headers.get("Retry-After", 1))
-            print(f"Rate limited. Retrying after {retry_after} seconds...")
-            time.sleep(retry_after)
-            continue
-        resp.raise_for_status()
-        return resp
+    return NOTION_CLIENT.get(url, headers=headers, params=params)
 
 def get_child_pages_and_databases(parent_id):
     url = f"{NOTION_API_URL}/blocks/{parent_id}/children"
@@ -87,13 +84,7 @@ def get_database_rows(database_id):
     rows = []
     payload = {"page_size": 100}
     while True:
-        resp = requests.post(url, headers=HEADERS, json=payload)
-        if resp.status_code == 429:
-            retry_after = int(resp.headers.get("Retry-After", 1))
-            print(f"Rate limited (database query). Retrying after {retry_after} seconds...")
-            time.sleep(retry_after)
-            continue
-        resp.raise_for_status()
+        resp = NOTION_CLIENT.post(url, headers=HEADERS, json=payload)
         data = resp.json()
         for result in data.get("results", []):
             if result["object"] == "page":
@@ -117,7 +108,7 @@ def get_page_metadata(page_id):
 
 def is_valid_database_id(database_id):
     url = f"{NOTION_API_URL}/databases/{database_id}"
-    resp = requests.get(url, headers=HEADERS)
+    resp = NOTION_CLIENT.get(url, headers=HEADERS, raise_for_status=False)
     return resp.status_code == 200
 
 def crawl_page_tree(conn, page_id, parent_id=None, depth=0):
@@ -146,12 +137,12 @@ def crawl_page_tree(conn, page_id, parent_id=None, depth=0):
 def detect_id_type(notion_id):
     # Try database endpoint
     url_db = f"{NOTION_API_URL}/databases/{notion_id}"
-    resp_db = requests.get(url_db, headers=HEADERS)
+    resp_db = NOTION_CLIENT.get(url_db, headers=HEADERS, raise_for_status=False)
     if resp_db.status_code == 200:
         return "database"
     # Try page endpoint
     url_page = f"{NOTION_API_URL}/pages/{notion_id}"
-    resp_page = requests.get(url_page, headers=HEADERS)
+    resp_page = NOTION_CLIENT.get(url_page, headers=HEADERS, raise_for_status=False)
     if resp_page.status_code == 200:
         return "page"
     raise ValueError(f"ID {notion_id} is neither a valid page nor database ID, or you lack access.")
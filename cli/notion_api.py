@@ -0,0 +1,124 @@
+import random
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+
+NOTION_API_URL = "https://api.notion.com/v1"
+NOTION_VERSION = "2022-06-28"
+
+# Notion allows an average of ~3 requests/second per integration, with short bursts.
+NOTION_REQUESTS_PER_SECOND = 3.0
+NOTION_BURST_SIZE = 10
+
+# Responses worth retrying: rate limiting and transient server errors
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+SUPPORTED_METHODS = ("GET", "POST", "PATCH", "DELETE")
+
+class TokenBucket:
+    """
+    Thread-safe token bucket shared by every Notion call in the process.
+
+    `acquire()` blocks until a token is available, so serial and concurrent
+    crawls both stay under the same request budget.
+    """
+    def __init__(self, rate, capacity):
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                self._refill()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+class NotionClient:
+    """
+    Notion API client backed by one keep-alive `requests.Session`.
+
+    Connections are pooled (`pool_size` per host), so a crawl pays the TLS
+    handshake once per connection instead of once per call. 429 and 5xx
+    responses (and dropped connections) are retried with jittered exponential
+    backoff; a `Retry-After` header always wins over the computed delay.
+    """
+    def __init__(self, token, pool_size=10, connect_timeout=10.0, read_timeout=60.0,
+                 max_retries=8, backoff_base=1.0, backoff_max=60.0, rate_limiter=None):
+        self.session = requests.Session()
+        self.session.headers.update({
+            "Authorization": f"Bearer {token}",
+            "Notion-Version": NOTION_VERSION,
+            "Content-Type": "application/json",
+        })
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.rate_limiter = rate_limiter
+
+    def backoff_delay(self, attempt, resp=None):
+        """Seconds to wait before retry number `attempt` (0-based)."""
+        if resp is not None:
+            retry_after = resp.headers.get("Retry-After")
+            if retry_after:
+                try:
+                    return max(0.0, float(retry_after))
+                except ValueError:
+                    pass
+        delay = min(self.backoff_max, self.backoff_base * (2 ** attempt))
+        # "Equal jitter": keep at least half the delay, randomise the rest
+        return random.uniform(delay / 2, delay)
+
+    def request(self, method, url, headers=None, params=None, json=None, raise_for_status=True):
+        if method not in SUPPORTED_METHODS:
+            raise ValueError("Unsupported HTTP method")
+        attempt = 0
+        while True:
+            if self.rate_limiter is not None:
+                self.rate_limiter.acquire()
+            try:
+                resp = self.session.request(method, url, headers=headers, params=params,
+                                            json=json, timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if attempt >= self.max_retries:
+                    raise
+                delay = self.backoff_delay(attempt)
+                print(f"Notion request failed ({e}). Retrying after {delay:.1f} seconds...")
+                time.sleep(delay)
+                attempt += 1
+                continue
+            if resp.status_code in RETRY_STATUS_CODES and attempt < self.max_retries:
+                delay = self.backoff_delay(attempt, resp)
+                if resp.status_code == 429:
+                    print(f"Rate limited. Retrying after {delay:g} seconds...")
+                else:
+                    print(f"Notion returned {resp.status_code}. Retrying after {delay:.1f} seconds...")
+                time.sleep(delay)
+                attempt += 1
+                continue
+            if raise_for_status:
+                resp.raise_for_status()
+            return resp
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    def close(self):
+        self.session.close()
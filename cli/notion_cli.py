@@ -1,14 +1,22 @@
 import os
-import requests
 import sqlite3
 import time
 import argparse
 from dotenv import load_dotenv
 import csv
-import glob
 import json
-from gemini_utils import call_gemini_api, MODEL_NAME
+import hashlib
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from gemini_utils import (call_gemini_api, call_gemini_api_batch, pack_batches, estimate_tokens, TOKEN_USAGE, MODEL_NAME,
+                          QUESTION_REGISTRY, load_questions, latest_questions_version, question_versions)
+from notion_api import NotionClient, TokenBucket, NOTION_REQUESTS_PER_SECOND, NOTION_BURST_SIZE
+from analysis_pool import run_analysis
+from analysis_cache import AnalysisCache, AnalysisQueue, CACHE_SCHEMA, QUESTION_ANSWERS_SCHEMA, content_hash
 import re
+import asyncio
+import signal
+import threading
 
 # --- Setup ---
 load_dotenv()
@@ -32,36 +40,290 @@ EXPORTS_DIR = "notion_notes"
 OUTPUTS_DIR = "answers_to_questions_by_LLM"
 
 # --- Utilities ---
+# One rate limiter and one pooled client shared by every Notion call in the process
+NOTION_RATE_LIMITER = TokenBucket(NOTION_REQUESTS_PER_SECOND, NOTION_BURST_SIZE)
+NOTION_CLIENT = NotionClient(
+    NOTION_TOKEN,
+    pool_size=int(os.getenv("NOTION_POOL_SIZE", "10")),
+    connect_timeout=float(os.getenv("NOTION_CONNECT_TIMEOUT", "10")),
+    read_timeout=float(os.getenv("NOTION_READ_TIMEOUT", "60")),
+    rate_limiter=NOTION_RATE_LIMITER,
+)
+
 def request_with_rate_limit(url, headers, method="GET", json=None, params=None):
-    while True:
-        if method == "GET":
-            resp = requests.get(url, headers=headers, params=params)
-        elif method == "POST":
-            resp = requests.post(url, headers=headers, json=json)
-        else:
-            raise ValueError("Unsupported HTTP method")
-        if resp.status_code == 429:
-            retry_after = int(resp.headers.get("Retry-After", 1))
-            print(f"Rate limited. Retrying after {retry_after} seconds...")
-            time.sleep(retry_after)
-            continue
-        resp.raise_for_status()
-        return resp
+    if method == "GET":
+        return NOTION_CLIENT.get(url, headers=headers, params=params)
+    elif method == "POST":
+        return NOTION_CLIENT.post(url, headers=headers, json=json)
+    raise ValueError("Unsupported HTTP method")
 
 def detect_id_type(notion_id):
     url_db = f"{NOTION_API_URL}/databases/{notion_id}"
-    resp_db = requests.get(url_db, headers=HEADERS)
+    resp_db = NOTION_CLIENT.get(url_db, headers=HEADERS, raise_for_status=False)
     if resp_db.status_code == 200:
         return "database"
     url_page = f"{NOTION_API_URL}/pages/{notion_id}"
-    resp_page = requests.get(url_page, headers=HEADERS)
+    resp_page = NOTION_CLIENT.get(url_page, headers=HEADERS, raise_for_status=False)
     if resp_page.status_code == 200:
         return "page"
     raise ValueError(f"ID {notion_id} is neither a valid page nor database ID, or you lack access.")
 
 # --- DB Functions (for crawl_metadata) ---
+# Connection profile: WAL lets the GUI backend read while a crawl or analysis
+# run is writing; NORMAL sync is durable across application crashes in WAL mode.
+SQLITE_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA mmap_size=268435456",  # 256 MB
+    "PRAGMA cache_size=-65536",    # 64 MB (negative = KiB)
+)
+
+def add_pages_content_hash(conn):
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(pages)")]
+    if "content_hash" not in columns:
+        conn.execute("ALTER TABLE pages ADD COLUMN content_hash TEXT")
+
+# Full-text search over note content and Gemini answers (served by gui_backend's /search).
+# search_docs gives every searchable text a stable id, used as the search_index rowid;
+# triggers keep both in step with pages and gemini_analysis. Answers are indexed as the
+# text of their JSON values. INSERT OR REPLACE skips delete triggers, so the insert
+# triggers drop any previous entry first. The search_docs inserts are not INSERT OR IGNORE:
+# the firing statement's conflict policy would override it.
+SEARCH_SCHEMA = [
+    '''CREATE TABLE IF NOT EXISTS search_docs (
+        docid INTEGER PRIMARY KEY AUTOINCREMENT,
+        kind TEXT,
+        note_id TEXT,
+        questions_version TEXT,
+        model TEXT,
+        UNIQUE (kind, note_id, questions_version, model)
+    )''',
+    "CREATE VIRTUAL TABLE IF NOT EXISTS search_index USING fts5(body, tokenize = 'unicode61 remove_diacritics 2')",
+    '''CREATE TRIGGER IF NOT EXISTS pages_search_insert AFTER INSERT ON pages BEGIN
+        INSERT INTO search_docs (kind, note_id, questions_version, model)
+            SELECT 'note', new.id, '', ''
+            WHERE NOT EXISTS (SELECT 1 FROM search_docs
+                              WHERE kind = 'note' AND note_id = new.id AND questions_version = '' AND model = '');
+        DELETE FROM search_index WHERE rowid = (SELECT docid FROM search_docs
+            WHERE kind = 'note' AND note_id = new.id AND questions_version = '' AND model = '');
+        INSERT INTO search_index (rowid, body)
+            SELECT docid, new.content FROM search_docs
+            WHERE kind = 'note' AND note_id = new.id AND questions_version = '' AND model = ''
+                AND TRIM(COALESCE(new.content, '')) != '';
+    END''',
+    '''CREATE TRIGGER IF NOT EXISTS pages_search_update AFTER UPDATE OF content ON pages
+        WHEN old.content IS NOT new.content BEGIN
+        INSERT INTO search_docs (kind, note_id, questions_version, model)
+            SELECT 'note', new.id, '', ''
+            WHERE NOT EXISTS (SELECT 1 FROM search_docs
+                              WHERE kind = 'note' AND note_id = new.id AND questions_version = '' AND model = '');
+        DELETE FROM search_index WHERE rowid = (SELECT docid FROM search_docs
+            WHERE kind = 'note' AND note_id = new.id AND questions_version = '' AND model = '');
+        INSERT INTO search_index (rowid, body)
+            SELECT docid, new.content FROM search_docs
+            WHERE kind = 'note' AND note_id = new.id AND questions_version = '' AND model = ''
+                AND TRIM(COALESCE(new.content, '')) != '';
+    END''',
+    '''CREATE TRIGGER IF NOT EXISTS pages_search_delete AFTER DELETE ON pages BEGIN
+        DELETE FROM search_index WHERE rowid = (SELECT docid FROM search_docs
+            WHERE kind = 'note' AND note_id = old.id AND questions_version = '' AND model = '');
+        DELETE FROM search_docs WHERE kind = 'note' AND note_id = old.id AND questions_version = '' AND model = '';
+    END''',
+    '''CREATE TRIGGER IF NOT EXISTS answers_search_insert AFTER INSERT ON gemini_analysis BEGIN
+        INSERT INTO search_docs (kind, note_id, questions_version, model)
+            SELECT 'answers', new.note_id, new.questions_version, new.model
+            WHERE NOT EXISTS (SELECT 1 FROM search_docs WHERE kind = 'answers' AND note_id = new.note_id
+                              AND questions_version = new.questions_version AND model = new.model);
+        DELETE FROM search_index WHERE rowid = (SELECT docid FROM search_docs WHERE kind = 'answers'
+            AND note_id = new.note_id AND questions_version = new.questions_version AND model = new.model);
+        INSERT INTO search_index (rowid, body)
+            SELECT d.docid, a.body FROM search_docs d,
+                (SELECT group_concat(value, ' ') AS body
+                 FROM json_each(CASE WHEN json_valid(new.answers_json) THEN new.answers_json END)) a
+            WHERE d.kind = 'answers' AND d.note_id = new.note_id AND d.questions_version = new.questions_version
+                AND d.model = new.model AND TRIM(COALESCE(a.body, '')) != '';
+    END''',
+    '''CREATE TRIGGER IF NOT EXISTS answers_search_update AFTER UPDATE OF answers_json ON gemini_analysis BEGIN
+        INSERT INTO search_docs (kind, note_id, questions_version, model)
+            SELECT 'answers', new.note_id, new.questions_version, new.model
+            WHERE NOT EXISTS (SELECT 1 FROM search_docs WHERE kind = 'answers' AND note_id = new.note_id
+                              AND questions_version = new.questions_version AND model = new.model);
+        DELETE FROM search_index WHERE rowid = (SELECT docid FROM search_docs WHERE kind = 'answers'
+            AND note_id = new.note_id AND questions_version = new.questions_version AND model = new.model);
+        INSERT INTO search_index (rowid, body)
+            SELECT d.docid, a.body FROM search_docs d,
+                (SELECT group_concat(value, ' ') AS body
+                 FROM json_each(CASE WHEN json_valid(new.answers_json) THEN new.answers_json END)) a
+            WHERE d.kind = 'answers' AND d.note_id = new.note_id AND d.questions_version = new.questions_version
+                AND d.model = new.model AND TRIM(COALESCE(a.body, '')) != '';
+    END''',
+    '''CREATE TRIGGER IF NOT EXISTS answers_search_delete AFTER DELETE ON gemini_analysis BEGIN
+        DELETE FROM search_index WHERE rowid = (SELECT docid FROM search_docs WHERE kind = 'answers'
+            AND note_id = old.note_id AND questions_version = old.questions_version AND model = old.model);
+        DELETE FROM search_docs WHERE kind = 'answers' AND note_id = old.note_id
+            AND questions_version = old.questions_version AND model = old.model;
+    END''',
+]
+
+def create_search_index(conn):
+    try:
+        conn.execute("CREATE VIRTUAL TABLE IF NOT EXISTS fts5_probe USING fts5(x)")
+        conn.execute("DROP TABLE fts5_probe")
+    except sqlite3.OperationalError as e:
+        print(f"Warning: SQLite has no FTS5 support ({e}); full-text search is disabled.")
+        return
+    for step in SEARCH_SCHEMA:
+        conn.execute(step)
+    # Index what is already stored
+    conn.execute("""INSERT OR IGNORE INTO search_docs (kind, note_id, questions_version, model)
+                    SELECT 'note', id, '', '' FROM pages WHERE TRIM(COALESCE(content, '')) != ''""")
+    conn.execute("""INSERT OR IGNORE INTO search_docs (kind, note_id, questions_version, model)
+                    SELECT 'answers', note_id, questions_version, model FROM gemini_analysis""")
+    conn.execute("""INSERT INTO search_index (rowid, body)
+                    SELECT d.docid, p.content FROM search_docs d JOIN pages p ON p.id = d.note_id
+                    WHERE d.kind = 'note'""")
+    conn.execute("""INSERT INTO search_index (rowid, body)
+                    SELECT docid, body FROM (
+                        SELECT d.docid, (SELECT group_concat(value, ' ')
+                                         FROM json_each(CASE WHEN json_valid(g.answers_json) THEN g.answers_json END)) AS body
+                        FROM search_docs d
+                        JOIN gemini_analysis g ON g.note_id = d.note_id AND g.questions_version = d.questions_version
+                            AND g.model = d.model
+                        WHERE d.kind = 'answers')
+                    WHERE TRIM(COALESCE(body, '')) != ''""")
+
+# Closure table of the page hierarchy: one row per (ancestor, descendant) pair, including each
+# page's (id, id, 0) row, served by gui_backend's /hierarchy/... endpoints. Parents that are
+# not (yet) pages still appear as ancestors, so pages saved before their parent link up as
+# soon as it arrives. Moving a page detaches its whole subtree from the old ancestors and
+# attaches it under the new parent's; a parent inside the page's own subtree is ignored.
+CLOSURE_SELF_ROW = ("INSERT INTO page_closure (ancestor, descendant, depth) SELECT new.id, new.id, 0 "
+                    "WHERE NOT EXISTS (SELECT 1 FROM page_closure WHERE ancestor = new.id AND descendant = new.id)")
+CLOSURE_DETACH = ("DELETE FROM page_closure "
+                  "WHERE descendant IN (SELECT descendant FROM page_closure WHERE ancestor = {row}.id) "
+                  "AND ancestor NOT IN (SELECT descendant FROM page_closure WHERE ancestor = {row}.id)")
+CLOSURE_ATTACH = (
+    "INSERT INTO page_closure (ancestor, descendant, depth) "
+    "SELECT a.ancestor, d.descendant, a.depth + d.depth + 1 "
+    "FROM (SELECT ancestor, depth FROM page_closure WHERE descendant = new.parent_id "
+    "      UNION SELECT new.parent_id, 0) a, "
+    "     (SELECT descendant, depth FROM page_closure WHERE ancestor = new.id) d "
+    "WHERE new.parent_id IS NOT NULL "
+    "AND NOT EXISTS (SELECT 1 FROM page_closure WHERE ancestor = new.id AND descendant = new.parent_id)")
+
+def trigger_sql(name, event, steps, when=None):
+    when = f" WHEN {when}" if when else ""
+    return f"CREATE TRIGGER IF NOT EXISTS {name} {event}{when} BEGIN {'; '.join(steps)}; END"
+
+HIERARCHY_SCHEMA = [
+    '''CREATE TABLE IF NOT EXISTS page_closure (
+        ancestor TEXT,
+        descendant TEXT,
+        depth INTEGER,
+        PRIMARY KEY (ancestor, descendant)
+    )''',
+    "CREATE INDEX IF NOT EXISTS idx_page_closure_descendant ON page_closure(descendant, depth)",
+    "CREATE INDEX IF NOT EXISTS idx_page_closure_ancestor_depth ON page_closure(ancestor, depth)",
+    trigger_sql("pages_closure_insert", "AFTER INSERT ON pages",
+                [CLOSURE_SELF_ROW, CLOSURE_DETACH.format(row="new"), CLOSURE_ATTACH]),
+    trigger_sql("pages_closure_update", "AFTER UPDATE OF parent_id ON pages",
+                [CLOSURE_DETACH.format(row="new"), CLOSURE_ATTACH], when="old.parent_id IS NOT new.parent_id"),
+    # A deleted page stays an ancestor of its children, but no longer links them to its own ancestors
+    trigger_sql("pages_closure_delete", "AFTER DELETE ON pages",
+                [CLOSURE_DETACH.format(row="old"), "DELETE FROM page_closure WHERE ancestor = old.id AND descendant = old.id"]),
+    # Backfill from the stored parent links (depth cap guards against cycles)
+    '''INSERT OR IGNORE INTO page_closure (ancestor, descendant, depth)
+        WITH RECURSIVE chain(ancestor, descendant, depth) AS (
+            SELECT id, id, 0 FROM pages
+            UNION ALL
+            SELECT p.parent_id, chain.descendant, chain.depth + 1
+            FROM chain JOIN pages p ON p.id = chain.ancestor
+            WHERE p.parent_id IS NOT NULL AND chain.depth < 1000
+        )
+        SELECT ancestor, descendant, MIN(depth) FROM chain GROUP BY ancestor, descendant''',
+]
+
+# Versioned schema upgrades, applied in order by migrate_db. PRAGMA user_version
+# records the last one applied. Steps are SQL strings or callables taking the connection.
+SCHEMA_MIGRATIONS = [
+    (1, [
+        "CREATE INDEX IF NOT EXISTS idx_pages_parent_id ON pages(parent_id)",
+        "CREATE INDEX IF NOT EXISTS idx_pages_last_edited_time ON pages(last_edited_time)",
+        "CREATE INDEX IF NOT EXISTS idx_pages_created_time ON pages(created_time)",
+        # gemini_analysis(note_id) lookups are already served by the
+        # (note_id, questions_version, model) primary key index.
+    ]),
+    (2, [
+        # One row per exported markdown file, so unchanged files are skipped without reading them.
+        # `path` is "<resolved export directory or .zip>!/<path inside it>" (see export_manifest_prefix).
+        '''CREATE TABLE IF NOT EXISTS export_manifest (
+            path TEXT PRIMARY KEY,
+            size INTEGER,
+            mtime_ns INTEGER,
+            content_hash TEXT,
+            note_id TEXT
+        )''',
+    ]),
+    # Gemini results keyed by content hash, and what each note was last analyzed from
+    (3, CACHE_SCHEMA),
+    # Answers per question text, carried forward to question versions that keep the question
+    (4, QUESTION_ANSWERS_SCHEMA),
+    (5, [
+        # One row per Gemini output file already loaded by load_outputs
+        '''CREATE TABLE IF NOT EXISTS output_ledger (
+            filename TEXT PRIMARY KEY,
+            size INTEGER,
+            mtime_ns INTEGER
+        )''',
+    ]),
+    (6, [
+        # Normalized content hash (analysis_cache.content_hash), filled in by analyze_notes
+        # and cleared whenever the content changes, so finished notes are skipped in SQL
+        add_pages_content_hash,
+        '''CREATE TRIGGER IF NOT EXISTS pages_content_hash_reset AFTER UPDATE OF content ON pages
+            WHEN old.content IS NOT new.content
+            BEGIN UPDATE pages SET content_hash = NULL WHERE id = new.id; END''',
+        "CREATE INDEX IF NOT EXISTS idx_pages_content_length ON pages(content_length)",
+    ]),
+    (7, [
+        # Keyset pagination order of the GUI's /notes endpoint
+        "CREATE INDEX IF NOT EXISTS idx_pages_edited_id ON pages(COALESCE(last_edited_time, ''), id)",
+    ]),
+    # Full-text search over note content and answers, backfilled from existing rows
+    (8, [create_search_index]),
+    # Materialized page hierarchy for subtree, ancestor and child queries
+    (9, HIERARCHY_SCHEMA),
+    (10, [
+        # /notes sorts 'NA' timestamps (failed metadata fetches) with the undated notes
+        "DROP INDEX IF EXISTS idx_pages_edited_id",
+        """CREATE INDEX idx_pages_edited_id ON pages(
+            (CASE WHEN last_edited_time GLOB '[0-9][0-9][0-9][0-9]-*' THEN last_edited_time ELSE '' END), id)""",
+    ]),
+]
+
+def apply_sqlite_profile(conn):
+    for pragma in SQLITE_PRAGMAS:
+        conn.execute(pragma)
+
+def migrate_db(conn):
+    c = conn.cursor()
+    c.execute("PRAGMA user_version")
+    current = c.fetchone()[0]
+    for version, steps in SCHEMA_MIGRATIONS:
+        if version <= current:
+            continue
+        print(f"Upgrading database schema to version {version}...")
+        for step in steps:
+            if callable(step):
+                step(conn)
+            else:
+                c.execute(step)
+        c.execute(f"PRAGMA user_version = {version}")
+        conn.commit()
+
 def init_db():
     conn = sqlite3.connect(DB_PATH)
+    apply_sqlite_profile(conn)
     c = conn.cursor()
     # Add content column if it doesn't exist
     c.execute('''CREATE TABLE IF NOT EXISTS pages (
@@ -111,6 +373,30 @@ def init_db():
         head_content TEXT
     )''')
     
+    # Page-vs-database resolution cache for Notion IDs
+    c.execute('''CREATE TABLE IF NOT EXISTS id_types (
+        id TEXT PRIMARY KEY,
+        type TEXT
+    )''')
+    
+    # Persistent crawl frontier (see crawl_metadata)
+    c.execute('''CREATE TABLE IF NOT EXISTS crawl_frontier (
+        seq INTEGER PRIMARY KEY AUTOINCREMENT,
+        id TEXT UNIQUE,
+        parent_id TEXT,
+        kind TEXT,
+        state TEXT,
+        updated_at TEXT
+    )''')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_crawl_frontier_state ON crawl_frontier(state, seq)')
+    
+    # High-water marks (newest last_edited_time seen) for incremental `sync` runs
+    c.execute('''CREATE TABLE IF NOT EXISTS sync_watermarks (
+        scope TEXT PRIMARY KEY,
+        last_edited_time TEXT,
+        synced_at TEXT
+    )''')
+    
     # Add questions table for storing UI questions
     c.execute('''CREATE TABLE IF NOT EXISTS questions (
         version TEXT PRIMARY KEY,
@@ -119,40 +405,35 @@ def init_db():
     )''')
     
     conn.commit()
+    migrate_db(conn)
     return conn
 
-def save_page_to_db(conn, page_id, parent_id, created_time, last_edited_time, content=None):
-    c = conn.cursor()
-    # Check if page already exists
-    c.execute('SELECT * FROM pages WHERE id = ?', (page_id,))
-    existing = c.fetchone()
-    
+# Insert-or-update in one statement. A NULL `content` leaves the stored content
+# (and its length) alone, matching a metadata-only update.
+PAGE_UPSERT_SQL = '''INSERT INTO pages (id, parent_id, created_time, last_edited_time, content, content_length)
+    VALUES (?, ?, ?, ?, ?, ?)
+    ON CONFLICT(id) DO UPDATE SET
+        parent_id = excluded.parent_id,
+        created_time = excluded.created_time,
+        last_edited_time = excluded.last_edited_time,
+        content = COALESCE(excluded.content, pages.content),
+        content_length = CASE WHEN excluded.content IS NULL THEN pages.content_length
+                              ELSE excluded.content_length END'''
+ANALYSIS_UPSERT_SQL = '''INSERT OR REPLACE INTO gemini_analysis (note_id, questions_version, model, date_executed, answers_json)
+    VALUES (?, ?, ?, ?, ?)'''
+# Keys of a Gemini result that describe the run rather than answer a question
+ANALYSIS_METADATA_KEYS = ("questions_version", "model", "date_executed")
+CRAWL_ERROR_INSERT_SQL = '''INSERT INTO crawl_errors (id, parent_id, error_message, head_title, head_content)
+    VALUES (?, ?, ?, ?, ?)'''
+
+def page_row(page_id, parent_id, created_time, last_edited_time, content=None):
     # Calculate content length if content is provided
     content_length = len(content) if content else None
-    
-    if existing:
-        # Update existing page
-        if content is not None:
-            c.execute('''UPDATE pages SET
-                        parent_id = ?,
-                        created_time = ?,
-                        last_edited_time = ?,
-                        content = ?,
-                        content_length = ?
-                     WHERE id = ?''',
-                     (parent_id, created_time, last_edited_time, content, content_length, page_id))
-        else:
-            c.execute('''UPDATE pages SET
-                        parent_id = ?,
-                        created_time = ?,
-                        last_edited_time = ?
-                     WHERE id = ?''',
-                     (parent_id, created_time, last_edited_time, page_id))
-    else:
-        # Insert new page
-        c.execute('''INSERT INTO pages (id, parent_id, created_time, last_edited_time, content, content_length)
-                   VALUES (?, ?, ?, ?, ?, ?)''',
-                  (page_id, parent_id, created_time, last_edited_time, content, content_length))
+    return (page_id, parent_id, created_time, last_edited_time, content, content_length)
+
+def save_page_to_db(conn, page_id, parent_id, created_time, last_edited_time, content=None):
+    c = conn.cursor()
+    c.execute(PAGE_UPSERT_SQL, page_row(page_id, parent_id, created_time, last_edited_time, content))
     conn.commit()
 
 def get_page_from_db(conn, page_id):
@@ -162,13 +443,214 @@ def get_page_from_db(conn, page_id):
 
 def save_crawl_error(conn, id, parent_id, error_message, head_title, head_content):
     c = conn.cursor()
-    c.execute('''INSERT INTO crawl_errors (id, parent_id, error_message, head_title, head_content)
-                 VALUES (?, ?, ?, ?, ?)''', (id, parent_id, error_message, head_title, head_content))
+    c.execute(CRAWL_ERROR_INSERT_SQL, (id, parent_id, error_message, head_title, head_content))
     conn.commit()
 
+class WriteBuffer:
+    """
+    Batches page upserts, crawl errors and analysis rows for one connection.
+
+    Rows are written with `executemany` and committed every `max_rows` rows or
+    `max_seconds` seconds, instead of one commit (and fsync) per row. Anything
+    else executed on the same connection in between (e.g. crawl frontier
+    updates) lands in the same transaction. Reading a page that is still
+    buffered writes the pending rows first, so callers always see their own
+    writes.
+
+    Use it as a context manager: the buffer is flushed on normal exit, on
+    exceptions (including Ctrl-C) and on SIGTERM.
+    """
+    def __init__(self, conn, max_rows=500, max_seconds=5.0):
+        self.conn = conn
+        self.max_rows = max_rows
+        self.max_seconds = max_seconds
+        self.pages = []
+        self.errors = []
+        self.analyses = []
+        self.pending_ids = set()
+        self.unflushed = 0
+        self.last_commit = time.monotonic()
+        self._previous_sigterm = None
+
+    def save_page(self, page_id, parent_id, created_time, last_edited_time, content=None):
+        self.pages.append(page_row(page_id, parent_id, created_time, last_edited_time, content))
+        self.pending_ids.add(page_id)
+        self.unflushed += 1
+        self.maybe_flush()
+
+    def save_crawl_error(self, id, parent_id, error_message, head_title, head_content):
+        self.errors.append((id, parent_id, error_message, head_title, head_content))
+        self.unflushed += 1
+        self.maybe_flush()
+
+    def save_analysis(self, note_id, questions_version, model, date_executed, answers_json):
+        self.analyses.append((note_id, questions_version, model, date_executed, answers_json))
+        self.unflushed += 1
+        self.maybe_flush()
+
+    def get_page(self, page_id):
+        if page_id in self.pending_ids:
+            self.write()
+        return get_page_from_db(self.conn, page_id)
+
+    def write(self):
+        """Execute buffered rows on the connection without committing."""
+        c = self.conn.cursor()
+        if self.pages:
+            c.executemany(PAGE_UPSERT_SQL, self.pages)
+            self.pages = []
+            self.pending_ids.clear()
+        if self.errors:
+            c.executemany(CRAWL_ERROR_INSERT_SQL, self.errors)
+            self.errors = []
+        if self.analyses:
+            c.executemany(ANALYSIS_UPSERT_SQL, self.analyses)
+            self.analyses = []
+
+    def flush(self):
+        self.write()
+        self.conn.commit()
+        self.unflushed = 0
+        self.last_commit = time.monotonic()
+
+    def maybe_flush(self):
+        if self.unflushed >= self.max_rows or time.monotonic() - self.last_commit >= self.max_seconds:
+            self.flush()
+
+    def __enter__(self):
+        # Turn SIGTERM into SystemExit so __exit__ still flushes (main thread only)
+        if threading.current_thread() is threading.main_thread():
+            def terminate(signum, frame):
+                raise SystemExit(128 + signum)
+            self._previous_sigterm = signal.signal(signal.SIGTERM, terminate)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            self.flush()
+        finally:
+            if self._previous_sigterm is not None:
+                signal.signal(signal.SIGTERM, self._previous_sigterm)
+                self._previous_sigterm = None
+        return False
+
+class AnalysisSink:
+    """
+    Stores Gemini results for one questions version and model.
+
+    Rows go straight into `gemini_analysis` through a WriteBuffer, so they are
+    committed in batches and visible to the GUI while a run is in progress.
+    With `mirror_dir` set, each result is also written as
+    `gemini_{id}_v{version}_{model}.json`, the layout `load_outputs` reads;
+    `find` also looks for such files from older runs in `outputs_dir`.
+    """
+    def __init__(self, writer, questions_version, model, mirror_dir=None, outputs_dir=None):
+        self.writer = writer
+        self.questions_version = str(questions_version)
+        self.model = model
+        self.mirror_dir = mirror_dir
+        self.outputs_dir = outputs_dir
+        self.saved = 0
+        if mirror_dir:
+            os.makedirs(mirror_dir, exist_ok=True)
+
+    def save(self, note_id, result):
+        answers = {k: v for k, v in result.items() if k not in ANALYSIS_METADATA_KEYS}
+        self.writer.save_analysis(note_id, f"v{self.questions_version}", self.model,
+                                  result.get("date_executed"), json.dumps(answers, ensure_ascii=False))
+        self.saved += 1
+        if self.mirror_dir:
+            path = os.path.join(self.mirror_dir, f"gemini_{note_id}_v{self.questions_version}_{self.model}.json")
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump(result, f, ensure_ascii=False, indent=2)
+
+    def stored(self, note_id, questions_version=None):
+        """The stored result for `note_id` (default: this sink's version) as a result dict, or None."""
+        label = f"v{questions_version or self.questions_version}"
+        row = next(((date_executed, answers_json) for row_id, row_label, model, date_executed, answers_json
+                    in reversed(self.writer.analyses)
+                    if (row_id, row_label, model) == (note_id, label, self.model)), None)
+        if row is None:
+            c = self.writer.conn.cursor()
+            c.execute('''SELECT date_executed, answers_json FROM gemini_analysis
+                         WHERE note_id = ? AND questions_version = ? AND model = ?''',
+                      (note_id, label, self.model))
+            row = c.fetchone()
+        if row is None:
+            return None
+        try:
+            result = json.loads(row[1])
+        except (TypeError, ValueError):
+            return None
+        result.update({"questions_version": label, "model": self.model, "date_executed": row[0]})
+        return result
+
+    def find(self, note_id, questions_version=None):
+        """Like `stored`, falling back to the JSON file an older run left in `outputs_dir`."""
+        existing = self.stored(note_id, questions_version)
+        if existing is not None or not self.outputs_dir:
+            return existing
+        version = questions_version or self.questions_version
+        output_path = os.path.join(self.outputs_dir, f"gemini_{note_id}_v{version}_{self.model}.json")
+        if not os.path.exists(output_path):
+            return None
+        try:
+            with open(output_path, "r", encoding="utf-8") as f:
+                existing = json.load(f)
+        except Exception:
+            return None
+        if (str(existing.get("questions_version")) == f"v{version}" and
+            existing.get("model") == self.model):
+            return existing
+        return None
+
+# Requests the old probe-then-fetch get_page_metadata spent per node type
+LEGACY_METADATA_REQUESTS = {"database": 2, "page": 3}
+
+class IdTypeCache:
+    """
+    Remembers whether a Notion ID is a page or a database.
+
+    Filled from block-children listings (which already say `child_page` or
+    `child_database`) and from database queries, so metadata can be fetched with
+    one request instead of probing. Entries are kept in memory and persisted in
+    the `id_types` table for later runs. `requests_saved` counts the requests
+    avoided compared to probing every node.
+    """
+    def __init__(self, conn):
+        self.conn = conn
+        self.types = {}
+        self.requests_saved = 0
+
+    def get(self, notion_id):
+        if notion_id in self.types:
+            return self.types[notion_id]
+        c = self.conn.cursor()
+        c.execute('SELECT type FROM id_types WHERE id=?', (notion_id,))
+        row = c.fetchone()
+        if row:
+            self.types[notion_id] = row[0]
+            return row[0]
+        return None
+
+    def remember(self, notion_ids, id_type, commit=True):
+        new = [(notion_id, id_type) for notion_id in notion_ids if self.types.get(notion_id) != id_type]
+        if not new:
+            return
+        for notion_id, _ in new:
+            self.types[notion_id] = id_type
+        c = self.conn.cursor()
+        c.executemany('INSERT OR REPLACE INTO id_types (id, type) VALUES (?, ?)', new)
+        if commit:
+            self.conn.commit()
+
+    def record_metadata_fetch(self, meta, commit=True):
+        self.remember([meta["id"]], meta["type"], commit=commit)
+        self.requests_saved += LEGACY_METADATA_REQUESTS[meta["type"]] - meta["requests"]
+
 def is_valid_database_id(database_id):
     url = f"{NOTION_API_URL}/databases/{database_id}"
-    resp = requests.get(url, headers=HEADERS)
+    resp = NOTION_CLIENT.get(url, headers=HEADERS, raise_for_status=False)
     return resp.status_code == 200
 
 def get_child_pages_and_databases(parent_id):
@@ -214,90 +696,432 @@ def get_database_rows(database_id):
             break
     return rows
 
-def get_page_metadata(page_id):
-    id_type = detect_id_type(page_id)
-    if id_type == "database":
-        url = f"{NOTION_API_URL}/databases/{page_id}"
+def get_page_metadata(page_id, id_type=None):
+    """
+    Fetch created/last-edited times of a page or database.
+
+    With a known `id_type` this is exactly one request. Otherwise the page
+    endpoint is tried first (crawl seeds come from exported notes, which are
+    nearly always pages) and its response reused, falling back to the
+    database endpoint, so no separate type probe is ever made.
+    """
+    if id_type is not None:
+        url = f"{NOTION_API_URL}/{'databases' if id_type == 'database' else 'pages'}/{page_id}"
+        resp = request_with_rate_limit(url, HEADERS)
+        requests_made = 1
     else:
-        url = f"{NOTION_API_URL}/pages/{page_id}"
-    resp = request_with_rate_limit(url, HEADERS)
+        resp = NOTION_CLIENT.get(f"{NOTION_API_URL}/pages/{page_id}", headers=HEADERS, raise_for_status=False)
+        requests_made = 1
+        id_type = "page"
+        if resp.status_code != 200:
+            resp = NOTION_CLIENT.get(f"{NOTION_API_URL}/databases/{page_id}", headers=HEADERS, raise_for_status=False)
+            requests_made = 2
+            id_type = "database"
+            if resp.status_code != 200:
+                raise ValueError(f"ID {page_id} is neither a valid page nor database ID, or you lack access.")
     data = resp.json()
     return {
         "id": page_id,
         "created_time": data.get("created_time"),
         "last_edited_time": data.get("last_edited_time"),
+        "type": id_type,
+        "requests": requests_made,
     }
 
-def crawl_metadata(conn, page_id, parent_id=None, depth=0, resume_incomplete=False):
+def already_crawled(writer, node_id, parent_id):
+    """True if `node_id` is already stored in the DB under `parent_id`."""
+    db_node = writer.get_page(node_id)
+    return db_node is not None and db_node[1] == parent_id
+
+def get_database_head(database_id):
+    """Best-effort (title, first row) of a database, used to annotate crawl errors."""
     try:
-        meta = get_page_metadata(page_id)
+        title = get_database_title(database_id)
+    except Exception:
+        title = "NA"
+    try:
+        first_row = get_first_db_row(database_id)
+    except Exception:
+        first_row = "NA"
+    return title, first_row
+
+def record_database_error(writer, database_id, parent_id, error_message, head):
+    title, first_row = head
+    writer.save_page(database_id, parent_id, "NA", "NA")
+    writer.save_crawl_error(database_id, parent_id, error_message, str(title), str(first_row))
+
+# --- Search-API discovery ---
+def normalize_notion_id(notion_id):
+    """Exports use 32-hex IDs, the API returns dashed UUIDs; compare them without dashes."""
+    return notion_id.replace("-", "").lower()
+
+def search_workspace(page_size=100, sort=None):
+    """Yield every page and database shared with the integration, `page_size` per request."""
+    url = f"{NOTION_API_URL}/search"
+    payload = {"page_size": page_size}
+    if sort:
+        payload["sort"] = sort
+    while True:
+        resp = request_with_rate_limit(url, HEADERS, method="POST", json=payload)
+        data = resp.json()
+        for result in data.get("results", []):
+            yield result
+        next_cursor = data.get("next_cursor")
+        if data.get("has_more", True) and next_cursor:
+            payload["start_cursor"] = next_cursor
+        else:
+            break
+
+def get_parent_id(notion_object):
+    """Parent page/database/block ID from an API object's `parent` field (None for the workspace)."""
+    parent = notion_object.get("parent") or {}
+    parent_type = parent.get("type")
+    if parent_type in ("page_id", "database_id", "block_id"):
+        return parent.get(parent_type)
+    return None
+
+def id_canonicalizer(conn):
+    """
+    Return a function mapping API IDs onto the spelling already stored in `pages`,
+    so undashed IDs from markdown exports are updated rather than duplicated.
+    """
+    c = conn.cursor()
+    c.execute('SELECT id FROM pages')
+    known_ids = {normalize_notion_id(row[0]): row[0] for row in c.fetchall()}
+    def canonical(notion_id):
+        if notion_id is None:
+            return None
+        return known_ids.setdefault(normalize_notion_id(notion_id), notion_id)
+    return canonical
+
+def discover_via_search(conn, id_cache=None):
+    """
+    Fill `pages` from the /search endpoint instead of walking block children.
+
+    Each result already carries its timestamps and `parent`, so the whole
+    workspace costs about N/100 requests. IDs that already exist in the DB
+    (e.g. undashed IDs from markdown exports) keep their stored spelling.
+    """
+    if id_cache is None:
+        id_cache = IdTypeCache(conn)
+    canonical = id_canonicalizer(conn)
+    discovered = {"page": [], "database": []}
+    with WriteBuffer(conn) as writer:
+        for result in search_workspace():
+            object_type = result.get("object")
+            if object_type not in discovered:
+                continue
+            page_id = canonical(result["id"])
+            writer.save_page(page_id, canonical(get_parent_id(result)),
+                             result.get("created_time"), result.get("last_edited_time"))
+            discovered[object_type].append(page_id)
+        for object_type, ids in discovered.items():
+            id_cache.remember(ids, object_type, commit=False)
+    print(f"Discovered {len(discovered['page'])} pages and {len(discovered['database'])} databases via search.")
+    return len(discovered["page"]) + len(discovered["database"])
+
+# --- Incremental sync ---
+SEARCH_SCOPE = "search"
+LAST_EDITED_DESC = {"timestamp": "last_edited_time", "direction": "descending"}
+
+def get_watermark(conn, scope):
+    c = conn.cursor()
+    c.execute('SELECT last_edited_time FROM sync_watermarks WHERE scope=?', (scope,))
+    row = c.fetchone()
+    return row[0] if row else None
+
+def set_watermark(conn, scope, last_edited_time):
+    from datetime import datetime
+    c = conn.cursor()
+    c.execute('''INSERT OR REPLACE INTO sync_watermarks (scope, last_edited_time, synced_at)
+                 VALUES (?, ?, ?)''', (scope, last_edited_time, datetime.now().isoformat()))
+    conn.commit()
+
+def query_database_since(database_id, since=None):
+    """Yield rows of a database edited on/after `since` (all rows if None), newest first."""
+    url = f"{NOTION_API_URL}/databases/{database_id}/query"
+    payload = {"page_size": 100, "sorts": [LAST_EDITED_DESC]}
+    if since:
+        payload["filter"] = {"timestamp": "last_edited_time", "last_edited_time": {"on_or_after": since}}
+    while True:
+        resp = request_with_rate_limit(url, HEADERS, method="POST", json=payload)
+        data = resp.json()
+        for result in data.get("results", []):
+            if result["object"] == "page":
+                yield result
+        next_cursor = data.get("next_cursor")
+        if next_cursor:
+            payload["start_cursor"] = next_cursor
+        else:
+            break
+
+def sync_metadata():
+    """
+    Fetch only what changed since the previous sync and update `pages` in place.
+
+    Search results are read newest-first and paging stops at the stored
+    high-water mark; every known database is queried with an
+    `on_or_after` filter on its own mark. Timestamps are compared as Notion's
+    ISO strings; objects edited in the same minute as the mark are re-read
+    rather than missed.
+    """
+    conn = init_db()
+    id_cache = IdTypeCache(conn)
+    canonical = id_canonicalizer(conn)
+    updated = 0
+
+    with WriteBuffer(conn) as writer:
+        watermark = get_watermark(conn, SEARCH_SCOPE)
+        newest = watermark
+        discovered = {"page": [], "database": []}
+        for result in search_workspace(sort=LAST_EDITED_DESC):
+            edited = result.get("last_edited_time")
+            if watermark and edited and edited < watermark:
+                break
+            object_type = result.get("object")
+            if object_type not in discovered:
+                continue
+            page_id = canonical(result["id"])
+            writer.save_page(page_id, canonical(get_parent_id(result)), result.get("created_time"), edited)
+            discovered[object_type].append(page_id)
+            updated += 1
+            if edited and (newest is None or edited > newest):
+                newest = edited
+        for object_type, ids in discovered.items():
+            id_cache.remember(ids, object_type, commit=False)
+        # The watermark only moves once the rows it covers are committed
+        writer.flush()
+        if newest:
+            set_watermark(conn, SEARCH_SCOPE, newest)
+
+        c = conn.cursor()
+        c.execute("SELECT id FROM id_types WHERE type='database'")
+        for (database_id,) in c.fetchall():
+            scope = f"database:{database_id}"
+            watermark = get_watermark(conn, scope)
+            newest = watermark
+            row_ids = []
+            try:
+                for row in query_database_since(database_id, watermark):
+                    edited = row.get("last_edited_time")
+                    row_id = canonical(row["id"])
+                    writer.save_page(row_id, canonical(database_id), row.get("created_time"), edited)
+                    row_ids.append(row_id)
+                    if edited and (newest is None or edited > newest):
+                        newest = edited
+            except Exception as e:
+                print(f"Error syncing database {database_id}: {e}. Skipping.")
+                continue
+            id_cache.remember(row_ids, "page", commit=False)
+            updated += len(row_ids)
+            writer.flush()
+            if newest:
+                set_watermark(conn, scope, newest)
+    print(f"Sync complete: {updated} pages updated.")
+    return updated
+
+# --- Crawl frontier ---
+# Pending crawl work lives in the `crawl_frontier` table rather than on the call
+# stack: each node is pending -> in_progress -> done | error. A crash, Ctrl-C or
+# quota stop leaves the table behind, and the next run continues from it without
+# re-requesting completed nodes. Finished crawls clear the table.
+FRONTIER_STATES = ("pending", "in_progress", "done", "error")
+PROGRESS_INTERVAL_SECONDS = 10
+
+def _frontier_now():
+    from datetime import datetime
+    return datetime.now().isoformat()
+
+def frontier_seed(conn, items):
+    """(Re)queue (kind, id, parent_id) items as pending, even if seen before."""
+    c = conn.cursor()
+    now = _frontier_now()
+    c.executemany('''INSERT INTO crawl_frontier (id, parent_id, kind, state, updated_at)
+                     VALUES (?, ?, ?, 'pending', ?)
+                     ON CONFLICT(id) DO UPDATE SET parent_id = excluded.parent_id,
+                                                   kind = excluded.kind,
+                                                   state = 'pending',
+                                                   updated_at = excluded.updated_at''',
+                  [(node_id, parent_id, kind, now) for kind, node_id, parent_id in items])
+    conn.commit()
+
+def frontier_add(conn, items):
+    """Add discovered children; returns only the items that were not already in the frontier."""
+    c = conn.cursor()
+    now = _frontier_now()
+    added = []
+    for kind, node_id, parent_id in items:
+        c.execute('''INSERT OR IGNORE INTO crawl_frontier (id, parent_id, kind, state, updated_at)
+                     VALUES (?, ?, ?, 'pending', ?)''', (node_id, parent_id, kind, now))
+        if c.rowcount:
+            added.append((kind, node_id, parent_id))
+    return added
+
+def frontier_set_state(conn, node_id, state):
+    c = conn.cursor()
+    c.execute('UPDATE crawl_frontier SET state = ?, updated_at = ? WHERE id = ?', (state, _frontier_now(), node_id))
+
+def frontier_pending(conn):
+    """Pending items in discovery order; anything left in_progress by a crash is requeued first."""
+    c = conn.cursor()
+    c.execute("UPDATE crawl_frontier SET state = 'pending' WHERE state = 'in_progress'")
+    conn.commit()
+    c.execute("SELECT kind, id, parent_id FROM crawl_frontier WHERE state = 'pending' ORDER BY seq")
+    return c.fetchall()
+
+def frontier_counts(conn):
+    c = conn.cursor()
+    c.execute('SELECT state, COUNT(*) FROM crawl_frontier GROUP BY state')
+    counts = dict.fromkeys(FRONTIER_STATES, 0)
+    counts.update(c.fetchall())
+    return counts
+
+def frontier_clear(conn):
+    c = conn.cursor()
+    c.execute('DELETE FROM crawl_frontier')
+    conn.commit()
+
+# --- Crawl engine ---
+# Workers pull (kind, id, parent_id) items from a queue fed by the frontier table.
+# Notion calls run in worker threads (all throttled by NOTION_RATE_LIMITER); every
+# SQLite read and write stays on the event loop thread, so the connection is never
+# shared across threads. With one worker this is the plain serial crawl.
+async def _crawl_page_async(writer, page_id, parent_id, resume_incomplete, id_cache):
+    try:
+        meta = await asyncio.to_thread(get_page_metadata, page_id, id_cache.get(page_id))
     except Exception as e:
-        save_crawl_error(conn, page_id, parent_id, str(e), "NA", "NA")
-        save_page_to_db(conn, page_id, parent_id, "NA", "NA")
+        writer.save_crawl_error(page_id, parent_id, str(e), "NA", "NA")
+        writer.save_page(page_id, parent_id, "NA", "NA")
         print(f"Error fetching metadata for {page_id}: {e}")
-        return
-    db_page = get_page_from_db(conn, page_id)
+        return "error", []
+    id_cache.record_metadata_fetch(meta, commit=False)
+    db_page = writer.get_page(page_id)
     if not resume_incomplete and db_page and db_page[3] == meta["last_edited_time"]:
         print(f"Page {page_id} unchanged since last crawl. Skipping descendants.")
-        return
-    # Only update content if we have a value for it (should be rare here, but for safety)
-    save_page_to_db(conn, page_id, parent_id, meta["created_time"], meta["last_edited_time"], db_page[4] if db_page else None)
+        return "done", []
+    # Stored content is kept as-is by the upsert
+    writer.save_page(page_id, parent_id, meta["created_time"], meta["last_edited_time"])
     print(f"Saved page {page_id} (parent: {parent_id})")
-    child_pages, child_databases = get_child_pages_and_databases(page_id)
+    child_pages, child_databases = await asyncio.to_thread(get_child_pages_and_databases, page_id)
+    id_cache.remember([child["id"] for child in child_pages], "page", commit=False)
+    id_cache.remember([db["id"] for db in child_databases], "database", commit=False)
+    children = []
     for child in child_pages:
-        db_child = get_page_from_db(conn, child["id"])
-        if resume_incomplete and db_child is not None and db_child[1] == page_id:
-            print(f"Child page {child['id']} already crawled. Skipping.")
-            continue
-        elif not resume_incomplete and db_child and db_child[1] == page_id:
+        if already_crawled(writer, child["id"], page_id):
             print(f"Child page {child['id']} already crawled. Skipping.")
             continue
-        crawl_metadata(conn, child["id"], parent_id=page_id, depth=depth+1, resume_incomplete=resume_incomplete)
+        children.append(("page", child["id"], page_id))
     for db in child_databases:
-        db_db = get_page_from_db(conn, db["id"])
-        if resume_incomplete and db_db is not None and db_db[1] == page_id:
+        if already_crawled(writer, db["id"], page_id):
             print(f"Child database {db['id']} already crawled. Skipping.")
             continue
-        elif not resume_incomplete and db_db and db_db[1] == page_id:
-            print(f"Child database {db['id']} already crawled. Skipping.")
-            continue
-        print(f"Entering database {db['id']} (parent: {page_id})")
-        if not is_valid_database_id(db["id"]):
-            print(f"Warning: Block {db['id']} is not a valid or accessible database. Skipping.")
-            try:
-                title = get_database_title(db["id"])
-            except Exception:
-                title = "NA"
-            try:
-                first_row = get_first_db_row(db["id"])
-            except Exception:
-                first_row = "NA"
-            save_page_to_db(conn, db["id"], page_id, "NA", "NA")
-            save_crawl_error(conn, db["id"], page_id, "Not accessible or cross-workspace DB", str(title), str(first_row))
+        children.append(("database", db["id"], page_id))
+    return "done", children
+
+async def _crawl_database_async(writer, database_id, parent_id, id_cache):
+    print(f"Entering database {database_id} (parent: {parent_id})")
+    if not await asyncio.to_thread(is_valid_database_id, database_id):
+        print(f"Warning: Block {database_id} is not a valid or accessible database. Skipping.")
+        head = await asyncio.to_thread(get_database_head, database_id)
+        record_database_error(writer, database_id, parent_id, "Not accessible or cross-workspace DB", head)
+        return "error", []
+    try:
+        row_ids = await asyncio.to_thread(get_database_rows, database_id)
+    except Exception as e:
+        print(f"Error querying database {database_id}: {e}. Skipping.")
+        head = await asyncio.to_thread(get_database_head, database_id)
+        record_database_error(writer, database_id, parent_id, str(e), head)
+        return "error", []
+    id_cache.remember(row_ids, "page", commit=False)
+    children = []
+    for row_id in row_ids:
+        if already_crawled(writer, row_id, database_id):
+            print(f"Database row {row_id} already crawled. Skipping.")
             continue
-        try:
-            row_ids = get_database_rows(db["id"])
-            for row_id in row_ids:
-                db_row = get_page_from_db(conn, row_id)
-                if resume_incomplete and db_row is not None and db_row[1] == db["id"]:
-                    print(f"Database row {row_id} already crawled. Skipping.")
-                    continue
-                elif not resume_incomplete and db_row and db_row[1] == db["id"]:
-                    print(f"Database row {row_id} already crawled. Skipping.")
-                    continue
-                crawl_metadata(conn, row_id, parent_id=db["id"], depth=depth+1, resume_incomplete=resume_incomplete)
-        except Exception as e:
-            print(f"Error querying database {db['id']}: {e}. Skipping.")
-            try:
-                title = get_database_title(db["id"])
-            except Exception:
-                title = "NA"
+        children.append(("page", row_id, database_id))
+    return "done", children
+
+async def _crawl_frontier_async(writer, concurrency, resume_incomplete, id_cache):
+    conn = writer.conn
+    queue = asyncio.Queue()
+    for item in frontier_pending(conn):
+        queue.put_nowait(item)
+    started = time.monotonic()
+    progress = {"processed": 0, "reported": started}
+
+    def report_progress(force=False):
+        now = time.monotonic()
+        if not force and now - progress["reported"] < PROGRESS_INTERVAL_SECONDS:
+            return
+        progress["reported"] = now
+        counts = frontier_counts(conn)
+        rate = progress["processed"] / max(now - started, 1e-9)
+        print(f"Frontier: {counts['pending']} pending, {counts['in_progress']} in progress, "
+              f"{counts['done']} done, {counts['error']} errors ({rate:.1f} nodes/s)")
+
+    async def worker():
+        while True:
+            kind, node_id, parent_id = await queue.get()
             try:
-                first_row = get_first_db_row(db["id"])
-            except Exception:
-                first_row = "NA"
-            save_page_to_db(conn, db["id"], page_id, "NA", "NA")
-            save_crawl_error(conn, db["id"], page_id, str(e), str(title), str(first_row))
+                frontier_set_state(conn, node_id, "in_progress")
+                try:
+                    if kind == "database":
+                        state, children = await _crawl_database_async(writer, node_id, parent_id, id_cache)
+                    else:
+                        state, children = await _crawl_page_async(writer, node_id, parent_id, resume_incomplete, id_cache)
+                except Exception as e:
+                    # Keep the pool alive; the node is recorded like any other crawl failure.
+                    print(f"Error crawling {kind} {node_id}: {e}")
+                    writer.save_crawl_error(node_id, parent_id, str(e), "NA", "NA")
+                    state, children = "error", []
+                # Children, the node's final state and its page rows share one transaction
+                for child in frontier_add(conn, children):
+                    queue.put_nowait(child)
+                frontier_set_state(conn, node_id, state)
+                writer.maybe_flush()
+                progress["processed"] += 1
+                report_progress()
+            finally:
+                queue.task_done()
+
+    workers = [asyncio.create_task(worker()) for _ in range(max(1, concurrency))]
+    try:
+        await queue.join()
+    finally:
+        for w in workers:
+            w.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+    report_progress(force=True)
+
+def run_crawl_frontier(conn, concurrency=1, resume_incomplete=False, id_cache=None):
+    """
+    Crawl every pending node in the frontier with `concurrency` workers.
+
+    Returns True when the frontier was fully drained (and then cleared).
+    """
+    if id_cache is None:
+        id_cache = IdTypeCache(conn)
+    with WriteBuffer(conn) as writer:
+        asyncio.run(_crawl_frontier_async(writer, concurrency, resume_incomplete, id_cache))
+    counts = frontier_counts(conn)
+    if counts["pending"] or counts["in_progress"]:
+        return False
+    frontier_clear(conn)
+    return True
+
+def crawl_metadata(conn, page_id, parent_id=None, depth=0, resume_incomplete=False, id_cache=None):
+    """Crawl the tree below `page_id` (plus any unfinished frontier work) with a single worker."""
+    frontier_seed(conn, [("page", page_id, parent_id)])
+    run_crawl_frontier(conn, concurrency=1, resume_incomplete=resume_incomplete, id_cache=id_cache)
+
+def crawl_metadata_concurrent(conn, seeds, concurrency=4, resume_incomplete=False, id_cache=None):
+    """
+    Crawl from several (page_id, parent_id) seeds with a pool of `concurrency` workers.
+
+    Writes the same `pages` and `crawl_errors` rows as `crawl_metadata`.
+    """
+    frontier_seed(conn, [("page", page_id, parent_id) for page_id, parent_id in seeds])
+    run_crawl_frontier(conn, concurrency=concurrency, resume_incomplete=resume_incomplete, id_cache=id_cache)
 
 # --- New: Extract head info ---
 def get_page_title(page_id):
@@ -338,75 +1162,203 @@ def get_first_db_row(database_id):
     return results[0] if results else None
 
 # --- New: Integrate exported page contents ---
-def integrate_exports():
+NOTION_ID_PATTERN = re.compile(r"[0-9a-fA-F]{32}|[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}")
+EXPORT_HASH_WORKERS = 8
+EXPORT_BATCH_SIZE = 256
+
+def extract_notion_id_from_name(name):
+    """Notion exports name files and folders "<Title> <id>"; return the id or None."""
+    parts = name.rsplit(" ", 1)
+    if len(parts) == 2 and NOTION_ID_PATTERN.fullmatch(parts[1]):
+        return parts[1]
+    return None
+
+def scan_exports(root):
+    """Yield (relative path, size, mtime_ns) for every markdown file under `root`, recursively."""
+    stack = [root]
+    while stack:
+        current = stack.pop()
+        try:
+            entries = list(os.scandir(current))
+        except OSError as e:
+            print(f"Warning: Could not scan {current}: {e}")
+            continue
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                stack.append(entry.path)
+            elif entry.name.endswith(".md") and entry.is_file():
+                st = entry.stat()
+                yield os.path.relpath(entry.path, root), st.st_size, st.st_mtime_ns
+
+def hash_export(raw):
+    """Decode one exported note; returns (stripped content, sha256 of the content)."""
+    content = raw.decode("utf-8").strip()
+    return content, hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+def read_export(path):
+    with open(path, "rb") as f:
+        return hash_export(f.read())
+
+# export_manifest keys start with the resolved export source, so each
+# directory or archive only prunes its own rows
+EXPORT_KEY_SEPARATOR = "!/"
+
+def export_manifest_prefix(source):
+    return os.path.realpath(source) + EXPORT_KEY_SEPARATOR
+
+class ExportDirectory:
+    """Markdown exports unpacked under a directory; files are read in a thread pool."""
+    def __init__(self, root):
+        self.root = root
+        self.prefix = export_manifest_prefix(root)
+
+    def scan(self):
+        """Yield (manifest key, path inside the export, size, mtime_ns) per markdown file."""
+        if not os.path.isdir(self.root):
+            return
+        for rel_path, size, mtime_ns in scan_exports(self.root):
+            yield self.prefix + rel_path, rel_path, size, mtime_ns
+
+    def owns(self, key):
+        return key.startswith(self.prefix)
+
+    def read_many(self, paths, pool):
+        return pool.map(read_export, [os.path.join(self.root, path) for path in paths])
+
+    def close(self):
+        pass
+
+class ExportArchive:
+    """
+    A Notion export .zip read in place, one member at a time.
+
+    Members are decompressed as streams straight from the archive, so nothing
+    is extracted to disk and memory holds at most one batch of notes. The
+    member's CRC stands in for the file mtime in the manifest.
+    """
+    def __init__(self, zip_path):
+        self.zip_path = zip_path
+        self.prefix = export_manifest_prefix(zip_path)
+        self.archive = zipfile.ZipFile(zip_path)
+
+    def scan(self):
+        for info in self.archive.infolist():
+            if info.is_dir() or not info.filename.endswith(".md"):
+                continue
+            yield self.prefix + info.filename, info.filename, info.file_size, info.CRC
+
+    def owns(self, key):
+        return key.startswith(self.prefix)
+
+    def read_many(self, paths, pool):
+        # Members share one file handle, so decompress them sequentially
+        for path in paths:
+            with self.archive.open(path) as member:
+                yield hash_export(member.read())
+
+    def close(self):
+        self.archive.close()
+
+def open_export_source(source):
+    if source.endswith(".zip") or zipfile.is_zipfile(source):
+        return ExportArchive(source)
+    return ExportDirectory(source)
+
+def integrate_exports(source=None):
+    """
+    Load markdown exports into the pages table.
+
+    `source` is a directory of unpacked exports (default: EXPORTS_DIR) or a
+    Notion export .zip, which is read in place without extracting it.
+
+    The `export_manifest` table remembers each file's size, mtime (CRC for zip
+    members) and content hash: unchanged files are skipped without being
+    opened, and the rest are read and hashed in a thread pool. A file whose
+    hash changed since the last run replaces the stored content of its note.
+    """
+    export_source = open_export_source(source or EXPORTS_DIR)
     conn = init_db()
-    notion_id_pattern = re.compile(r"[0-9a-fA-F]{32}|[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}")
+    c = conn.cursor()
+    c.execute("SELECT path, size, mtime_ns, content_hash FROM export_manifest")
+    manifest = {row[0]: row[1:] for row in c.fetchall() if export_source.owns(row[0])}
     notes_added = 0
-    def extract_notion_id_from_name(name):
-        parts = name.rsplit(" ", 1)
-        if len(parts) == 2 and notion_id_pattern.fullmatch(parts[1]):
-            return parts[1]
-        return None
+    files_seen = 0
+    changed = []
+    seen_keys = set()
+    for key, rel_path, size, mtime_ns in export_source.scan():
+        files_seen += 1
+        seen_keys.add(key)
+        known = manifest.get(key)
+        if known and known[0] == size and known[1] == mtime_ns:
+            continue
+        changed.append((key, rel_path, size, mtime_ns))
+
     def ensure_parent_in_db(dir_path):
-        parent_dir = os.path.dirname(dir_path)
-        entry = os.path.basename(dir_path)
-        parent_id = extract_notion_id_from_name(entry)
+        # dir_path is relative to the export root; every folder named "<Title> <id>" is a page
+        if not dir_path:
+            return None
+        parent_id = extract_notion_id_from_name(os.path.basename(dir_path))
         if not parent_id:
             return None
-        c = conn.cursor()
-        c.execute('SELECT id FROM pages WHERE id=?', (parent_id,))
-        if c.fetchone():
+        if writer.get_page(parent_id):
             return parent_id
-        parent_parent_id = ensure_parent_in_db(parent_dir)
-        save_page_to_db(conn, parent_id, parent_parent_id, None, None, None)
+        parent_parent_id = ensure_parent_in_db(os.path.dirname(dir_path))
+        writer.save_page(parent_id, parent_parent_id, None, None, None)
         return parent_id
 
-    for entry in os.listdir(EXPORTS_DIR):
-        entry_path = os.path.join(EXPORTS_DIR, entry)
-        if os.path.isdir(entry_path):
-            parent_id = extract_notion_id_from_name(entry)
-            if parent_id:
-                parent_id = ensure_parent_in_db(entry_path)
-            else:
-                parent_id = None
-            md_files = glob.glob(os.path.join(entry_path, "*.md"))
-            for md_file in md_files:
-                filename = os.path.basename(md_file)
-                if not filename.endswith(".md"):
-                    continue
-                # Extract unique ID: after last space, before .md
-                parts = filename[:-3].rsplit(" ", 1)
-                if len(parts) != 2:
-                    continue  # skip files not matching pattern
-                unique_id = parts[1]
-                with open(md_file, encoding="utf-8") as f:
-                    content = f.read().strip()
-                if not content:
-                    continue  # skip empty notes
-                # Check if note already exists in DB
-                c = conn.cursor()
-                c.execute('SELECT id, content FROM pages WHERE id=?', (unique_id,))
-                row = c.fetchone()
-                if row:
-                    # If content is missing/empty, update it
-                    if not row[1] or row[1].strip() == "":
-                        save_page_to_db(conn, unique_id, parent_id, None, None, content)
-                        notes_added += 1
-                    continue
-                # Insert new note
-                save_page_to_db(conn, unique_id, parent_id, None, None, content)
-                notes_added += 1
-    print(f"Integrated {notes_added} notes from markdown exports.")
+    try:
+        with WriteBuffer(conn) as writer, ThreadPoolExecutor(max_workers=EXPORT_HASH_WORKERS) as pool:
+            for start in range(0, len(changed), EXPORT_BATCH_SIZE):
+                batch = changed[start:start + EXPORT_BATCH_SIZE]
+                contents = export_source.read_many([rel_path for _, rel_path, _, _ in batch], pool)
+                manifest_rows = []
+                for (key, rel_path, size, mtime_ns), (content, content_hash) in zip(batch, contents):
+                    filename = os.path.basename(rel_path)
+                    # Extract unique ID: after last space, before .md
+                    parts = filename[:-3].rsplit(" ", 1)
+                    unique_id = parts[1] if len(parts) == 2 else None
+                    manifest_rows.append((key, size, mtime_ns, content_hash, unique_id))
+                    if not unique_id or not content:
+                        continue  # skip files not matching pattern and empty notes
+                    known = manifest.get(key)
+                    if known and known[2] == content_hash:
+                        continue  # touched but not modified
+                    parent_id = ensure_parent_in_db(os.path.dirname(rel_path))
+                    row = writer.get_page(unique_id)
+                    if row:
+                        # Fill missing content, or replace it when this export changed since the last run
+                        if known or not row[4] or row[4].strip() == "":
+                            writer.save_page(unique_id, row[1] or parent_id, row[2], row[3], content)
+                            notes_added += 1
+                        continue
+                    # Insert new note
+                    writer.save_page(unique_id, parent_id, None, None, content)
+                    notes_added += 1
+                # Commit the notes together with their manifest entries
+                writer.write()
+                c.executemany('''INSERT INTO export_manifest (path, size, mtime_ns, content_hash, note_id)
+                    VALUES (?, ?, ?, ?, ?)
+                    ON CONFLICT(path) DO UPDATE SET size = excluded.size, mtime_ns = excluded.mtime_ns,
+                        content_hash = excluded.content_hash, note_id = excluded.note_id''', manifest_rows)
+                writer.flush()
+            removed = [(key,) for key in manifest if key not in seen_keys]
+            if removed:
+                c.executemany("DELETE FROM export_manifest WHERE path = ?", removed)
+    finally:
+        export_source.close()
+    print(f"Integrated {notes_added} notes from markdown exports "
+          f"({len(changed)} of {files_seen} files new or changed).")
 
 # --- New: Batch Gemini Processing ---
 def batch_gemini(questions_version="1"):
-    from gemini_utils import MODEL_NAME
+    # Resolve the question set once up front; call_gemini_api reuses the registry's parsed copy
+    question_set = QUESTION_REGISTRY.get(questions_version)
     conn = init_db()
     os.makedirs(OUTPUTS_DIR, exist_ok=True)
     c = conn.cursor()
     c.execute('SELECT id, content FROM pages WHERE content IS NOT NULL AND TRIM(content) != ""')
     notes = c.fetchall()
-    print(f"Processing {len(notes)} notes with Gemini (questions_v{questions_version}, model={MODEL_NAME})...")
+    print(f"Processing {len(notes)} notes with Gemini ({question_set.questions_version}, {len(question_set.questions)} questions, model={MODEL_NAME})...")
     for note_id, content in notes:
         output_path = os.path.join(OUTPUTS_DIR, f"gemini_{note_id}_v{questions_version}_{MODEL_NAME}.json")
         # Check if this note/version/model has already been processed
@@ -430,184 +1382,266 @@ def batch_gemini(questions_version="1"):
     print(f"Done. Results saved in {OUTPUTS_DIR}/.")
 
 # --- Load Gemini outputs into DB ---
+# A file only replaces the stored analysis if it was produced later
+OUTPUT_UPSERT_SQL = '''INSERT INTO gemini_analysis (note_id, questions_version, model, date_executed, answers_json)
+    VALUES (?, ?, ?, ?, ?)
+    ON CONFLICT(note_id, questions_version, model) DO UPDATE SET
+        date_executed = excluded.date_executed,
+        answers_json = excluded.answers_json
+    WHERE excluded.date_executed > COALESCE(gemini_analysis.date_executed, '')'''
+def parse_output_name(fname):
+    """(note_id, version, model) from "gemini_{id}_v{version}_{model}.json", or None."""
+    if not fname.startswith("gemini_") or not fname.endswith(".json"):
+        return None
+    try:
+        base = fname[len("gemini_"):-len(".json")]
+        parts = base.split("_v")
+        note_id = parts[0]
+        rem = parts[1]
+        version, model = rem.split("_", 1)
+        model = model.replace("_", "-")  # just in case
+    except Exception:
+        return None
+    return note_id, version, model
+
+def parse_output_file(fpath):
+    """(gemini_analysis row, None) for one output file, or (None, error)."""
+    note_id, version, model = parse_output_name(os.path.basename(fpath))
+    try:
+        with open(fpath, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, ValueError) as e:
+        return None, str(e)
+    # Remove meta fields from answers_json
+    answers = {k: v for k, v in data.items() if k not in ANALYSIS_METADATA_KEYS}
+    return (note_id, f"v{version}", model, data.get("date_executed"), json.dumps(answers, ensure_ascii=False)), None
+
 def load_gemini_outputs():
+    """
+    Load Gemini output files from OUTPUTS_DIR into `gemini_analysis`.
+
+    The `output_ledger` table remembers the size and mtime of every file
+    loaded, so unchanged files are skipped without being opened. New or
+    changed files are parsed and written, together with their ledger rows,
+    in a single transaction. A file older than the stored analysis of its
+    note is not loaded; one that replaces it clears the note's
+    `note_analysis_state`, since the cache no longer knows what it describes.
+    """
     conn = init_db()
-    count = 0
-    for fname in os.listdir(OUTPUTS_DIR):
-        if not fname.startswith("gemini_") or not fname.endswith(".json"):
-            continue
-        # Parse note_id, version, model from filename
-        try:
-            base = fname[len("gemini_"):-len(".json")]
-            parts = base.split("_v")
-            note_id = parts[0]
-            rem = parts[1]
-            version, model = rem.split("_", 1)
-            model = model.replace("_", "-")  # just in case
-        except Exception:
-            print(f"Skipping {fname}: could not parse identifiers.")
+    c = conn.cursor()
+    c.execute("SELECT filename, size, mtime_ns FROM output_ledger")
+    ledger = {row[0]: row[1:] for row in c.fetchall()}
+    seen = set()
+    changed = []
+    if os.path.isdir(OUTPUTS_DIR):
+        for entry in os.scandir(OUTPUTS_DIR):
+            if parse_output_name(entry.name) is None:
+                if entry.name.startswith("gemini_") and entry.name.endswith(".json"):
+                    print(f"Skipping {entry.name}: could not parse identifiers.")
+                continue
+            st = entry.stat()
+            seen.add(entry.name)
+            if ledger.get(entry.name) == (st.st_size, st.st_mtime_ns):
+                continue
+            changed.append((entry.path, st.st_size, st.st_mtime_ns))
+    rows = []
+    ledger_rows = []
+    for path, size, mtime_ns in changed:
+        row, error = parse_output_file(path)
+        if error:
+            print(f"Skipping {os.path.basename(path)}: {error}")
             continue
-        fpath = os.path.join(OUTPUTS_DIR, fname)
-        with open(fpath, "r", encoding="utf-8") as f:
-            data = json.load(f)
-        date_executed = data.get("date_executed")
-        # Remove meta fields from answers_json
-        answers = {k: v for k, v in data.items() if k not in ("questions_version", "model", "date_executed")}
-        c = conn.cursor()
-        c.execute('''INSERT OR REPLACE INTO gemini_analysis (note_id, questions_version, model, date_executed, answers_json)
-                     VALUES (?, ?, ?, ?, ?)''',
-                  (note_id, f"v{version}", model, date_executed, json.dumps(answers, ensure_ascii=False)))
-        count += 1
+        rows.append(row)
+        ledger_rows.append((os.path.basename(path), size, mtime_ns))
+    removed = [(name,) for name in ledger if name not in seen]
+    loaded = 0
+    for row in rows:
+        c.execute(OUTPUT_UPSERT_SQL, row)
+        if c.rowcount:
+            loaded += 1
+            note_id, version, model = row[:3]
+            c.execute("DELETE FROM note_analysis_state WHERE note_id = ? AND questions_version = ? AND model = ?",
+                      (note_id, version[1:], model))
+    c.executemany('''INSERT INTO output_ledger (filename, size, mtime_ns) VALUES (?, ?, ?)
+        ON CONFLICT(filename) DO UPDATE SET size = excluded.size, mtime_ns = excluded.mtime_ns''', ledger_rows)
+    c.executemany("DELETE FROM output_ledger WHERE filename = ?", removed)
     conn.commit()
-    print(f"Loaded {count} Gemini outputs into the DB.")
+    print(f"Loaded {loaded} Gemini outputs into the DB ({len(rows) - loaded} older than the stored analysis, "
+          f"{len(seen) - len(changed)} of {len(seen)} files unchanged).")
 
 # --- 1. RESET_DB ---
-def reset_db():
+def reset_db(concurrency=1, discovery="crawl", exports=None):
     """
     Integrate Notion notes, update DB with new IDs, and fetch missing metadata from Notion API
+
+    Args:
+        concurrency (int): Number of concurrent crawl workers. 1 keeps the serial crawl.
+        discovery (str): "crawl" walks block children recursively; "search" first fills
+                         `pages` from the /search endpoint and only crawls what it missed.
+        exports (str): Export directory or Notion export .zip to integrate (default: EXPORTS_DIR).
     """
-    integrate_exports()
+    integrate_exports(exports)
     conn = init_db()
+    id_cache = IdTypeCache(conn)
+    if discovery == "search":
+        discover_via_search(conn, id_cache=id_cache)
     c = conn.cursor()
     c.execute('SELECT id, parent_id FROM pages WHERE created_time IS NULL OR last_edited_time IS NULL')
     missing = c.fetchall()
-    for page_id, parent_id in missing:
-        crawl_metadata(conn, page_id, parent_id=parent_id)
+    if discovery == "search" and missing:
+        print(f"{len(missing)} pages not visible to search; crawling them.")
+    counts = frontier_counts(conn)
+    if counts["pending"] or counts["in_progress"]:
+        print(f"Resuming interrupted crawl: {counts['pending'] + counts['in_progress']} nodes pending, {counts['done']} already done.")
+    # Nodes already in an interrupted frontier keep their state
+    frontier_add(conn, [("page", page_id, parent_id) for page_id, parent_id in missing])
+    conn.commit()
+    run_crawl_frontier(conn, concurrency=concurrency, id_cache=id_cache)
+    print(f"ID-type cache saved {id_cache.requests_saved} Notion requests this crawl.")
     print("DB reset and metadata fetched.")
 
 # --- 2. ANALYZE_NOTES ---
-def analyze_notes(questions_version=None, from_date=None):
-    from cli.gemini_utils import load_questions
+ISO_DATE_GLOB = "[0-9][0-9][0-9][0-9]-*"
+
+class AnalysisCandidates:
+    """
+    The notes analyze_notes has to look at, selected in SQL.
+
+    Notes whose stored analysis (`note_analysis_state` plus a `gemini_analysis`
+    row) was computed from the current `pages.content_hash` and questions are
+    excluded with an anti-join; `date_filter` (a YYYY-MM-DD string) keeps notes
+    created or edited on or after that day. Iterating yields
+    (note_id, content, content_hash or None, last_edited_time) longest first, streamed from a
+    separate read connection so content is never held in memory all at once.
+    """
+    DONE_SQL = '''EXISTS (SELECT 1 FROM note_analysis_state s
+        JOIN gemini_analysis g ON g.note_id = s.note_id AND g.model = s.model AND g.questions_version = ?
+        WHERE s.note_id = pages.id AND s.questions_version = ? AND s.model = ?
+            AND s.questions_hash = ? AND s.content_hash = pages.content_hash)'''
+
+    def __init__(self, questions_version, model, questions_hash, date_filter=None):
+        self.where = ["content IS NOT NULL", "TRIM(content) != ''"]
+        self.params = []
+        if date_filter:
+            # Only ISO timestamps compare by date; crawl errors store 'NA', which sorts after them
+            self.where.append(f"((created_time GLOB '{ISO_DATE_GLOB}' AND created_time >= ?) "
+                              f"OR (last_edited_time GLOB '{ISO_DATE_GLOB}' AND last_edited_time >= ?))")
+            self.params += [date_filter, date_filter]
+        self.done_params = [f"v{questions_version}", str(questions_version), model, questions_hash]
+
+    def count_done(self, conn):
+        """Number of notes the anti-join skips as already analyzed."""
+        c = conn.cursor()
+        c.execute(f"SELECT COUNT(*) FROM pages WHERE {' AND '.join(self.where)} AND {self.DONE_SQL}",
+                  self.params + self.done_params)
+        return c.fetchone()[0]
+
+    def __iter__(self):
+        reader = sqlite3.connect(DB_PATH)
+        try:
+            c = reader.cursor()
+            c.execute(f'''SELECT id, content, content_hash, last_edited_time FROM pages
+                          WHERE {' AND '.join(self.where)} AND NOT {self.DONE_SQL}
+                          ORDER BY content_length DESC''',
+                      self.params + self.done_params)
+            yield from c
+        finally:
+            reader.close()
+
+def analyze_notes(questions_version=None, from_date=None, concurrency=1, batch_tokens=0, mirror_json=False):
+    """
+    Run Gemini analysis on notes whose content or questions changed since their last analysis.
+
+    Results are cached by (normalized content hash, questions hash, model):
+    unchanged notes are skipped (in SQL, see AnalysisCandidates), and notes
+    whose content was already analyzed under another ID reuse that result
+    instead of calling Gemini.
+
+    Up to `concurrency` requests run at once; quota errors shrink the
+    concurrency and wait for the suggested retry delay instead of aborting.
+    With `batch_tokens` > 0, short notes are packed into shared prompts of up
+    to that many note tokens, so the instructions and questions are sent once
+    per batch instead of once per note.
+
+    Results are written to `gemini_analysis` in batched commits as they come
+    in, so the GUI sees them during the run; `mirror_json` also writes the
+    per-note JSON files to OUTPUTS_DIR.
+    """
     import datetime
     if questions_version is None:
-        # Use latest version by inspecting questions directory
-        files = os.listdir(os.path.join(os.path.dirname(__file__), '../questions'))
-        versions = []
-        for fname in files:
-            m = re.match(r'questions_v(\d+)\.json', fname)
-            if m:
-                versions.append(int(m.group(1)))
-        if versions:
-            questions_version = str(max(versions))
-        else:
-            questions_version = "1"
+        questions_version = latest_questions_version()
     conn = init_db()
-    os.makedirs(OUTPUTS_DIR, exist_ok=True)
-    c = conn.cursor()
 
-    # Parse from_date if provided
+    # Parse from_date if provided; stored times are UTC ISO strings, so the date compares as text
     date_filter = None
     if from_date:
         try:
-            # Create a naive datetime from the input string
-            naive_date = datetime.datetime.strptime(from_date, "%d/%m/%Y")
-            # Make it aware with UTC timezone
-            date_filter = naive_date.replace(tzinfo=datetime.timezone.utc)
-        except Exception as e:
+            date_filter = datetime.datetime.strptime(from_date, "%d/%m/%Y").date().isoformat()
+        except ValueError:
             print(f"Invalid from_date format (expected DD/MM/YYYY): {from_date}")
             return
 
-    # Fetch note metadata for filtering and sorting
-    # Include content_length in our query for efficient sorting
-    c.execute('''SELECT id, content, content_length, created_time, last_edited_time 
-                FROM pages 
-                WHERE content IS NOT NULL AND TRIM(content) != ""''')
-    notes = c.fetchall()
-    
-    # Filter by date if needed
-    filtered_notes = []
-    for row in notes:
-        note_id, content, content_length, created_time, last_edited_time = row
-        if date_filter:
-            # Parse times from database (ISO format)
-            ct = None
-            lt = None
-            try:
-                if created_time:
-                    # Parse with timezone info (already aware)
-                    ct = datetime.datetime.fromisoformat(created_time.replace("Z", "+00:00"))
-                if last_edited_time:
-                    # Parse with timezone info (already aware)
-                    lt = datetime.datetime.fromisoformat(last_edited_time.replace("Z", "+00:00"))
-            except Exception as e:
-                print(f"Warning: Could not parse date for note {note_id}: {e}")
-                pass
-            # Only keep if either date is on/after filter
-            if (ct and ct >= date_filter) or (lt and lt >= date_filter):
-                filtered_notes.append((note_id, content))
-        else:
-            filtered_notes.append((note_id, content))
-
-    # Sort by content length (longest first) using the stored value
-    if filtered_notes:
-        # Get the content lengths for the filtered notes
-        content_length_dict = {}
-        for note_id, content in filtered_notes:
-            c.execute('SELECT content_length FROM pages WHERE id = ?', (note_id,))
-            result = c.fetchone()
-            if result and result[0]:
-                content_length_dict[note_id] = result[0]
-            else:
-                # Fallback to calculating length if not in DB
-                content_length_dict[note_id] = len(content)
-        
-        # Sort using the content_length dictionary
-        filtered_notes.sort(key=lambda x: content_length_dict.get(x[0], 0), reverse=True)
+    instructions, questions, version_str = load_questions(questions_version)
+    prompt_overhead = estimate_tokens(instructions + "".join(questions))
+    cache = AnalysisCache(conn, questions_version, instructions, questions, MODEL_NAME)
+    candidates = AnalysisCandidates(questions_version, MODEL_NAME, cache.questions_hash, date_filter)
+    cache.up_to_date += candidates.count_done(conn)
+    earlier_versions = [v for v in reversed(question_versions()) if v != str(questions_version)]
 
-    for note_id, content in filtered_notes:
-        output_path = os.path.join(OUTPUTS_DIR, f"gemini_{note_id}_v{questions_version}_{MODEL_NAME}.json")
-        if os.path.exists(output_path):
-            try:
-                with open(output_path, "r", encoding="utf-8") as f:
-                    existing = json.load(f)
-                if (str(existing.get("questions_version")) == f"v{questions_version}" and
-                    existing.get("model") == MODEL_NAME):
-                    continue
-            except Exception as e:
-                continue
-        result = call_gemini_api(content, questions_version)
-        # Only save result if it's a successful analysis (no error key)
-        if "error" in result:
-            # If this is a quota/resource exhausted error, stop all processing immediately
-            if result.get("status_code") == 429 and "quota" in result.get("error", "").lower():
-                print("Gemini API quota exhausted. Halting further analysis.")
-                import sys
-                sys.exit(1)
-            else:
-                print(f"Skipping note {note_id} due to API error: {result.get('error')}")
-                continue
-        with open(output_path, "w", encoding="utf-8") as f:
-            json.dump(result, f, ensure_ascii=False, indent=2)
-    print("Gemini analysis complete.")
+    def hashed_candidates():
+        for note_id, content, stored_hash, last_edited_time in candidates:
+            digest = stored_hash or content_hash(content)
+            if stored_hash is None:
+                conn.execute("UPDATE pages SET content_hash = ? WHERE id = ?", (digest, note_id))
+            yield note_id, content, digest, last_edited_time
 
-# --- 3. LOAD_GEMINI_OUTPUTS ---
-def load_gemini_outputs():
-    conn = init_db()
-    count = 0
-    for fname in os.listdir(OUTPUTS_DIR):
-        if not fname.startswith("gemini_") or not fname.endswith(".json"):
-            continue
-        try:
-            base = fname[len("gemini_"):-len(".json")]
-            parts = base.split("_v")
-            note_id = parts[0]
-            rem = parts[1]
-            version, model = rem.split("_", 1)
-            model = model.replace("_", "-")
-        except Exception:
-            continue
-        fpath = os.path.join(OUTPUTS_DIR, fname)
-        with open(fpath, "r", encoding="utf-8") as f:
-            data = json.load(f)
-        date_executed = data.get("date_executed")
-        answers = {k: v for k, v in data.items() if k not in ("questions_version", "model", "date_executed")}
-        c = conn.cursor()
-        c.execute('''INSERT OR REPLACE INTO gemini_analysis (note_id, questions_version, model, date_executed, answers_json)
-                     VALUES (?, ?, ?, ?, ?)''',
-                  (note_id, f"v{version}", model, date_executed, json.dumps(answers, ensure_ascii=False)))
-        count += 1
-    conn.commit()
-    print(f"Loaded {count} Gemini outputs into the DB.")
+    def analyze(payload, controller):
+        if isinstance(payload, list):
+            return call_gemini_api_batch(payload, questions_version)
+        content, missing = payload
+        return call_gemini_api(content, questions_version, question_indices=missing, controller=controller)
+
+    def save(key, result):
+        for note_id, note_result in (result.items() if isinstance(key, tuple) else [(key, result)]):
+            queue.finish(note_id, note_result)
+        writer.maybe_flush()
+        if not isinstance(key, tuple):
+            return None
+        # Notes the batch reply missed go back to run_analysis as single-note work
+        return [(note_id, (content, None)) for note_id, content in batches.pop(key) if note_id not in result]
+
+    batches = {}
+
+    def work_items():
+        # Notes needing every question go into batches (if enabled); partial re-analysis is always single-note
+        if batch_tokens <= 0:
+            for note_id, content, missing in queue.pending(hashed_candidates()):
+                yield note_id, (content, missing)
+            return
+        partial = []
+        def full_notes():
+            for note_id, content, missing in queue.pending(hashed_candidates()):
+                if missing is None:
+                    yield note_id, content
+                else:
+                    partial.append((note_id, (content, missing)))
+        for batch in pack_batches(full_notes(), token_budget=batch_tokens):
+            yield from partial
+            partial.clear()
+            key = tuple(note_id for note_id, _ in batch)
+            batches[key] = batch
+            yield key, batch
+        yield from partial
+
+    with WriteBuffer(conn) as writer:
+        sink = AnalysisSink(writer, questions_version, MODEL_NAME, mirror_dir=OUTPUTS_DIR if mirror_json else None,
+                            outputs_dir=OUTPUTS_DIR)
+        queue = AnalysisQueue(cache, sink, version_str, estimate_tokens, prompt_overhead,
+                              earlier_versions, lambda version: load_questions(version)[1])
+        run_analysis(work_items(), analyze, save, concurrency=concurrency)
+    cache.report()
+    TOKEN_USAGE.report()
+    print("Gemini analysis complete.")
 
 # --- 4. LAUNCH_GUI ---
 def launch_gui():
@@ -627,9 +1661,6 @@ def update_questions(version=None, force_update=False):
     Returns:
         tuple: (success, message) indicating success/failure and a descriptive message
     """
-    from cli.gemini_utils import QUESTIONS_DIR
-    import os
-    import glob
     from datetime import datetime
     
     # Initialize the database if it doesn't exist
@@ -644,34 +1675,22 @@ def update_questions(version=None, force_update=False):
         cursor.execute("SELECT version FROM questions")
         existing_versions = set(row[0] for row in cursor.fetchall())
         
-        # If a specific version is requested
-        if version is not None:
-            version_files = [os.path.join(QUESTIONS_DIR, f"questions_v{version}.json")]
-        else:
-            # Get all question files from the questions directory
-            version_files = glob.glob(os.path.join(QUESTIONS_DIR, "questions_v*.json"))
+        # A specific version, or every question file in the questions directory
+        file_versions = [str(version)] if version is not None else question_versions()
         
-        for question_file in version_files:
-            # Extract version from filename
-            file_version = os.path.basename(question_file).replace("questions_v", "").replace(".json", "")
-            
+        for file_version in file_versions:
             # Skip if version already exists and force_update is False
             if file_version in existing_versions and not force_update:
                 skipped_versions.append(f"v{file_version}")
                 continue
                 
-            # Load questions from file
-            with open(question_file, "r", encoding="utf-8") as f:
-                data = json.load(f)
-                
-            instructions = data.get("instructions", "")
-            questions = data.get("questions", [])
-            version_str = data.get("version", f"v{file_version}")
+            question_set = QUESTION_REGISTRY.get(file_version)
+            version_str = question_set.questions_version
             
             # Prepare the data to insert
             questions_data = {
-                "instructions": instructions,
-                "questions": questions,
+                "instructions": question_set.instructions,
+                "questions": question_set.questions,
                 "version": version_str
             }
             questions_json = json.dumps(questions_data, ensure_ascii=False)
@@ -713,12 +1732,21 @@ if __name__ == "__main__":
     subparsers = parser.add_subparsers(dest="command", required=True)
 
     # reset_db command
-    subparsers.add_parser("reset_db", help="Integrate Notion notes, update DB and fetch metadata")
+    reset_parser = subparsers.add_parser("reset_db", help="Integrate Notion notes, update DB and fetch metadata")
+    reset_parser.add_argument("--concurrency", type=int, default=1, help="Number of concurrent crawl workers (default: 1)")
+    reset_parser.add_argument("--discovery", choices=["crawl", "search"], default="crawl", help="How to discover pages: recursive crawl or the search API (default: crawl)")
+    reset_parser.add_argument("--exports", type=str, default=None, help=f"Export directory or Notion export .zip to integrate (default: {EXPORTS_DIR})")
 
     # analyze_notes command
     analyze_parser = subparsers.add_parser("analyze_notes", help="Analyze notes with Gemini AI")
     analyze_parser.add_argument("--questions_version", type=str, default=None, help="Which questions version to use (default: latest)")
     analyze_parser.add_argument("--from_date", type=str, default=None, help="Only analyze notes created/edited on or after this date (format: DD/MM/YYYY)")
+    analyze_parser.add_argument("--concurrency", type=int, default=1, help="Number of concurrent Gemini requests (default: 1)")
+    analyze_parser.add_argument("--batch_tokens", type=int, default=0, help="Pack short notes into shared prompts of up to this many note tokens (default: 0, one note per prompt)")
+    analyze_parser.add_argument("--mirror_json", action="store_true", help="Also write each result as a JSON file in the outputs folder")
+
+    # sync command
+    subparsers.add_parser("sync", help="Fetch only pages edited since the last sync")
 
     # load_outputs command
     subparsers.add_parser("load_outputs", help="Load Gemini outputs into the DB")
@@ -732,9 +1760,11 @@ if __name__ == "__main__":
     args = parser.parse_args()
 
     if args.command == "reset_db":
-        reset_db()
+        reset_db(concurrency=args.concurrency, discovery=args.discovery, exports=args.exports)
+    elif args.command == "sync":
+        sync_metadata()
     elif args.command == "analyze_notes":
-        analyze_notes(questions_version=args.questions_version, from_date=args.from_date)
+        analyze_notes(questions_version=args.questions_version, from_date=args.from_date, concurrency=args.concurrency, batch_tokens=args.batch_tokens, mirror_json=args.mirror_json)
     elif args.command == "load_outputs":
         load_gemini_outputs()
     elif args.command == "launch_gui":
@@ -18,10 +18,12 @@ import rehypeHighlight from 'rehype-highlight';
 function App() {
   // Data states
   const [notes, setNotes] = useState([]);
+  const [nextCursor, setNextCursor] = useState(null); // Cursor of the next page of the note list
   const [answersIndex, setAnswersIndex] = useState({}); // noteId -> true if has answers
   const [noteVersionsIndex, setNoteVersionsIndex] = useState({}); // noteId -> [versions]
   const [selectedNote, setSelectedNote] = useState(null);
   const [answers, setAnswers] = useState([]);
+  const [answersByNote, setAnswersByNote] = useState({}); // noteId -> answers, prefetched per page of notes
   const [questionVersions, setQuestionVersions] = useState([]); // Available question versions from DB
   const [selectedVersions, setSelectedVersions] = useState([]); // Selected versions to display
   const [questions, setQuestions] = useState({}); // Format: { "v1": [question1, question2, ...], "v2": [...] }
@@ -44,11 +46,6 @@ function App() {
 
   // Load data on component mount
   useEffect(() => {
-    // Fetch notes
-    fetch("http://localhost:8000/notes")
-      .then((res) => res.json())
-      .then(setNotes);
-    
     // Fetch answer index
     fetch("http://localhost:8000/answers_index")
       .then((res) => res.json())
@@ -221,8 +218,30 @@ function App() {
     closeFilterDialog();
   };
   
+  // Fetch the answers of a whole page of notes in one request
+  const prefetchAnswers = (pageNotes) => {
+    if (pageNotes.length === 0) return;
+    const ids = pageNotes.map((note) => note.id).join(",");
+    fetch(`http://localhost:8000/answers?ids=${encodeURIComponent(ids)}`)
+      .then((res) => res.json())
+      .then((byNote) => {
+        // Notes without answers come back missing; remember them as empty
+        const fetched = {};
+        pageNotes.forEach((note) => { fetched[note.id] = byNote[note.id] || []; });
+        setAnswersByNote((previous) => ({ ...previous, ...fetched }));
+      });
+  };
+
   const selectNote = (note) => {
     setSelectedNote(note);
+    // The list only carries metadata; fetch the full note for its content
+    fetch(`http://localhost:8000/note/${note.id}`)
+      .then((res) => res.json())
+      .then((fullNote) => setSelectedNote((current) => (current?.id === fullNote.id ? { ...note, ...fullNote } : current)));
+    if (answersByNote[note.id]) {
+      setAnswers(answersByNote[note.id]);
+      return;
+    }
     fetch(`http://localhost:8000/answers/${note.id}`)
       .then((res) => res.json())
       .then(setAnswers);
@@ -241,48 +260,43 @@ function App() {
     setViewMode(modes[newValue]);
   };
 
-  // Filter and sort notes
-  const processedNotes = React.useMemo(() => {
-    // Step 1: Filter notes
-    let filtered = [...notes];
-    
-    // Apply content filter
-    if (contentFilter) {
-      filtered = filtered.filter((note) => note.content && note.content.trim().length > 0);
-    }
-    
-    // Apply analysis filter
-    if (analysisFilter) {
-      filtered = filtered.filter((note) => answersIndex[note.id]);
-    }
+  // Filters and sort run on the server (/notes/query); the list holds the pages loaded so far
+  const notesQueryUrl = React.useCallback((cursor) => {
+    const params = new URLSearchParams({ limit: "200", order: sortDirection });
+    if (contentFilter) params.set("has_content", "true");
+    if (analysisFilter) params.set("has_answers", "true");
+    // A specific version wins over the dialog's selections, as before
+    const versions = versionFilter !== "any" ? [versionFilter] : versionFilterSelections;
+    versions.forEach((version) => params.append("versions", version));
+    if (cursor) params.set("cursor", cursor);
+    return `http://localhost:8000/notes/query?${params}`;
+  }, [contentFilter, analysisFilter, sortDirection, versionFilter, versionFilterSelections]);
 
-    // Apply version filter if specific version is selected
-    if (versionFilter !== "any") {
-      filtered = filtered.filter((note) => {
-        // Check if this note has answers for the selected version
-        return noteVersionsIndex[note.id]?.includes(versionFilter);
+  // Reload the first page whenever a filter or the sort changes
+  useEffect(() => {
+    let cancelled = false;
+    fetch(notesQueryUrl(null))
+      .then((res) => res.json())
+      .then((page) => {
+        if (cancelled) return;
+        setNotes(page.notes);
+        setNextCursor(page.next_cursor);
+        prefetchAnswers(page.notes);
       });
-    }
-    // Apply version filter selections (from the filter dialog)
-    else if (versionFilterSelections.length > 0) {
-      filtered = filtered.filter((note) => {
-        // Check if this note has answers for any of the selected versions
-        return versionFilterSelections.some(version => 
-          noteVersionsIndex[note.id]?.includes(version)
-        );
+    return () => { cancelled = true; };
+  }, [notesQueryUrl]);
+
+  const loadMoreNotes = () => {
+    fetch(notesQueryUrl(nextCursor))
+      .then((res) => res.json())
+      .then((page) => {
+        setNotes((previous) => [...previous, ...page.notes]);
+        setNextCursor(page.next_cursor);
+        prefetchAnswers(page.notes);
       });
-    }
-    
-    // Step 2: Sort notes (by last_edited_time)
-    filtered.sort((a, b) => {
-      const timeA = new Date(a.last_edited_time || 0).getTime();
-      const timeB = new Date(b.last_edited_time || 0).getTime();
-      
-      return sortDirection === "asc" ? timeA - timeB : timeB - timeA;
-    });
-    
-    return filtered;
-  }, [notes, contentFilter, analysisFilter, sortDirection, answersIndex, versionFilterSelections, versionFilter, noteVersionsIndex]);
+  };
+
+  const processedNotes = notes;
 
   // Get formatted date for display
   const getFormattedDate = (dateString) => {
@@ -506,7 +520,7 @@ function App() {
             <Typography variant="h6">
               Notes
               <Typography variant="caption" sx={{ ml: 1 }}>
-                Showing: {processedNotes.length}
+                Showing: {processedNotes.length}{nextCursor ? "+" : ""}
               </Typography>
             </Typography>
           </Box>
@@ -539,9 +553,9 @@ function App() {
                           whiteSpace: 'nowrap',
                         }}
                       >
-                        {/* Extract title from first line of content or use ID */}
-                        {note.content 
-                          ? note.content.split('\n')[0].substr(0, 40) 
+                        {/* Title is the first line of content (from the backend), or the ID */}
+                        {note.title 
+                          ? note.title.substr(0, 40) 
                           : note.id.substr(0, 10) + '...'}
                       </Typography>
                       
@@ -568,6 +582,13 @@ function App() {
               </ListItem>
             ))}
           </List>
+          {nextCursor && (
+            <Box sx={{ p: 2, textAlign: 'center' }}>
+              <Button onClick={loadMoreNotes} variant="outlined" size="small">
+                Load more
+              </Button>
+            </Box>
+          )}
         </Paper>
 
         {/* Right Panel: Details */}
@@ -1,10 +1,20 @@
 import os
 import sqlite3
 import json
-from fastapi import FastAPI, HTTPException
+import ast
+import base64
+import threading
+from collections import OrderedDict
+from fastapi import FastAPI, HTTPException, Query
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Literal
+
+try:
+    import orjson
+    json_loads = orjson.loads
+except ImportError:  # optional speed-up; the standard library parser gives the same result
+    json_loads = json.loads
 
 DB_PATH = "notion_pages.db"
 
@@ -41,14 +51,209 @@ class QuestionData(BaseModel):
     questions: List[str]
     date_updated: str
 
-@app.get("/notes", response_model=List[Note])
-def get_notes():
+class NotesPage(BaseModel):
+    notes: List[Dict[str, Any]]
+    next_cursor: Optional[str]
+
+class NoteIndexEntry(BaseModel):
+    id: str
+    parent_id: Optional[str]
+    created_time: Optional[str]
+    last_edited_time: Optional[str]
+    content_length: Optional[int]
+
+NOTES_DEFAULT_LIMIT = 200
+NOTES_MAX_LIMIT = 1000
+# Keyset sort key; matches the idx_pages_edited_id expression index created by init_db.
+# Pages whose metadata fetch failed store 'NA', which would sort after every ISO timestamp;
+# they sort with the undated notes instead.
+NOTES_SORT_KEY = "CASE WHEN last_edited_time GLOB '[0-9][0-9][0-9][0-9]-*' THEN last_edited_time ELSE '' END"
+# Selectable /notes fields -> SQL; "title" is the first line of the content, cut to 80 characters
+NOTE_FIELDS = {
+    "id": "id",
+    "parent_id": "parent_id",
+    "created_time": "created_time",
+    "last_edited_time": "last_edited_time",
+    "content_length": "content_length",
+    "title": "substr(content, 1, MIN(80, CASE WHEN instr(content, char(10)) > 0 THEN instr(content, char(10)) - 1 ELSE 80 END))",
+    "content": "content",
+}
+DEFAULT_NOTE_FIELDS = "id,parent_id,created_time,last_edited_time,content_length,title"
+
+def encode_cursor(last_edited_time, note_id):
+    return base64.urlsafe_b64encode(json.dumps([last_edited_time, note_id]).encode("utf-8")).decode("ascii")
+
+def decode_cursor(cursor):
+    try:
+        last_edited_time, note_id = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        return str(last_edited_time), str(note_id)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def select_fields(fields):
+    selected = [f.strip() for f in fields.split(",") if f.strip()]
+    unknown = [f for f in selected if f not in NOTE_FIELDS]
+    if unknown or not selected:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}" if unknown else "No fields selected")
+    return selected
+
+def fts_query(text):
+    """Quote each word so user input is never parsed as FTS5 syntax; the last word also matches as a prefix."""
+    terms = ['"' + term.replace('"', '""') + '"' for term in text.split()]
+    if terms:
+        terms[-1] += "*"
+    return " ".join(terms)
+
+def fetch_notes_page(selected, cursor, limit, order, conditions=(), condition_params=()):
+    """
+    One keyset page of `pages` rows matching `conditions` (SQL snippets ANDed together).
+
+    Rows are ordered by (last_edited_time, id); only `limit` + 1 rows are read,
+    the extra one telling whether there is a next page.
+    """
+    columns = ", ".join(f"{NOTE_FIELDS[f]} AS {f}" for f in selected)
+    direction, comparison = ("DESC", "<") if order == "desc" else ("ASC", ">")
+    conditions, params = list(conditions), list(condition_params)
+    if cursor:
+        # Spelled out rather than as a row value so SQLite seeks into the index instead of scanning it
+        last_edited_time, note_id = decode_cursor(cursor)
+        conditions.append(f"{NOTES_SORT_KEY} {comparison}= ? AND ({NOTES_SORT_KEY} {comparison} ? OR id {comparison} ?)")
+        params += [last_edited_time, last_edited_time, note_id]
+    query = f"SELECT {NOTES_SORT_KEY}, id, {columns} FROM pages"
+    if conditions:
+        query += " WHERE " + " AND ".join(conditions)
+    query += f" ORDER BY {NOTES_SORT_KEY} {direction}, id {direction} LIMIT ?"
+    conn = sqlite3.connect(DB_PATH)
+    c = conn.cursor()
+    try:
+        c.execute(query, params + [limit + 1])
+        rows = c.fetchall()
+    except sqlite3.OperationalError as e:
+        # Only the text filter depends on the search index
+        raise HTTPException(status_code=503, detail=f"Search index unavailable: {e}")
+    finally:
+        conn.close()
+    next_cursor = encode_cursor(*rows[limit - 1][:2]) if len(rows) > limit else None
+    notes = [dict(zip(selected, row[2:])) for row in rows[:limit]]
+    return NotesPage(notes=notes, next_cursor=next_cursor)
+
+@app.get("/notes", response_model=NotesPage)
+def get_notes(cursor: Optional[str] = None,
+              limit: int = Query(NOTES_DEFAULT_LIMIT, ge=1, le=NOTES_MAX_LIMIT),
+              fields: str = DEFAULT_NOTE_FIELDS,
+              order: Literal["asc", "desc"] = "desc"):
+    """
+    One page of notes ordered by (last_edited_time, id), newest first by default.
+
+    `fields` is a comma-separated subset of NOTE_FIELDS; `content` is left out
+    unless asked for. Pass the returned `next_cursor` back to get the next page;
+    it is null on the last page.
+    """
+    return fetch_notes_page(select_fields(fields), cursor, limit, order)
+
+@app.get("/notes/query", response_model=NotesPage)
+def query_notes(cursor: Optional[str] = None,
+                limit: int = Query(NOTES_DEFAULT_LIMIT, ge=1, le=NOTES_MAX_LIMIT),
+                fields: str = DEFAULT_NOTE_FIELDS,
+                order: Literal["asc", "desc"] = "desc",
+                has_content: bool = False,
+                has_answers: bool = False,
+                versions: List[str] = Query([]),
+                edited_after: Optional[str] = None,
+                edited_before: Optional[str] = None,
+                text: Optional[str] = None):
+    """
+    The explorer list's filters and sort, run in SQL; pages like `/notes`.
+
+    `versions` (repeatable) keeps notes with answers for any of those question
+    versions, `has_answers` notes with answers for any version. `edited_after`
+    and `edited_before` compare ISO timestamps (a date prefix works); notes
+    without one never match them. `text` matches note content through the
+    full-text index, like `/search` with `kind=note`.
+    """
+    conditions, params = [], []
+    if has_content:
+        conditions.append("content_length > 0")
+    if versions:
+        placeholders = ", ".join("?" for _ in versions)
+        conditions.append("EXISTS (SELECT 1 FROM gemini_analysis g WHERE g.note_id = pages.id "
+                          f"AND g.questions_version IN ({placeholders}))")
+        params += versions
+    elif has_answers:
+        conditions.append("EXISTS (SELECT 1 FROM gemini_analysis g WHERE g.note_id = pages.id)")
+    if edited_after:
+        conditions.append(f"{NOTES_SORT_KEY} >= ?")
+        params.append(edited_after)
+    if edited_before:
+        conditions.append(f"{NOTES_SORT_KEY} != '' AND {NOTES_SORT_KEY} < ?")
+        params.append(edited_before)
+    match = fts_query(text or "")
+    if match:
+        conditions.append("id IN (SELECT d.note_id FROM search_index JOIN search_docs d ON d.docid = search_index.rowid "
+                          "WHERE search_index MATCH ? AND d.kind = 'note')")
+        params.append(match)
+    return fetch_notes_page(select_fields(fields), cursor, limit, order, conditions, params)
+
+class SearchHit(BaseModel):
+    note_id: str
+    kind: str  # "note" for note content, "answers" for a Gemini analysis
+    questions_version: Optional[str]
+    model: Optional[str]
+    snippet: str
+    score: float
+
+class SearchResults(BaseModel):
+    hits: List[SearchHit]
+    next_offset: Optional[int]
+
+SEARCH_DEFAULT_LIMIT = 20
+SEARCH_MAX_LIMIT = 100
+
+@app.get("/search", response_model=SearchResults)
+def search(q: str = Query(..., min_length=1),
+           kind: Optional[Literal["note", "answers"]] = None,
+           limit: int = Query(SEARCH_DEFAULT_LIMIT, ge=1, le=SEARCH_MAX_LIMIT),
+           offset: int = Query(0, ge=0)):
+    """
+    Full-text search over note content and Gemini answers, best matches (BM25) first.
+
+    Every word of `q` must match. Each hit carries a snippet with the matches
+    wrapped in `**`; pass `next_offset` back as `offset` for the next page.
+    """
+    match = fts_query(q)
+    if not match:
+        raise HTTPException(status_code=400, detail="Empty search query")
+    query = ("SELECT d.note_id, d.kind, d.questions_version, d.model, "
+             "snippet(search_index, 0, '**', '**', '…', 16), bm25(search_index) "
+             "FROM search_index JOIN search_docs d ON d.docid = search_index.rowid "
+             "WHERE search_index MATCH ?")
+    params = [match]
+    if kind:
+        query += " AND d.kind = ?"
+        params.append(kind)
+    query += " ORDER BY bm25(search_index) LIMIT ? OFFSET ?"
+    conn = sqlite3.connect(DB_PATH)
+    c = conn.cursor()
+    try:
+        c.execute(query, params + [limit + 1, offset])
+        rows = c.fetchall()
+    except sqlite3.OperationalError as e:
+        raise HTTPException(status_code=503, detail=f"Search index unavailable: {e}")
+    finally:
+        conn.close()
+    hits = [SearchHit(note_id=row[0], kind=row[1], questions_version=row[2] or None, model=row[3] or None,
+                      snippet=row[4], score=-row[5]) for row in rows[:limit]]
+    return SearchResults(hits=hits, next_offset=offset + limit if len(rows) > limit else None)
+
+@app.get("/notes/index", response_model=List[NoteIndexEntry])
+def get_notes_index():
+    """Every note's id, parent, timestamps and content length, without any content."""
     conn = sqlite3.connect(DB_PATH)
     c = conn.cursor()
-    c.execute("SELECT id, parent_id, created_time, last_edited_time, content FROM pages")
-    notes = [Note(id=row[0], parent_id=row[1], created_time=row[2], last_edited_time=row[3], content=row[4]) for row in c.fetchall()]
+    c.execute("SELECT id, parent_id, created_time, last_edited_time, content_length FROM pages")
+    entries = [NoteIndexEntry(id=row[0], parent_id=row[1], created_time=row[2], last_edited_time=row[3], content_length=row[4]) for row in c.fetchall()]
     conn.close()
-    return notes
+    return entries
 
 @app.get("/note/{note_id}", response_model=Note)
 def get_note(note_id: str):
@@ -61,15 +266,85 @@ def get_note(note_id: str):
         raise HTTPException(status_code=404, detail="Note not found")
     return Note(id=row[0], parent_id=row[1], created_time=row[2], last_edited_time=row[3], content=row[4])
 
+class AnswerCache:
+    """
+    Bounded LRU of decoded answers_json, keyed by (note_id, version, model, date_executed).
+
+    Re-analysis changes date_executed, so an entry never outlives the row it came from.
+    """
+    def __init__(self, maxsize=4096):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key, raw):
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                return self.entries[key]
+        answers = decode_answers(raw)
+        with self.lock:
+            self.entries[key] = answers
+            if len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+        return answers
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+def decode_answers(raw):
+    """answers_json as a dict; rows written as Python dict literals by old loaders are still read, without eval."""
+    if not isinstance(raw, (str, bytes)):
+        return raw
+    try:
+        return json_loads(raw)
+    except ValueError:
+        try:
+            return ast.literal_eval(raw)
+        except (ValueError, SyntaxError):
+            return {}
+
+ANSWER_CACHE = AnswerCache()
+ANSWERS_MAX_IDS = 500
+
+def answer_from_row(row):
+    answers = ANSWER_CACHE.get(tuple(row[:4]), row[4])
+    return GeminiAnswer(note_id=row[0], questions_version=row[1], model=row[2], date_executed=row[3], answers_json=answers)
+
 @app.get("/answers/{note_id}", response_model=List[GeminiAnswer])
 def get_answers(note_id: str):
     conn = sqlite3.connect(DB_PATH)
     c = conn.cursor()
     c.execute("SELECT note_id, questions_version, model, date_executed, answers_json FROM gemini_analysis WHERE note_id=?", (note_id,))
-    answers = [GeminiAnswer(note_id=row[0], questions_version=row[1], model=row[2], date_executed=row[3], answers_json=eval(row[4]) if isinstance(row[4], str) else row[4]) for row in c.fetchall()]
+    answers = [answer_from_row(row) for row in c.fetchall()]
     conn.close()
     return answers
 
+@app.get("/answers", response_model=Dict[str, List[GeminiAnswer]])
+def get_answers_bulk(ids: List[str] = Query(...)):
+    """
+    Answers for many notes in one round trip, as note_id -> answers.
+
+    `ids` may be repeated or comma-separated (at most ANSWERS_MAX_IDS); notes
+    without answers are left out.
+    """
+    note_ids = list(dict.fromkeys(i.strip() for value in ids for i in value.split(",") if i.strip()))
+    if not note_ids:
+        raise HTTPException(status_code=400, detail="No note ids given")
+    if len(note_ids) > ANSWERS_MAX_IDS:
+        raise HTTPException(status_code=400, detail=f"At most {ANSWERS_MAX_IDS} ids per request")
+    placeholders = ", ".join("?" for _ in note_ids)
+    conn = sqlite3.connect(DB_PATH)
+    c = conn.cursor()
+    c.execute("SELECT note_id, questions_version, model, date_executed, answers_json FROM gemini_analysis "
+              f"WHERE note_id IN ({placeholders})", note_ids)
+    by_note = {}
+    for row in c.fetchall():
+        by_note.setdefault(row[0], []).append(answer_from_row(row))
+    conn.close()
+    return by_note
+
 @app.get("/answers_index")
 def get_answers_index():
     conn = sqlite3.connect(DB_PATH)
@@ -113,6 +388,77 @@ def get_hierarchy():
         tree[parent_id].append(id)
     return tree
 
+class HierarchyNode(BaseModel):
+    id: str
+    parent_id: Optional[str]
+    title: Optional[str]
+    depth: int
+    child_count: int
+
+class SubtreeCount(BaseModel):
+    id: str
+    children: int
+    descendants: int
+
+SUBTREE_MAX_NODES = 5000
+
+# Nodes come from the page_closure table maintained by init_db's triggers; parents that are
+# not pages themselves show up with a null title.
+HIERARCHY_TITLE_SQL = NOTE_FIELDS["title"].replace("content", "p.content")
+
+def fetch_hierarchy_nodes(source, params, order="n.depth, n.node_id", limit=None):
+    """Nodes for the (node_id, depth) rows selected by `source`, with titles and child counts."""
+    query = (f"SELECT n.node_id, p.parent_id, {HIERARCHY_TITLE_SQL}, n.depth, "
+             "(SELECT COUNT(*) FROM page_closure k WHERE k.ancestor = n.node_id AND k.depth = 1) "
+             f"FROM ({source}) n LEFT JOIN pages p ON p.id = n.node_id ORDER BY {order}")
+    params = list(params)
+    if limit is not None:
+        query += " LIMIT ?"
+        params.append(limit)
+    conn = sqlite3.connect(DB_PATH)
+    c = conn.cursor()
+    c.execute(query, params)
+    nodes = [HierarchyNode(id=row[0], parent_id=row[1], title=row[2], depth=row[3], child_count=row[4]) for row in c.fetchall()]
+    conn.close()
+    return nodes
+
+@app.get("/hierarchy/roots", response_model=List[HierarchyNode])
+def get_hierarchy_roots():
+    """Top-level nodes: pages without a parent, and parents that are not pages themselves."""
+    return fetch_hierarchy_nodes(
+        "SELECT id AS node_id, 0 AS depth FROM pages WHERE parent_id IS NULL "
+        "UNION SELECT parent_id, 0 FROM pages WHERE parent_id IS NOT NULL AND parent_id NOT IN (SELECT id FROM pages)", [])
+
+@app.get("/hierarchy/{note_id}/children", response_model=List[HierarchyNode])
+def get_hierarchy_children(note_id: str):
+    return fetch_hierarchy_nodes(
+        "SELECT descendant AS node_id, depth FROM page_closure WHERE ancestor = ? AND depth = 1", [note_id])
+
+@app.get("/hierarchy/{note_id}/subtree", response_model=List[HierarchyNode])
+def get_hierarchy_subtree(note_id: str, max_depth: int = Query(1, ge=1, le=100),
+                          limit: int = Query(SUBTREE_MAX_NODES, ge=1, le=SUBTREE_MAX_NODES)):
+    """Descendants of `note_id` down to `max_depth` levels, breadth first; depth is relative to `note_id`."""
+    return fetch_hierarchy_nodes(
+        "SELECT descendant AS node_id, depth FROM page_closure WHERE ancestor = ? AND depth BETWEEN 1 AND ?",
+        [note_id, max_depth], limit=limit)
+
+@app.get("/hierarchy/{note_id}/ancestors", response_model=List[HierarchyNode])
+def get_hierarchy_ancestors(note_id: str):
+    """Breadcrumbs for `note_id`, from the top-level node down to its parent; depth counts levels up."""
+    return fetch_hierarchy_nodes(
+        "SELECT ancestor AS node_id, depth FROM page_closure WHERE descendant = ? AND depth > 0",
+        [note_id], order="n.depth DESC")
+
+@app.get("/hierarchy/{note_id}/count", response_model=SubtreeCount)
+def get_hierarchy_count(note_id: str):
+    """Number of direct children and of all descendants of `note_id`."""
+    conn = sqlite3.connect(DB_PATH)
+    c = conn.cursor()
+    c.execute("SELECT COUNT(CASE WHEN depth = 1 THEN 1 END), COUNT(*) FROM page_closure WHERE ancestor = ? AND depth > 0", (note_id,))
+    children, descendants = c.fetchone()
+    conn.close()
+    return SubtreeCount(id=note_id, children=children, descendants=descendants)
+
 # New endpoints for questions data
 
 @app.get("/question_versions", response_model=List[QuestionVersion])
@@ -7,6 +7,7 @@ sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'cli'))
 
 from notion_cli import (
     reset_db,
+    sync_metadata,
     analyze_notes,
     load_gemini_outputs,
     launch_gui,
@@ -18,11 +19,21 @@ def main():
     subparsers = parser.add_subparsers(dest="command")
 
     # Reset DB from Notion notes and fetch missing metadata
-    subparsers.add_parser(
+    reset_parser = subparsers.add_parser(
         "reset_db",
         help="Reset and populate DB from Notion notes, fetch missing metadata",
         description="Integrate Notion notes, update the database with new IDs, and fetch missing metadata from the Notion API recursively."
     )
+    reset_parser.add_argument("--concurrency", type=int, default=1, help="Number of concurrent crawl workers (default: 1, serial crawl)")
+    reset_parser.add_argument("--discovery", choices=["crawl", "search"], default="crawl", help="Discover pages by recursive crawl or in bulk via the search API (default: crawl)")
+    reset_parser.add_argument("--exports", type=str, default=None, help="Export directory or Notion export .zip to integrate (default: notion_notes/)")
+
+    # Incremental metadata sync
+    subparsers.add_parser(
+        "sync",
+        help="Fetch only pages edited since the last sync",
+        description="Use last_edited_time high-water marks to fetch only pages and database rows edited since the previous sync, updating the database in place."
+    )
 
     # Analyze notes with Gemini
     analyze_parser = subparsers.add_parser(
@@ -32,6 +43,9 @@ def main():
     )
     analyze_parser.add_argument("--questions_version", type=str, help="Question version to use (default: auto-detect latest)")
     analyze_parser.add_argument("--from_date", type=str, help="Only analyze notes created/edited on or after this date (format: DD/MM/YYYY)")
+    analyze_parser.add_argument("--concurrency", type=int, default=1, help="Number of concurrent Gemini requests; backs off automatically on quota errors (default: 1)")
+    analyze_parser.add_argument("--batch_tokens", type=int, default=0, help="Pack short notes into shared prompts of up to this many note tokens, e.g. 6000 (default: 0, one note per prompt)")
+    analyze_parser.add_argument("--mirror_json", action="store_true", help="Also write each result as a JSON file in the outputs folder")
 
     # Load Gemini output JSONs into DB
     subparsers.add_parser(
@@ -58,9 +72,11 @@ def main():
 
     args = parser.parse_args()
     if args.command == "reset_db":
-        reset_db()
+        reset_db(concurrency=args.concurrency, discovery=args.discovery, exports=args.exports)
+    elif args.command == "sync":
+        sync_metadata()
     elif args.command == "analyze_notes":
-        analyze_notes(questions_version=args.questions_version, from_date=args.from_date)
+        analyze_notes(questions_version=args.questions_version, from_date=args.from_date, concurrency=args.concurrency, batch_tokens=args.batch_tokens, mirror_json=args.mirror_json)
     elif args.command == "load_outputs":
         load_gemini_outputs()
     elif args.command == "launch_gui":
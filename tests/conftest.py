@@ -7,6 +7,8 @@ import sqlite3
 
 # Add parent directory to path for imports
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+# cli/ modules import each other by bare name, as when run through notion_explorer.py
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'cli')))
 
 
 @pytest.fixture
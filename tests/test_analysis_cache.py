@@ -0,0 +1,131 @@
+import unittest
+import os
+import sys
+import sqlite3
+
+# Add parent directory to path for imports
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from cli.analysis_cache import AnalysisCache, AnalysisQueue, CACHE_SCHEMA, QUESTION_ANSWERS_SCHEMA, content_hash, questions_hash, is_current
+
+
+class TestAnalysisCache(unittest.TestCase):
+    
+    def setUp(self):
+        self.conn = sqlite3.connect(':memory:')
+        for stmt in CACHE_SCHEMA + QUESTION_ANSWERS_SCHEMA:
+            self.conn.execute(stmt)
+        self.cache = AnalysisCache(self.conn, "4", "Instructions", ["Q1"], "gemini-2.0-flash")
+    
+    def tearDown(self):
+        self.conn.close()
+    
+    def test_content_hash_ignores_whitespace_only_changes(self):
+        self.assertEqual(content_hash("Line one\n\nLine  two "), content_hash("Line one Line two"))
+        self.assertNotEqual(content_hash("Line one"), content_hash("Line two"))
+    
+    def test_questions_hash_changes_with_questions(self):
+        self.assertNotEqual(questions_hash("Instructions", ["Q1"]), questions_hash("Instructions", ["Q1", "Q2"]))
+    
+    def test_results_are_shared_by_content_not_note(self):
+        digest = content_hash("Template text")
+        self.assertIsNone(self.cache.get(digest))
+        self.cache.put(digest, {"q1": "Answer"})
+        self.cache.mark("note-a", digest)
+        self.assertEqual(self.cache.get(digest), {"q1": "Answer"})
+        self.assertEqual(self.cache.status("note-a"), (digest, self.cache.questions_hash))
+        self.assertIsNone(self.cache.status("note-b"))
+        
+        # Another model does not see the result
+        other_model = AnalysisCache(self.conn, "4", "Instructions", ["Q1"], "gemini-2.5-pro")
+        self.assertIsNone(other_model.get(digest))
+    
+    def test_answers_carry_over_to_questions_kept_by_a_new_version(self):
+        digest = content_hash("Note text")
+        old = AnalysisCache(self.conn, "3", "Instructions", ["Kept?", "Dropped?", "Also kept?"], "gemini-2.0-flash")
+        old.put(digest, {"q1": "kept answer", "q2": "dropped answer", "q3": ["also", "kept"]})
+        
+        new = AnalysisCache(self.conn, "4", "New instructions", ["Also kept?", "Brand new?", "Kept?"], "gemini-2.0-flash")
+        self.assertIsNone(new.get(digest))
+        self.assertEqual(new.get_answers(digest), {0: ["also", "kept"], 2: "kept answer"})
+    
+    def test_untracked_results_must_be_complete_and_newer_than_the_edit(self):
+        result = {"q1": "A", "q2": "B", "date_executed": "2024-01-02T09:00:00+00:00"}
+        self.assertTrue(is_current(result, 2, "2024-01-02T08:00:00.000Z"))
+        self.assertFalse(is_current(result, 3, "2024-01-02T08:00:00.000Z"))
+        self.assertFalse(is_current(result, 2, "2024-01-02T10:00:00.000Z"))
+        # Unknown edit or run times cannot vouch for the result
+        self.assertFalse(is_current(result, 2, "NA"))
+        self.assertFalse(is_current({"q1": "A", "q2": "B"}, 2, "2024-01-02T08:00:00.000Z"))
+    
+    def test_hit_rate_and_tokens_saved(self):
+        self.cache.record_hit(120)
+        self.cache.record_hit(80)
+        self.cache.misses = 2
+        self.assertEqual(self.cache.hit_rate(), 0.5)
+        self.assertEqual(self.cache.tokens_saved, 200)
+
+
+
+class FakeSink:
+    """Results by (note_id, version), like AnalysisSink without the database."""
+    def __init__(self, version, found=None):
+        self.version = version
+        self.results = {}
+        self.found = found or {}
+    
+    def stored(self, note_id, version=None):
+        return self.results.get((note_id, version or self.version))
+    
+    def find(self, note_id, version=None):
+        return self.stored(note_id, version) or self.found.get((note_id, version or self.version))
+    
+    def save(self, note_id, result):
+        self.results[(note_id, self.version)] = result
+
+
+class TestAnalysisQueue(unittest.TestCase):
+    
+    def setUp(self):
+        self.conn = sqlite3.connect(':memory:')
+        for stmt in CACHE_SCHEMA + QUESTION_ANSWERS_SCHEMA:
+            self.conn.execute(stmt)
+    
+    def tearDown(self):
+        self.conn.close()
+    
+    def make_queue(self, version, questions, sink, earlier=None):
+        cache = AnalysisCache(self.conn, version, "Instructions", questions, "gemini-2.0-flash")
+        earlier = earlier or {}
+        return AnalysisQueue(cache, sink, f"v{version}", lambda text: len(text), 0,
+                             list(earlier), lambda v: earlier[v])
+    
+    def test_same_content_is_sent_once_and_stored_for_every_note(self):
+        sink = FakeSink("1")
+        queue = self.make_queue("1", ["Q1"], sink)
+        digest = content_hash("Text")
+        notes = [("a", "Text", digest, "2024-01-01T00:00:00.000Z"), ("b", "Text", digest, "2024-01-01T00:00:00.000Z")]
+        self.assertEqual(list(queue.pending(notes)), [("a", "Text", None)])
+        
+        queue.finish("a", {"q1": "Answer", "questions_version": "v1"})
+        self.assertEqual(sink.stored("b")["q1"], "Answer")
+        self.assertEqual(queue.cache.status("b"), (digest, queue.cache.questions_hash))
+        # Both are up to date now
+        self.assertEqual(list(queue.pending(notes)), [])
+        self.assertEqual(queue.cache.up_to_date, 2)
+    
+    def test_only_questions_without_earlier_answers_are_asked(self):
+        digest = content_hash("Text")
+        # Version 1's output predates the cache, but was produced after the last edit
+        found = {("a", "1"): {"q1": "Kept answer", "q2": "Old answer", "date_executed": "2024-01-02T00:00:00"}}
+        sink = FakeSink("2", found)
+        queue = self.make_queue("2", ["Kept?", "Reworded?"], sink, earlier={"1": ["Kept?", "Original?"]})
+        self.assertEqual(list(queue.pending([("a", "Text", digest, "2024-01-01T00:00:00.000Z")])), [("a", "Text", [1])])
+        
+        queue.finish("a", {"q2": "New answer", "questions_version": "v2"})
+        result = sink.stored("a")
+        self.assertEqual((result["q1"], result["q2"]), ("Kept answer", "New answer"))
+
+
+if __name__ == '__main__':
+    unittest.main()
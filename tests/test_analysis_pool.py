@@ -0,0 +1,163 @@
+import unittest
+import os
+import sys
+import threading
+import time
+
+# Add parent directory to path for imports
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from cli.analysis_pool import AIMDController, run_analysis
+
+
+def quota_error(retry_delay=0.01):
+    return {"error": "API quota exceeded", "status_code": 429, "retry_delay": retry_delay}
+
+
+class TestAIMDController(unittest.TestCase):
+    
+    def test_throttle_halves_limit_and_successes_ramp_it_back(self):
+        controller = AIMDController(max_concurrency=8)
+        self.assertTrue(controller.acquire())
+        controller.release(throttled=True, retry_delay=0)
+        self.assertEqual(int(controller.limit), 4)
+        
+        # One step up after `limit` successes in a row
+        for _ in range(4):
+            controller.acquire()
+            controller.release()
+        self.assertEqual(int(controller.limit), 5)
+    
+    def test_limit_never_drops_below_minimum(self):
+        controller = AIMDController(max_concurrency=2)
+        for _ in range(5):
+            controller.acquire()
+            controller.release(throttled=True, retry_delay=0)
+        self.assertEqual(int(controller.limit), 1)
+    
+    def test_retry_delay_pauses_new_calls(self):
+        controller = AIMDController(max_concurrency=4)
+        controller.acquire()
+        controller.release(throttled=True, retry_delay=0.2)
+        start = time.monotonic()
+        controller.acquire()
+        self.assertGreaterEqual(time.monotonic() - start, 0.15)
+    
+    def test_one_burst_of_throttles_is_one_quota_event(self):
+        controller = AIMDController(max_concurrency=8, max_consecutive_throttles=2)
+        generations = [controller.acquire() for _ in range(8)]
+        for generation in generations:
+            controller.release(throttled=True, retry_delay=0, generation=generation)
+        self.assertEqual(int(controller.limit), 4)
+        self.assertEqual(controller.consecutive_throttles, 1)
+        self.assertFalse(controller.exhausted)
+        # A call started after the burst that is throttled again is a new event
+        controller.release(throttled=True, retry_delay=0, generation=controller.acquire())
+        self.assertEqual(int(controller.limit), 2)
+    
+    def test_repeated_throttles_exhaust_quota(self):
+        controller = AIMDController(max_concurrency=1, max_consecutive_throttles=3)
+        for _ in range(3):
+            self.assertTrue(controller.acquire())
+            controller.release(throttled=True, retry_delay=0)
+        self.assertFalse(controller.acquire())
+
+
+class TestRunAnalysis(unittest.TestCase):
+    
+    def test_results_for_every_note_and_concurrency_is_bounded(self):
+        lock = threading.Lock()
+        state = {"active": 0, "peak": 0}
+        def analyze(content, controller):
+            with lock:
+                state["active"] += 1
+                state["peak"] = max(state["peak"], state["active"])
+            time.sleep(0.01)
+            with lock:
+                state["active"] -= 1
+            return {"q1": content.upper()}
+        
+        results = {}
+        caller = threading.current_thread()
+        def on_result(note_id, result):
+            # Results are handed back on the calling thread
+            self.assertIs(threading.current_thread(), caller)
+            results[note_id] = result
+        
+        notes = [(f"note{i}", f"content {i}") for i in range(20)]
+        self.assertEqual(run_analysis(notes, analyze, on_result, concurrency=4), 20)
+        self.assertEqual(results["note7"], {"q1": "CONTENT 7"})
+        self.assertLessEqual(state["peak"], 4)
+        self.assertGreater(state["peak"], 1)
+    
+    def test_quota_errors_are_retried_instead_of_aborting(self):
+        calls = []
+        def analyze(content, controller):
+            calls.append(content)
+            if len(calls) <= 2:
+                return quota_error()
+            return {"q1": content}
+        
+        results = {}
+        completed = run_analysis([("a", "A"), ("b", "B")], analyze,
+                                 lambda note_id, result: results.update({note_id: result}), concurrency=2)
+        self.assertEqual(completed, 2)
+        self.assertEqual(results, {"a": {"q1": "A"}, "b": {"q1": "B"}})
+        self.assertEqual(len(calls), 4)
+    
+    def test_requeued_items_go_through_quota_control(self):
+        calls = []
+        def analyze(payload, controller):
+            calls.append(payload)
+            if payload == ["A", "B"]:
+                return {"a": {"q1": "A"}}  # the batch reply missed "b"
+            if len(calls) == 2:
+                return quota_error()
+            return {"q1": payload}
+        
+        results = {}
+        def on_result(key, result):
+            results[key] = result
+            if key == ("a", "b"):
+                return [("b", "B")]
+        
+        completed = run_analysis([(("a", "b"), ["A", "B"])], analyze, on_result, concurrency=1)
+        self.assertEqual(completed, 2)
+        self.assertEqual(results[("a", "b")], {"a": {"q1": "A"}})
+        self.assertEqual(results["b"], {"q1": "B"})
+        self.assertEqual(calls, [["A", "B"], "B", "B"])
+    
+    def test_concurrent_burst_of_quota_errors_does_not_halt(self):
+        lock = threading.Lock()
+        calls = []
+        started = threading.Barrier(20, timeout=5)
+        def analyze(content, controller):
+            with lock:
+                calls.append(content)
+                first_wave = len(calls) <= 20
+            if first_wave:
+                started.wait()  # all 20 calls are in flight when the quota runs out
+                return quota_error(0)
+            return {"q1": content}
+        
+        results = {}
+        controller = AIMDController(max_concurrency=20)
+        notes = [(f"note{i}", f"content {i}") for i in range(40)]
+        completed = run_analysis(notes, analyze, lambda note_id, result: results.update({note_id: result}),
+                                 concurrency=20, controller=controller)
+        self.assertEqual(completed, 40)
+        self.assertFalse(controller.exhausted)
+        self.assertGreaterEqual(int(controller.limit), 10)
+    
+    def test_exhausted_quota_stops_without_results(self):
+        results = []
+        controller = AIMDController(max_concurrency=1, max_consecutive_throttles=2)
+        notes = [(f"note{i}", "content") for i in range(10)]
+        completed = run_analysis(notes, lambda content, controller: quota_error(0), lambda *args: results.append(args),
+                                 concurrency=1, controller=controller)
+        self.assertEqual(completed, 0)
+        self.assertEqual(results, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -15,7 +15,7 @@ sys.modules['google.genai.errors'] = MagicMock()
 sys.modules['google.genai.errors'].ClientError = Exception
 
 # Now import the modules
-from cli.gemini_utils import parse_retry_delay
+from cli.gemini_utils import parse_retry_delay, QuestionSet
 
 
 class TestGeminiUtils(unittest.TestCase):
@@ -48,7 +48,7 @@ class TestGeminiUtils(unittest.TestCase):
         instructions = "Follow these instructions"
         questions = ["First question?", "Second question?"]
         
-        prompt = build_prompt(note_content, instructions, questions)
+        prompt = build_prompt(note_content, QuestionSet(instructions, questions, "v1"))
         
         self.assertIn("Follow these instructions", prompt)
         self.assertIn("1. First question?", prompt)
@@ -65,15 +65,15 @@ class TestGeminiUtils(unittest.TestCase):
 
     @patch('cli.gemini_utils.load_dotenv')
     @patch('cli.gemini_utils.client')
-    @patch('cli.gemini_utils.load_questions')
+    @patch('cli.gemini_utils.QUESTION_REGISTRY.get')
     @patch('cli.gemini_utils.datetime')
-    def test_call_gemini_api_success(self, mock_datetime, mock_load_questions, mock_client, mock_load_dotenv):
+    def test_call_gemini_api_success(self, mock_datetime, mock_get_questions, mock_client, mock_load_dotenv):
         # Import the function inside the test
         with patch.dict('sys.modules', {'google': MagicMock(), 'google.genai': MagicMock(), 'google.genai.errors': MagicMock()}):
             from cli.gemini_utils import call_gemini_api
             
         # Setup mock responses
-        mock_load_questions.return_value = ("Test instructions", ["Q1", "Q2"], "v1")
+        mock_get_questions.return_value = QuestionSet("Test instructions", ["Q1", "Q2"], "v1")
         
         mock_response = MagicMock()
         mock_response.text = '```json\n{"q1": "Answer 1", "q2": "Answer 2"}\n```'
@@ -99,15 +99,15 @@ class TestGeminiUtils(unittest.TestCase):
 
     @patch('cli.gemini_utils.load_dotenv')
     @patch('cli.gemini_utils.client')
-    @patch('cli.gemini_utils.load_questions')
+    @patch('cli.gemini_utils.QUESTION_REGISTRY.get')
     @patch('cli.gemini_utils.datetime')
-    def test_call_gemini_api_quota_exceeded(self, mock_datetime, mock_load_questions, mock_client, mock_load_dotenv):
+    def test_call_gemini_api_quota_exceeded(self, mock_datetime, mock_get_questions, mock_client, mock_load_dotenv):
         # Import the function inside the test
         with patch.dict('sys.modules', {'google': MagicMock(), 'google.genai': MagicMock(), 'google.genai.errors': MagicMock()}):
             from cli.gemini_utils import call_gemini_api
             
         # Setup mocks
-        mock_load_questions.return_value = ("Test instructions", ["Q1", "Q2"], "v1")
+        mock_get_questions.return_value = QuestionSet("Test instructions", ["Q1", "Q2"], "v1")
         
         # Mock datetime
         mock_now = MagicMock()
@@ -131,21 +131,22 @@ class TestGeminiUtils(unittest.TestCase):
         # Verify results
         self.assertIn("error", result)
         self.assertIn("API quota exceeded", result["error"])
+        self.assertEqual(result["retry_delay"], 30.0)
         self.assertEqual(result["questions_version"], "v1")
         self.assertEqual(result["model"], "gemini-2.0-flash")
         self.assertEqual(result["date_executed"], "2023-01-07T00:00:00Z")
 
     @patch('cli.gemini_utils.load_dotenv')
     @patch('cli.gemini_utils.client')
-    @patch('cli.gemini_utils.load_questions')
+    @patch('cli.gemini_utils.QUESTION_REGISTRY.get')
     @patch('cli.gemini_utils.datetime')
-    def test_call_gemini_api_invalid_response(self, mock_datetime, mock_load_questions, mock_client, mock_load_dotenv):
+    def test_call_gemini_api_invalid_response(self, mock_datetime, mock_get_questions, mock_client, mock_load_dotenv):
         # Import the function inside the test
         with patch.dict('sys.modules', {'google': MagicMock(), 'google.genai': MagicMock(), 'google.genai.errors': MagicMock()}):
             from cli.gemini_utils import call_gemini_api
             
         # Setup mocks
-        mock_load_questions.return_value = ("Test instructions", ["Q1", "Q2"], "v1")
+        mock_get_questions.return_value = QuestionSet("Test instructions", ["Q1", "Q2"], "v1")
         
         # Mock datetime
         mock_now = MagicMock()
@@ -167,6 +168,340 @@ class TestGeminiUtils(unittest.TestCase):
         self.assertEqual(result["model"], "gemini-2.0-flash")
         self.assertEqual(result["date_executed"], "2023-01-07T00:00:00Z")
 
+    @patch('cli.gemini_utils.CONTEXT_CACHE_ENABLED', False)
+    @patch('cli.gemini_utils.client')
+    @patch('cli.gemini_utils.QUESTION_REGISTRY.get')
+    def test_call_gemini_api_question_subset(self, mock_get_questions, mock_client):
+        from cli.gemini_utils import call_gemini_api
+        mock_get_questions.return_value = QuestionSet("Test instructions", ["Q1", "Q2", "Q3", "Q4"], "v4")
+        mock_response = MagicMock()
+        mock_response.text = '{"q1": "answer to Q2", "q2": "answer to Q4"}'
+        mock_client.models.generate_content.return_value = mock_response
+        
+        result = call_gemini_api("Test note content", "4", question_indices=[1, 3])
+        
+        prompt = mock_client.models.generate_content.call_args.kwargs["contents"]
+        self.assertIn("1. Q2", prompt)
+        self.assertIn("2. Q4", prompt)
+        self.assertNotIn("Q3", prompt)
+        self.assertEqual((result["q2"], result["q4"]), ("answer to Q2", "answer to Q4"))
+        self.assertNotIn("q1", result)
+
+
+class TestQuestionRegistry(unittest.TestCase):
+    
+    def setUp(self):
+        import tempfile
+        import shutil
+        from cli.gemini_utils import QuestionRegistry
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+        for version, questions in (("2", ["Old?"]), ("10", ["New?", "Newer?"])):
+            self.write(version, questions)
+        self.registry = QuestionRegistry(self.tmp_dir)
+    
+    def write(self, version, questions, mtime_ns=None):
+        path = os.path.join(self.tmp_dir, f"questions_v{version}.json")
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"instructions": "Instructions", "questions": questions, "version": f"v{version}"}, f)
+        if mtime_ns is not None:
+            os.utime(path, ns=(mtime_ns, mtime_ns))
+    
+    def test_each_version_parsed_once(self):
+        with patch('cli.gemini_utils.json.load', side_effect=json.load) as mock_load:
+            first = self.registry.get("10")
+            second = self.registry.get("10")
+        self.assertIs(first, second)
+        self.assertEqual(mock_load.call_count, 1)
+        self.assertEqual(first.questions_version, "v10")
+        self.assertEqual(first.numbered, "1. New?\n2. Newer?")
+    
+    def test_edits_on_disk_are_picked_up(self):
+        self.write("2", ["Old?"], mtime_ns=1_000_000_000)
+        self.assertEqual(self.registry.get("2").questions, ["Old?"])
+        self.write("2", ["Edited?"], mtime_ns=2_000_000_000)
+        self.assertEqual(self.registry.get("2").questions, ["Edited?"])
+    
+    def test_versions_sorted_numerically(self):
+        self.assertEqual(self.registry.versions(), ["2", "10"])
+        self.assertEqual(self.registry.latest_version(), "10")
+    
+    def test_prompt_builders_use_the_pre_rendered_fragments(self):
+        from cli.gemini_utils import build_prompt, build_prompt_prefix, build_batch_prompt
+        question_set = self.registry.get("10")
+        with patch('cli.gemini_utils.render_numbered_questions') as mock_numbered, \
+             patch('cli.gemini_utils.render_prompt_frame') as mock_frame, \
+             patch('cli.gemini_utils.render_prompt_prefix') as mock_prefix:
+            prompt = build_prompt("Note two", question_set)
+            prefix = build_prompt_prefix(question_set)
+            batch = build_batch_prompt([("id1", "Note one")], question_set)
+        for mock_render in (mock_numbered, mock_frame, mock_prefix):
+            mock_render.assert_not_called()
+        self.assertIn("2. Newer?\n\nInput note:\nNote two\n\nOutput format", prompt)
+        self.assertIn('"q2": "Answer to question 2"', prompt)
+        self.assertIn("2. Newer?\n\nOutput format", prefix)
+        self.assertIn("2. Newer?\n\nInput notes:\n### Note id1", batch)
+
+
+class TestContextCache(unittest.TestCase):
+    
+    def setUp(self):
+        from cli.gemini_utils import ContextCache, TokenUsage
+        from cli.fake_gemini import FakeGeminiClient
+        self.now = [1000.0]
+        clock = lambda: self.now[0]
+        # The test question set is tiny, so lift the minimum cacheable size
+        self.client = FakeGeminiClient(clock=clock, cache_min_tokens=0)
+        for target, value in (('client', self.client),
+                              ('CONTEXT_CACHE', ContextCache(ttl_seconds=600, refresh_seconds=60, min_tokens=0,
+                                                             retry_seconds=30, clock=clock)),
+                              ('TOKEN_USAGE', TokenUsage()),
+                              ('CONTEXT_CACHE_ENABLED', True)):
+            patcher = patch(f'cli.gemini_utils.{target}', value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        questions_patch = patch('cli.gemini_utils.QUESTION_REGISTRY.get',
+                                return_value=QuestionSet("Test instructions", ["Q1", "Q2", "Q3"], "v1"))
+        questions_patch.start()
+        self.addCleanup(questions_patch.stop)
+    
+    def test_prefix_cached_once_and_only_note_sent(self):
+        import cli.gemini_utils as gemini_utils
+        first = gemini_utils.call_gemini_api("First note")
+        second = gemini_utils.call_gemini_api("Second note")
+        
+        self.assertEqual(self.client.caches.created, 1)
+        self.assertEqual([first["q3"], second["q1"]], ["Fake answer 3", "Fake answer 1"])
+        calls = self.client.models.calls
+        self.assertEqual([call["contents"] for call in calls], ["Input note:\nFirst note", "Input note:\nSecond note"])
+        self.assertTrue(all(call["cached_content"] for call in calls))
+        
+        usage = gemini_utils.TOKEN_USAGE
+        self.assertEqual(usage.requests, 2)
+        self.assertGreater(usage.cached_tokens, usage.uncached_tokens)
+    
+    def test_handle_refreshed_before_expiry_and_recreated_after(self):
+        import cli.gemini_utils as gemini_utils
+        gemini_utils.call_gemini_api("Note")
+        # Inside the refresh window: the TTL is extended, the handle kept
+        self.now[0] += 560
+        gemini_utils.call_gemini_api("Note")
+        self.assertEqual((self.client.caches.created, self.client.caches.updated), (1, 1))
+        # Long after expiry: a new handle is created
+        self.now[0] += 5000
+        gemini_utils.call_gemini_api("Note")
+        self.assertEqual(self.client.caches.created, 2)
+    
+    def test_server_side_expiry_falls_back_to_full_prompt(self):
+        import cli.gemini_utils as gemini_utils
+        gemini_utils.call_gemini_api("Note")
+        self.client.caches.entries.clear()
+        
+        result = gemini_utils.call_gemini_api("Another note")
+        
+        self.assertEqual(result["q2"], "Fake answer 2")
+        last_call = self.client.models.calls[-1]
+        self.assertIsNone(last_call["cached_content"])
+        self.assertIn("1. Q1", last_call["contents"])
+        # The stale handle is dropped, so the next call caches the prefix again
+        gemini_utils.call_gemini_api("Third note")
+        self.assertEqual(self.client.caches.created, 2)
+    
+    def test_uncacheable_prefix_uses_full_prompts(self):
+        import cli.gemini_utils as gemini_utils
+        self.client.caches.min_tokens = 10 ** 6
+        with patch.object(self.client.caches, 'create', wraps=self.client.caches.create) as mock_create:
+            gemini_utils.call_gemini_api("Note")
+            self.now[0] += 5000
+            gemini_utils.call_gemini_api("Note")
+        mock_create.assert_called_once()
+        self.assertTrue(all(call["cached_content"] is None for call in self.client.models.calls))
+        self.assertEqual(gemini_utils.TOKEN_USAGE.cached_tokens, 0)
+    
+    def test_transient_cache_error_is_retried_later(self):
+        import cli.gemini_utils as gemini_utils
+        unavailable = Exception("503 UNAVAILABLE")
+        unavailable.code = 503
+        with patch.object(self.client.caches, 'create', side_effect=[unavailable, ConnectionError("reset")]) as mock_create:
+            gemini_utils.call_gemini_api("Note")
+            gemini_utils.call_gemini_api("Note")  # within retry_seconds: no new attempt
+            self.now[0] += 31
+            gemini_utils.call_gemini_api("Note")
+        self.assertEqual(mock_create.call_count, 2)
+        self.now[0] += 31
+        gemini_utils.call_gemini_api("Note")
+        self.assertEqual(self.client.caches.created, 1)
+        self.assertIsNotNone(self.client.models.calls[-1]["cached_content"])
+    
+    def test_short_prefix_is_not_sent_for_caching(self):
+        import cli.gemini_utils as gemini_utils
+        from cli.gemini_utils import ContextCache, QUESTIONS_DIR, build_prompt_prefix
+        cache = ContextCache(clock=lambda: self.now[0])
+        with patch.object(self.client.caches, 'create') as mock_create:
+            for name in sorted(os.listdir(QUESTIONS_DIR)):
+                with open(os.path.join(QUESTIONS_DIR, name), encoding="utf-8") as f:
+                    data = json.load(f)
+                question_set = QuestionSet(data["instructions"], data["questions"], data["version"])
+                self.assertIsNone(cache.handle(build_prompt_prefix(question_set)))
+        mock_create.assert_not_called()
+
+
+class TestLongNotes(unittest.TestCase):
+    
+    def test_split_prefers_headings_then_paragraphs(self):
+        from cli.gemini_utils import split_into_chunks, estimate_tokens
+        intro = "# Intro\n" + "intro words " * 10
+        journal = "# Journal\n" + "\n\n".join(f"Entry {i}: " + "day " * 30 for i in range(6))
+        chunks = split_into_chunks(intro + "\n" + journal, max_tokens=60)
+        
+        self.assertTrue(all(estimate_tokens(chunk) <= 60 for chunk in chunks))
+        self.assertTrue(chunks[0].startswith("# Intro"))
+        self.assertTrue(chunks[1].startswith("# Journal"))
+        # Paragraphs are never cut in half
+        self.assertEqual(sum(chunk.count("Entry ") for chunk in chunks), 6)
+        self.assertTrue(all(chunk.count("day") % 30 == 0 for chunk in chunks[1:]))
+    
+    def test_oversized_paragraph_is_cut(self):
+        from cli.gemini_utils import split_into_chunks
+        chunks = split_into_chunks("x" * 1000, max_tokens=50)
+        self.assertEqual("".join(chunks), "x" * 1000)
+        self.assertTrue(all(len(chunk) <= 200 for chunk in chunks))
+    
+    @patch('cli.gemini_utils.CHUNK_TOKENS', 50)
+    @patch('cli.gemini_utils.CHUNK_THRESHOLD_TOKENS', 100)
+    @patch('cli.gemini_utils.CONTEXT_CACHE_ENABLED', False)
+    @patch('cli.gemini_utils.QUESTION_REGISTRY.get', return_value=QuestionSet("Test instructions", ["Q1", "Q2"], "v1"))
+    def test_long_note_map_reduce(self, mock_get_questions):
+        import cli.gemini_utils as gemini_utils
+        from cli.fake_gemini import FakeGeminiClient
+        fake = FakeGeminiClient()
+        long_note = "\n\n".join(f"## Day {i}\n" + "words " * 30 for i in range(5))
+        with patch('cli.gemini_utils.client', fake), \
+             patch('cli.gemini_utils.analyze_long_note', wraps=gemini_utils.analyze_long_note) as mock_long:
+            result = gemini_utils.call_gemini_api(long_note, question_indices=[1])
+            short = gemini_utils.call_gemini_api("A short note")
+        
+        mock_long.assert_called_once()
+        prompts = [call["contents"] for call in fake.models.calls]
+        map_prompts = [p for p in prompts if "of a longer note]" in p]
+        reduce_prompts = [p for p in prompts if "Partial answers" in p]
+        self.assertEqual(len(map_prompts), 5)
+        self.assertEqual(len(reduce_prompts), 1)
+        self.assertIn('"Fake answer 1"', reduce_prompts[0])
+        # Only the requested question, under its position in the full list
+        self.assertEqual(result["q2"], "Fake answer 1")
+        self.assertEqual(result["questions_version"], "v1")
+        self.assertEqual(short["q2"], "Fake answer 2")
+    
+    @patch('cli.gemini_utils.CHUNK_TOKENS', 50)
+    @patch('cli.gemini_utils.CHUNK_THRESHOLD_TOKENS', 100)
+    @patch('cli.gemini_utils.CONTEXT_CACHE_ENABLED', False)
+    @patch('cli.gemini_utils.QUESTION_REGISTRY.get', return_value=QuestionSet("Test instructions", ["Q1"], "v1"))
+    @patch('cli.gemini_utils.client')
+    def test_chunk_calls_share_the_concurrency_limit(self, mock_client, mock_get_questions):
+        import threading
+        import time
+        import cli.gemini_utils as gemini_utils
+        from cli.analysis_pool import run_analysis
+        lock = threading.Lock()
+        state = {"active": 0, "peak": 0}
+        def respond(model, contents, config=None):
+            with lock:
+                state["active"] += 1
+                state["peak"] = max(state["peak"], state["active"])
+            time.sleep(0.02)
+            with lock:
+                state["active"] -= 1
+            response = MagicMock()
+            response.text = '{"q1": "answer"}'
+            return response
+        mock_client.models.generate_content.side_effect = respond
+        long_note = "\n\n".join(f"## Day {i}\n" + "words " * 30 for i in range(6))
+        
+        for concurrency in (1, 3):
+            state["peak"] = 0
+            notes = [("long1", long_note), ("long2", long_note), ("short", "A short note")]
+            analyze = lambda content, controller: gemini_utils.call_gemini_api(content, controller=controller)
+            completed = run_analysis(notes, analyze, lambda *args: None, concurrency=concurrency)
+            self.assertEqual(completed, 3)
+            self.assertLessEqual(state["peak"], concurrency)
+        self.assertGreater(state["peak"], 1)
+    
+    @patch('cli.gemini_utils.CONTEXT_CACHE_ENABLED', False)
+    @patch('cli.gemini_utils.client')
+    def test_unparseable_reduce_joins_partial_answers(self, mock_client):
+        from cli.gemini_utils import analyze_long_note
+        def respond(model, contents, config=None):
+            response = MagicMock()
+            if "Partial answers" in contents:
+                response.text = "not json"
+            else:
+                part = contents.split("[Part ", 1)[1].split(" ", 1)[0]
+                response.text = json.dumps({"q1": f"part {part}"})
+            return response
+        mock_client.models.generate_content.side_effect = respond
+        
+        result = analyze_long_note("one\n\ntwo\n\nthree", QuestionSet("Instructions", ["Q1"], "v1"), chunk_tokens=2)
+        
+        # "one" and "two" fit one chunk, "three" gets its own
+        self.assertEqual(result, {"q1": "part 1\n\npart 2"})
+
+
+class TestBatchedPrompts(unittest.TestCase):
+    
+    def test_pack_batches_greedy_within_budget(self):
+        from cli.gemini_utils import pack_batches
+        notes = [("a", "x" * 400), ("b", "x" * 400), ("c", "x" * 400), ("big", "x" * 4000), ("d", "x" * 40)]
+        batches = list(pack_batches(notes, token_budget=250, max_notes=10))
+        self.assertEqual([[note_id for note_id, _ in batch] for batch in batches],
+                         [["a", "b"], ["c"], ["big"], ["d"]])
+        # The note cap applies even when the budget would allow more
+        batches = list(pack_batches([(str(i), "short") for i in range(5)], token_budget=1000, max_notes=2))
+        self.assertEqual([len(batch) for batch in batches], [2, 2, 1])
+    
+    def test_build_batch_prompt_lists_each_note_once(self):
+        from cli.gemini_utils import build_batch_prompt
+        prompt = build_batch_prompt([("id1", "First note"), ("id2", "Second note")],
+                                    QuestionSet("Follow these instructions", ["Q1?", "Q2?"], "v1"))
+        self.assertEqual(prompt.count("Follow these instructions"), 1)
+        self.assertIn("### Note id1\nFirst note", prompt)
+        self.assertIn("### Note id2\nSecond note", prompt)
+        self.assertIn('"q2"', prompt)
+    
+    @patch('cli.gemini_utils.call_gemini_api')
+    @patch('cli.gemini_utils.client')
+    @patch('cli.gemini_utils.QUESTION_REGISTRY.get')
+    @patch('cli.gemini_utils.datetime')
+    def test_batch_results_split_per_note(self, mock_datetime, mock_get_questions, mock_client, mock_single):
+        from cli.gemini_utils import call_gemini_api_batch
+        mock_get_questions.return_value = QuestionSet("Test instructions", ["Q1", "Q2"], "v1")
+        mock_datetime.now.return_value.isoformat.return_value = "2023-01-07T00:00:00Z"
+        mock_response = MagicMock()
+        mock_response.text = '```json\n{"id1": {"q1": "A1", "q2": "A2"}, "id2": {"q1": "only one answer"}}\n```'
+        mock_client.models.generate_content.return_value = mock_response
+        
+        results = call_gemini_api_batch([("id1", "Note one"), ("id2", "Note two")])
+        
+        mock_client.models.generate_content.assert_called_once()
+        self.assertEqual(results["id1"], {"q1": "A1", "q2": "A2", "questions_version": "v1",
+                                          "model": "gemini-2.0-flash", "date_executed": "2023-01-07T00:00:00Z"})
+        # An incomplete answer is left for the caller to retry as a single-note call
+        self.assertNotIn("id2", results)
+        mock_single.assert_not_called()
+    
+    @patch('cli.gemini_utils.call_gemini_api')
+    @patch('cli.gemini_utils.client')
+    @patch('cli.gemini_utils.QUESTION_REGISTRY.get')
+    def test_batch_quota_error_is_returned_for_retry(self, mock_get_questions, mock_client, mock_single):
+        from cli.gemini_utils import call_gemini_api_batch
+        mock_get_questions.return_value = QuestionSet("Test instructions", ["Q1"], "v1")
+        mock_client.models.generate_content.side_effect = Exception("429 RESOURCE_EXHAUSTED")
+        
+        result = call_gemini_api_batch([("id1", "Note one"), ("id2", "Note two")])
+        
+        self.assertEqual(result["status_code"], 429)
+        mock_single.assert_not_called()
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -8,13 +8,17 @@ from fastapi.testclient import TestClient
 
 # Add parent directory to path for imports
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import gui_backend
 from gui_backend import app
 
+SORT_KEY = "CASE WHEN last_edited_time GLOB '[0-9][0-9][0-9][0-9]-*' THEN last_edited_time ELSE '' END"
+
 
 class TestGUIBackend(unittest.TestCase):
     
     def setUp(self):
         self.client = TestClient(app)
+        gui_backend.ANSWER_CACHE.clear()
     
     @patch('gui_backend.sqlite3.connect')
     def test_get_notes(self, mock_connect):
@@ -24,27 +28,162 @@ class TestGUIBackend(unittest.TestCase):
         mock_connect.return_value = mock_conn
         mock_conn.cursor.return_value = mock_cursor
         
-        # Mock query results
+        # Mock query results: sort key and id first, then the projected fields
         mock_cursor.fetchall.return_value = [
-            ('note1', 'parent1', '2023-01-01', '2023-01-02', 'Test content 1'),
-            ('note2', 'parent2', '2023-01-03', '2023-01-04', 'Test content 2')
+            ('2023-01-04', 'note2', 'note2', 'Test content 2'),
+            ('2023-01-02', 'note1', 'note1', 'Test content 1'),
+            ('2023-01-01', 'note0', 'note0', 'Test content 0'),
         ]
         
         # Call the endpoint
-        response = self.client.get('/notes')
+        response = self.client.get('/notes?fields=id,content&limit=2')
         
-        # Check the response
+        # Check the response: one extra row fetched means there is a next page
         self.assertEqual(response.status_code, 200)
         data = response.json()
-        self.assertEqual(len(data), 2)
-        self.assertEqual(data[0]['id'], 'note1')
-        self.assertEqual(data[0]['parent_id'], 'parent1')
-        self.assertEqual(data[1]['id'], 'note2')
-        self.assertEqual(data[1]['content'], 'Test content 2')
+        self.assertEqual(data['notes'], [{'id': 'note2', 'content': 'Test content 2'},
+                                         {'id': 'note1', 'content': 'Test content 1'}])
+        self.assertIsNotNone(data['next_cursor'])
         
         # Verify the mock was called correctly
         mock_cursor.execute.assert_called_once_with(
-            "SELECT id, parent_id, created_time, last_edited_time, content FROM pages"
+            f"SELECT {SORT_KEY}, id, id AS id, content AS content FROM pages "
+            f"ORDER BY {SORT_KEY} DESC, id DESC LIMIT ?",
+            [3]
+        )
+        
+        # The cursor resumes after the last returned note
+        mock_cursor.reset_mock()
+        mock_cursor.fetchall.return_value = [('2023-01-01', 'note0', 'note0', 'Test content 0')]
+        response = self.client.get('/notes', params={'fields': 'id,content', 'limit': 2, 'cursor': data['next_cursor']})
+        self.assertEqual(response.json(), {'notes': [{'id': 'note0', 'content': 'Test content 0'}], 'next_cursor': None})
+        mock_cursor.execute.assert_called_once_with(
+            f"SELECT {SORT_KEY}, id, id AS id, content AS content FROM pages "
+            f"WHERE {SORT_KEY} <= ? AND ({SORT_KEY} < ? OR id < ?) "
+            f"ORDER BY {SORT_KEY} DESC, id DESC LIMIT ?",
+            ['2023-01-02', '2023-01-02', 'note1', 3]
+        )
+    
+    @patch('gui_backend.sqlite3.connect')
+    def test_get_notes_projection_and_limits(self, mock_connect):
+        mock_conn = MagicMock()
+        mock_cursor = MagicMock()
+        mock_connect.return_value = mock_conn
+        mock_conn.cursor.return_value = mock_cursor
+        mock_cursor.fetchall.return_value = []
+        
+        # Content is left out unless requested
+        response = self.client.get('/notes')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {'notes': [], 'next_cursor': None})
+        query, params = mock_cursor.execute.call_args.args
+        self.assertNotIn('content AS content', query)
+        self.assertIn('content_length AS content_length', query)
+        self.assertEqual(params, [201])
+        
+        self.assertEqual(self.client.get('/notes?fields=id,secret').status_code, 400)
+        self.assertEqual(self.client.get('/notes?limit=5000').status_code, 422)
+        self.assertEqual(self.client.get('/notes?cursor=not-a-cursor').status_code, 400)
+    
+    @patch('gui_backend.sqlite3.connect')
+    def test_query_notes(self, mock_connect):
+        mock_conn = MagicMock()
+        mock_cursor = MagicMock()
+        mock_connect.return_value = mock_conn
+        mock_conn.cursor.return_value = mock_cursor
+        mock_cursor.fetchall.return_value = [('2023-01-02', 'note1', 'note1')]
+        
+        response = self.client.get('/notes/query', params={
+            'fields': 'id', 'order': 'asc', 'limit': 10, 'has_content': 'true', 'has_answers': 'true',
+            'versions': ['v1', 'v2'], 'edited_after': '2023-01-01', 'edited_before': '2024-01-01',
+            'text': 'weekly rev'})
+        
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {'notes': [{'id': 'note1'}], 'next_cursor': None})
+        # Versions imply has_answers; the filters and sort run in a single query
+        mock_cursor.execute.assert_called_once_with(
+            f"SELECT {SORT_KEY}, id, id AS id FROM pages WHERE content_length > 0 AND "
+            "EXISTS (SELECT 1 FROM gemini_analysis g WHERE g.note_id = pages.id AND g.questions_version IN (?, ?)) AND "
+            f"{SORT_KEY} >= ? AND {SORT_KEY} != '' AND {SORT_KEY} < ? AND "
+            "id IN (SELECT d.note_id FROM search_index JOIN search_docs d ON d.docid = search_index.rowid "
+            "WHERE search_index MATCH ? AND d.kind = 'note') "
+            f"ORDER BY {SORT_KEY} ASC, id ASC LIMIT ?",
+            ['v1', 'v2', '2023-01-01', '2024-01-01', '"weekly" "rev"*', 11]
+        )
+        
+        # Without versions, has_answers checks for any analysis
+        self.client.get('/notes/query', params={'fields': 'id', 'has_answers': 'true'})
+        query = mock_cursor.execute.call_args.args[0]
+        self.assertIn("EXISTS (SELECT 1 FROM gemini_analysis g WHERE g.note_id = pages.id) ORDER BY", query)
+    
+    def test_notes_without_iso_timestamps_sort_as_undated(self):
+        import sqlite3
+        import tempfile
+        import shutil
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        db_path = os.path.join(tmp_dir, "notes.db")
+        conn = sqlite3.connect(db_path)
+        conn.execute("CREATE TABLE pages (id TEXT PRIMARY KEY, parent_id TEXT, created_time TEXT, "
+                     "last_edited_time TEXT, content TEXT, content_length INTEGER)")
+        conn.executemany("INSERT INTO pages (id, last_edited_time) VALUES (?, ?)",
+                         [("dated", "2024-01-02T00:00:00.000Z"), ("failed", "NA"), ("missing", None)])
+        conn.commit()
+        conn.close()
+        
+        with patch('gui_backend.DB_PATH', db_path):
+            newest = self.client.get('/notes', params={'fields': 'id'}).json()['notes']
+            after = self.client.get('/notes/query', params={'fields': 'id', 'edited_after': '2024-01-01'}).json()['notes']
+            before = self.client.get('/notes/query', params={'fields': 'id', 'edited_before': '2025-01-01'}).json()['notes']
+        self.assertEqual([note['id'] for note in newest], ['dated', 'missing', 'failed'])
+        self.assertEqual(after, [{'id': 'dated'}])
+        self.assertEqual(before, [{'id': 'dated'}])
+    
+    @patch('gui_backend.sqlite3.connect')
+    def test_search(self, mock_connect):
+        mock_conn = MagicMock()
+        mock_cursor = MagicMock()
+        mock_connect.return_value = mock_conn
+        mock_conn.cursor.return_value = mock_cursor
+        mock_cursor.fetchall.return_value = [
+            ('note1', 'note', '', '', 'the **main** theme', -2.5),
+            ('note2', 'answers', 'v1', 'gemini-2.0-flash', '**main** insight', -1.0),
+        ]
+        
+        response = self.client.get('/search', params={'q': 'main "theme', 'limit': 1})
+        
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {
+            'hits': [{'note_id': 'note1', 'kind': 'note', 'questions_version': None, 'model': None,
+                      'snippet': 'the **main** theme', 'score': 2.5}],
+            'next_offset': 1,
+        })
+        # User input is quoted so it can't break the FTS5 query syntax
+        mock_cursor.execute.assert_called_once_with(
+            "SELECT d.note_id, d.kind, d.questions_version, d.model, "
+            "snippet(search_index, 0, '**', '**', '…', 16), bm25(search_index) "
+            "FROM search_index JOIN search_docs d ON d.docid = search_index.rowid "
+            "WHERE search_index MATCH ? ORDER BY bm25(search_index) LIMIT ? OFFSET ?",
+            ['"main" """theme"*', 2, 0]
+        )
+        
+        self.assertEqual(self.client.get('/search', params={'q': ' '}).status_code, 400)
+    
+    @patch('gui_backend.sqlite3.connect')
+    def test_get_notes_index(self, mock_connect):
+        mock_conn = MagicMock()
+        mock_cursor = MagicMock()
+        mock_connect.return_value = mock_conn
+        mock_conn.cursor.return_value = mock_cursor
+        mock_cursor.fetchall.return_value = [('note1', 'parent1', '2023-01-01', '2023-01-02', 14)]
+        
+        response = self.client.get('/notes/index')
+        
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), [{'id': 'note1', 'parent_id': 'parent1', 'created_time': '2023-01-01',
+                                            'last_edited_time': '2023-01-02', 'content_length': 14}])
+        mock_cursor.execute.assert_called_once_with(
+            "SELECT id, parent_id, created_time, last_edited_time, content_length FROM pages"
         )
     
     @patch('gui_backend.sqlite3.connect')
@@ -120,6 +259,47 @@ class TestGUIBackend(unittest.TestCase):
             ('note1',)
         )
     
+    @patch('gui_backend.sqlite3.connect')
+    def test_get_answers_bulk(self, mock_connect):
+        mock_conn = MagicMock()
+        mock_cursor = MagicMock()
+        mock_connect.return_value = mock_conn
+        mock_conn.cursor.return_value = mock_cursor
+        mock_cursor.fetchall.return_value = [
+            ('note1', 'v1', 'gemini-2.0-flash', '2023-01-07', '{"q1": "A"}'),
+            ('note1', 'v2', 'gemini-2.0-flash', '2023-01-08', '{"q1": "B"}'),
+            # Written as a Python literal by an old loader: decoded without eval
+            ('note2', 'v1', 'gemini-2.0-flash', '2023-01-07', "{'q1': 'C', 'q2': None}"),
+        ]
+        
+        response = self.client.get('/answers?ids=note1,note2&ids=note3&ids=note1')
+        
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual([a['answers_json'] for a in data['note1']], [{'q1': 'A'}, {'q1': 'B'}])
+        self.assertEqual(data['note2'][0]['answers_json'], {'q1': 'C', 'q2': None})
+        self.assertNotIn('note3', data)
+        mock_cursor.execute.assert_called_once_with(
+            "SELECT note_id, questions_version, model, date_executed, answers_json FROM gemini_analysis "
+            "WHERE note_id IN (?, ?, ?)",
+            ['note1', 'note2', 'note3']
+        )
+        
+        too_many = ','.join(f'n{i}' for i in range(gui_backend.ANSWERS_MAX_IDS + 1))
+        self.assertEqual(self.client.get(f'/answers?ids={too_many}').status_code, 400)
+    
+    def test_answer_cache_is_bounded_and_keyed_by_run(self):
+        cache = gui_backend.AnswerCache(maxsize=2)
+        with patch('gui_backend.decode_answers', wraps=gui_backend.decode_answers) as mock_decode:
+            self.assertEqual(cache.get(('n1', 'v1', 'm', 'd1'), '{"q1": "A"}'), {'q1': 'A'})
+            self.assertEqual(cache.get(('n1', 'v1', 'm', 'd1'), '{"q1": "A"}'), {'q1': 'A'})
+            self.assertEqual(mock_decode.call_count, 1)
+            # A re-analysis has a new date_executed, so it is decoded afresh
+            self.assertEqual(cache.get(('n1', 'v1', 'm', 'd2'), '{"q1": "B"}'), {'q1': 'B'})
+            cache.get(('n2', 'v1', 'm', 'd1'), '{}')
+            self.assertEqual(list(cache.entries), [('n1', 'v1', 'm', 'd2'), ('n2', 'v1', 'm', 'd1')])
+        self.assertEqual(gui_backend.decode_answers("__import__('os')"), {})
+    
     @patch('gui_backend.sqlite3.connect')
     def test_get_answers_index(self, mock_connect):
         # Mock database connection and cursor
@@ -202,6 +382,59 @@ class TestGUIBackend(unittest.TestCase):
             "SELECT id, parent_id FROM pages"
         )
     
+    @patch('gui_backend.sqlite3.connect')
+    def test_get_hierarchy_subtree(self, mock_connect):
+        mock_conn = MagicMock()
+        mock_cursor = MagicMock()
+        mock_connect.return_value = mock_conn
+        mock_conn.cursor.return_value = mock_cursor
+        
+        # Mock query results (id, parent_id, title, depth, child_count)
+        mock_cursor.fetchall.return_value = [
+            ('child1', 'parent1', 'Child one', 1, 1),
+            ('grandchild1', 'child1', 'Grandchild', 2, 0),
+        ]
+        
+        response = self.client.get('/hierarchy/parent1/subtree?max_depth=2&limit=10')
+        
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), [
+            {'id': 'child1', 'parent_id': 'parent1', 'title': 'Child one', 'depth': 1, 'child_count': 1},
+            {'id': 'grandchild1', 'parent_id': 'child1', 'title': 'Grandchild', 'depth': 2, 'child_count': 0},
+        ])
+        query, params = mock_cursor.execute.call_args[0]
+        self.assertIn("FROM (SELECT descendant AS node_id, depth FROM page_closure "
+                      "WHERE ancestor = ? AND depth BETWEEN 1 AND ?) n", query)
+        self.assertTrue(query.endswith("ORDER BY n.depth, n.node_id LIMIT ?"))
+        self.assertEqual(params, ['parent1', 2, 10])
+        
+        # Ancestors come back from the top down
+        mock_cursor.reset_mock()
+        mock_cursor.fetchall.return_value = []
+        self.client.get('/hierarchy/grandchild1/ancestors')
+        query, params = mock_cursor.execute.call_args[0]
+        self.assertIn("WHERE descendant = ? AND depth > 0) n", query)
+        self.assertTrue(query.endswith("ORDER BY n.depth DESC"))
+        self.assertEqual(params, ['grandchild1'])
+        
+        self.assertEqual(self.client.get('/hierarchy/parent1/subtree?max_depth=0').status_code, 422)
+    
+    @patch('gui_backend.sqlite3.connect')
+    def test_get_hierarchy_count(self, mock_connect):
+        mock_conn = MagicMock()
+        mock_cursor = MagicMock()
+        mock_connect.return_value = mock_conn
+        mock_conn.cursor.return_value = mock_cursor
+        mock_cursor.fetchone.return_value = (2, 5)
+        
+        response = self.client.get('/hierarchy/parent1/count')
+        
+        self.assertEqual(response.json(), {'id': 'parent1', 'children': 2, 'descendants': 5})
+        mock_cursor.execute.assert_called_once_with(
+            "SELECT COUNT(CASE WHEN depth = 1 THEN 1 END), COUNT(*) FROM page_closure WHERE ancestor = ? AND depth > 0",
+            ('parent1',)
+        )
+    
     @patch('gui_backend.sqlite3.connect')
     def test_get_question_versions(self, mock_connect):
         # Mock database connection and cursor
@@ -35,12 +35,54 @@ class TestNotionExplorerIntegration(unittest.TestCase):
         main()
         mock_reset_db.assert_called_once()
     
+    @patch('sys.argv', ['notion_explorer.py', 'reset_db', '--concurrency', '8'])
+    @patch('notion_explorer.reset_db')
+    def test_reset_db_concurrency(self, mock_reset_db):
+        """Test the reset_db command with a concurrent crawl"""
+        main()
+        mock_reset_db.assert_called_once_with(concurrency=8, discovery="crawl", exports=None)
+    
+    @patch('sys.argv', ['notion_explorer.py', 'reset_db', '--discovery', 'search'])
+    @patch('notion_explorer.reset_db')
+    def test_reset_db_search_discovery(self, mock_reset_db):
+        """Test the reset_db command with search-API discovery"""
+        main()
+        mock_reset_db.assert_called_once_with(concurrency=1, discovery="search", exports=None)
+    
+    @patch('sys.argv', ['notion_explorer.py', 'reset_db', '--exports', 'Export-workspace.zip'])
+    @patch('notion_explorer.reset_db')
+    def test_reset_db_zip_exports(self, mock_reset_db):
+        """Test the reset_db command reading exports from a zip archive"""
+        main()
+        mock_reset_db.assert_called_once_with(concurrency=1, discovery="crawl", exports="Export-workspace.zip")
+    
+    @patch('sys.argv', ['notion_explorer.py', 'sync'])
+    @patch('notion_explorer.sync_metadata')
+    def test_sync_command(self, mock_sync):
+        """Test the sync command"""
+        main()
+        mock_sync.assert_called_once_with()
+    
+    @patch('sys.argv', ['notion_explorer.py', 'analyze_notes', '--concurrency', '16'])
+    @patch('notion_explorer.analyze_notes')
+    def test_analyze_notes_concurrency(self, mock_analyze_notes):
+        """Test the analyze_notes command with concurrent Gemini requests"""
+        main()
+        mock_analyze_notes.assert_called_once_with(questions_version=None, from_date=None, concurrency=16, batch_tokens=0, mirror_json=False)
+    
+    @patch('sys.argv', ['notion_explorer.py', 'analyze_notes', '--batch_tokens', '6000'])
+    @patch('notion_explorer.analyze_notes')
+    def test_analyze_notes_batched(self, mock_analyze_notes):
+        """Test the analyze_notes command with batched prompts"""
+        main()
+        mock_analyze_notes.assert_called_once_with(questions_version=None, from_date=None, concurrency=1, batch_tokens=6000, mirror_json=False)
+    
     @patch('sys.argv', ['notion_explorer.py', 'analyze_notes', '--questions_version', '2', '--from_date', '01/01/2024'])
     @patch('notion_explorer.analyze_notes')
     def test_analyze_notes_command(self, mock_analyze_notes):
         """Test the analyze_notes command with parameters"""
         main()
-        mock_analyze_notes.assert_called_once_with(questions_version='2', from_date='01/01/2024')
+        mock_analyze_notes.assert_called_once_with(questions_version='2', from_date='01/01/2024', concurrency=1, batch_tokens=0, mirror_json=False)
     
     @patch('sys.argv', ['notion_explorer.py', 'load_outputs'])
     @patch('notion_explorer.load_gemini_outputs')
@@ -0,0 +1,123 @@
+import time
+import unittest
+from unittest.mock import patch, MagicMock
+import os
+import sys
+import requests
+
+# Add parent directory to path for imports
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from cli.notion_api import NotionClient, TokenBucket
+
+
+def make_response(status_code, headers=None, payload=None):
+    resp = MagicMock()
+    resp.status_code = status_code
+    resp.headers = headers or {}
+    resp.json.return_value = payload or {}
+    if status_code >= 400:
+        resp.raise_for_status.side_effect = requests.HTTPError(f"{status_code} error")
+    return resp
+
+
+class TestTokenBucket(unittest.TestCase):
+    
+    @patch('time.sleep')
+    def test_acquire_within_capacity(self, mock_sleep):
+        bucket = TokenBucket(rate=2, capacity=2)
+        bucket.acquire()
+        bucket.acquire()
+        mock_sleep.assert_not_called()
+        
+        # Bucket is empty: half a second at 2 tokens/s refills exactly one token
+        bucket.updated -= 0.5
+        bucket.acquire()
+        mock_sleep.assert_not_called()
+        self.assertLess(bucket.tokens, 1)
+    
+    def test_acquire_waits_when_empty(self):
+        bucket = TokenBucket(rate=1000, capacity=1)
+        bucket.acquire()
+        # Freeze the clock so the refill can't race the second acquire; each sleep advances it
+        now = [time.monotonic()]
+        def sleep(seconds):
+            now[0] += seconds
+        with patch('time.monotonic', side_effect=lambda: now[0]), \
+             patch('time.sleep', side_effect=sleep) as mock_sleep:
+            bucket.updated = now[0]
+            bucket.acquire()
+        self.assertTrue(mock_sleep.called)
+        self.assertLessEqual(mock_sleep.call_args[0][0], 0.001)
+
+
+class TestNotionClient(unittest.TestCase):
+    
+    def setUp(self):
+        self.client = NotionClient("secret", pool_size=4, connect_timeout=2, read_timeout=5,
+                                   max_retries=3, backoff_base=1.0, backoff_max=8.0)
+    
+    def test_session_configuration(self):
+        self.assertEqual(self.client.session.headers["Authorization"], "Bearer secret")
+        self.assertEqual(self.client.session.headers["Notion-Version"], "2022-06-28")
+        adapter = self.client.session.get_adapter("https://api.notion.com/v1/pages/x")
+        self.assertEqual(adapter._pool_maxsize, 4)
+        self.assertEqual(self.client.timeout, (2, 5))
+    
+    @patch('time.sleep')
+    def test_retry_after_header_is_respected(self, mock_sleep):
+        with patch.object(self.client.session, 'request',
+                          side_effect=[make_response(429, {"Retry-After": "7"}), make_response(200)]) as mock_request:
+            resp = self.client.get("https://api.notion.com/v1/pages/x")
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(mock_request.call_count, 2)
+        mock_sleep.assert_called_once_with(7.0)
+        self.assertEqual(mock_request.call_args[1]["timeout"], (2, 5))
+    
+    @patch('time.sleep')
+    @patch('random.uniform', side_effect=lambda low, high: high)
+    def test_exponential_backoff_on_server_errors(self, mock_uniform, mock_sleep):
+        responses = [make_response(502), make_response(503), make_response(200)]
+        with patch.object(self.client.session, 'request', side_effect=responses):
+            resp = self.client.post("https://api.notion.com/v1/search", json={})
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual([c[0][0] for c in mock_sleep.call_args_list], [1.0, 2.0])
+        mock_uniform.assert_any_call(0.5, 1.0)
+    
+    @patch('time.sleep')
+    def test_gives_up_after_max_retries(self, mock_sleep):
+        with patch.object(self.client.session, 'request', return_value=make_response(500)) as mock_request:
+            with self.assertRaises(requests.HTTPError):
+                self.client.get("https://api.notion.com/v1/pages/x")
+        self.assertEqual(mock_request.call_count, 4)  # first try + 3 retries
+        self.assertEqual(mock_sleep.call_count, 3)
+    
+    @patch('time.sleep')
+    def test_retries_dropped_connections(self, mock_sleep):
+        with patch.object(self.client.session, 'request',
+                          side_effect=[requests.ConnectionError("reset"), make_response(200)]):
+            resp = self.client.get("https://api.notion.com/v1/pages/x")
+        self.assertEqual(resp.status_code, 200)
+        mock_sleep.assert_called_once()
+    
+    def test_client_errors_are_not_retried(self):
+        with patch.object(self.client.session, 'request', return_value=make_response(404)) as mock_request:
+            resp = self.client.get("https://api.notion.com/v1/pages/x", raise_for_status=False)
+        self.assertEqual(resp.status_code, 404)
+        mock_request.assert_called_once()
+    
+    def test_rate_limiter_is_consulted_per_attempt(self):
+        limiter = MagicMock()
+        client = NotionClient("secret", rate_limiter=limiter)
+        with patch.object(client.session, 'request', return_value=make_response(200)):
+            client.get("https://api.notion.com/v1/pages/x")
+            client.get("https://api.notion.com/v1/pages/y")
+        self.assertEqual(limiter.acquire.call_count, 2)
+    
+    def test_unsupported_method(self):
+        with self.assertRaises(ValueError):
+            self.client.request("PUT", "https://api.notion.com/v1/pages/x")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,9 +1,11 @@
 import unittest
-from unittest.mock import patch, MagicMock, mock_open
+from unittest.mock import patch, MagicMock, mock_open, ANY
 import os
 import sys
 import json
 import sqlite3
+import shutil
+import tempfile
 from datetime import datetime
 
 # Add parent directory to path for imports
@@ -14,6 +16,7 @@ sys.modules['gemini_utils'] = MagicMock()
 sys.modules['gemini_utils'].call_gemini_api = MagicMock()
 sys.modules['gemini_utils'].MODEL_NAME = "gemini-2.0-flash"
 
+import cli.notion_cli
 from cli.notion_cli import (
     request_with_rate_limit,
     detect_id_type,
@@ -23,13 +26,30 @@ from cli.notion_cli import (
     save_crawl_error,
     get_page_title,
     get_first_block,
-    update_questions
+    update_questions,
+    crawl_metadata,
+    crawl_metadata_concurrent,
+    get_page_metadata,
+    IdTypeCache,
+    discover_via_search,
+    sync_metadata,
+    frontier_counts,
+    run_crawl_frontier,
+    WriteBuffer,
+    AnalysisSink,
+    integrate_exports,
+    analyze_notes,
+    load_gemini_outputs
 )
 
 
 class TestNotionCLI(unittest.TestCase):
     
     def setUp(self):
+        # Don't let the process-wide Notion rate limiter throttle (or sleep in) unit tests
+        limiter_patch = patch.object(cli.notion_cli.NOTION_RATE_LIMITER, 'acquire')
+        limiter_patch.start()
+        self.addCleanup(limiter_patch.stop)
         # Create an in-memory SQLite database for testing
         self.conn = sqlite3.connect(':memory:')
         # Initialize the database schema
@@ -62,39 +82,73 @@ class TestNotionCLI(unittest.TestCase):
             date_updated TEXT,
             questions_json TEXT
         )''')
+        c.execute('''CREATE TABLE IF NOT EXISTS id_types (
+            id TEXT PRIMARY KEY,
+            type TEXT
+        )''')
+        c.execute('''CREATE TABLE IF NOT EXISTS crawl_frontier (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            id TEXT UNIQUE,
+            parent_id TEXT,
+            kind TEXT,
+            state TEXT,
+            updated_at TEXT
+        )''')
         self.conn.commit()
     
+    def make_db(self, init=True):
+        """
+        Point DB_PATH at a database file in a fresh temporary directory for the rest of the test.
+
+        The directory (`self.tmp_dir`, also free for the test's other files) is
+        removed afterwards. Returns an init_db() connection, or None with `init=False`.
+        """
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+        self.db_path = os.path.join(self.tmp_dir, "notion_pages.db")
+        db_patch = patch('cli.notion_cli.DB_PATH', self.db_path)
+        db_patch.start()
+        self.addCleanup(db_patch.stop)
+        if not init:
+            return None
+        conn = init_db()
+        self.addCleanup(conn.close)
+        return conn
+    
     def tearDown(self):
         self.conn.close()
         
-    @patch('requests.get')
-    @patch('requests.post')
+    @patch('requests.Session.request')
     @patch('time.sleep')
-    def test_request_with_rate_limit(self, mock_sleep, mock_post, mock_get):
+    def test_request_with_rate_limit(self, mock_sleep, mock_request):
         # Test GET request
         mock_response_get = MagicMock()
         mock_response_get.status_code = 200
         mock_response_get.json.return_value = {"success": True}
-        mock_get.return_value = mock_response_get
+        mock_request.return_value = mock_response_get
         
         result = request_with_rate_limit("https://test.com", {}, method="GET")
         
         self.assertEqual(result.json(), {"success": True})
-        mock_get.assert_called_once()
+        mock_request.assert_called_once()
+        self.assertEqual(mock_request.call_args[0][:2], ("GET", "https://test.com"))
         
         # Test POST request
+        mock_request.reset_mock()
         mock_response_post = MagicMock()
         mock_response_post.status_code = 200
         mock_response_post.json.return_value = {"success": True}
-        mock_post.return_value = mock_response_post
+        mock_request.return_value = mock_response_post
         
         result = request_with_rate_limit("https://test.com", {}, method="POST", json={"data": "test"})
         
         self.assertEqual(result.json(), {"success": True})
-        mock_post.assert_called_once()
+        mock_request.assert_called_once()
+        self.assertEqual(mock_request.call_args[0][0], "POST")
+        self.assertEqual(mock_request.call_args[1]["json"], {"data": "test"})
         
         # Test rate limiting
-        mock_get.reset_mock()
+        mock_request.reset_mock()
         mock_sleep.reset_mock()
         
         # First response hits rate limit, second succeeds
@@ -106,19 +160,19 @@ class TestNotionCLI(unittest.TestCase):
         mock_success.status_code = 200
         mock_success.json.return_value = {"success": True}
         
-        mock_get.side_effect = [mock_rate_limited, mock_success]
+        mock_request.side_effect = [mock_rate_limited, mock_success]
         
         result = request_with_rate_limit("https://test.com", {}, method="GET")
         
         self.assertEqual(result.json(), {"success": True})
-        self.assertEqual(mock_get.call_count, 2)
+        self.assertEqual(mock_request.call_count, 2)
         mock_sleep.assert_called_once_with(2)
         
         # Test unsupported method
         with self.assertRaises(ValueError):
             request_with_rate_limit("https://test.com", {}, method="PUT")
     
-    @patch('requests.get')
+    @patch('requests.Session.request')
     def test_detect_id_type(self, mock_get):
         # Test database ID
         mock_db_response = MagicMock()
@@ -211,6 +265,456 @@ class TestNotionCLI(unittest.TestCase):
         self.assertEqual(page[3], "2023-01-04T00:00:00Z")
         self.assertEqual(page[4], "Updated content")  # Content unchanged
     
+    def test_write_buffer_batches_commits(self):
+        save_page_to_db(self.conn, "page_id_1", None, "c0", "e0", "Original content")
+        
+        with WriteBuffer(self.conn, max_rows=3, max_seconds=3600) as writer:
+            writer.save_page("page_id_1", "parent_1", "c1", "e1")  # metadata-only update
+            writer.save_page("page_id_2", "parent_1", "c2", "e2", "New content")
+            self.assertFalse(self.conn.in_transaction)  # nothing written yet
+            
+            # Reading a buffered page writes pending rows first (still uncommitted)
+            self.assertEqual(writer.get_page("page_id_1"), ("page_id_1", "parent_1", "c1", "e1", "Original content"))
+            self.assertTrue(self.conn.in_transaction)
+            
+            writer.save_crawl_error("page_id_3", "parent_1", "boom", "NA", "NA")  # 3rd row -> commit
+            self.assertFalse(self.conn.in_transaction)
+            
+            writer.save_page("page_id_4", None, "c4", "e4")
+        
+        # Leaving the context flushes the remainder
+        self.assertFalse(self.conn.in_transaction)
+        self.assertEqual(get_page_from_db(self.conn, "page_id_4")[3], "e4")
+        c = self.conn.cursor()
+        c.execute('SELECT content_length FROM pages WHERE id = ?', ("page_id_1",))
+        self.assertEqual(c.fetchone()[0], len("Original content"))
+        c.execute('SELECT error_message FROM crawl_errors WHERE id = ?', ("page_id_3",))
+        self.assertEqual(c.fetchone()[0], "boom")
+    
+    def test_analysis_sink_commits_results_in_batches(self):
+        with WriteBuffer(self.conn, max_rows=2, max_seconds=3600) as writer:
+            sink = AnalysisSink(writer, "2", "gemini-2.0-flash")
+            sink.save("n1", {"q1": "A", "questions_version": "v2", "model": "gemini-2.0-flash", "date_executed": "d1"})
+            self.assertFalse(self.conn.in_transaction)  # buffered, but already readable through the sink
+            self.assertEqual(sink.stored("n1"), {"q1": "A", "questions_version": "v2",
+                                                 "model": "gemini-2.0-flash", "date_executed": "d1"})
+            sink.save("n2", {"q1": "B", "questions_version": "v2", "model": "gemini-2.0-flash", "date_executed": "d2"})
+            # 2nd row -> committed while the run is still going
+            self.assertFalse(self.conn.in_transaction)
+            c = self.conn.cursor()
+            c.execute("SELECT note_id, questions_version, model, date_executed, answers_json FROM gemini_analysis ORDER BY note_id")
+            self.assertEqual(c.fetchall(), [("n1", "v2", "gemini-2.0-flash", "d1", '{"q1": "A"}'),
+                                            ("n2", "v2", "gemini-2.0-flash", "d2", '{"q1": "B"}')])
+            self.assertIsNone(sink.stored("n1", "1"))
+    
+    def test_write_buffer_flushes_on_interrupt(self):
+        import signal
+        previous = signal.getsignal(signal.SIGTERM)
+        with self.assertRaises(KeyboardInterrupt):
+            with WriteBuffer(self.conn, max_rows=100, max_seconds=3600) as writer:
+                self.assertIsNot(signal.getsignal(signal.SIGTERM), previous)
+                writer.save_page("page_id_1", None, "c1", "e1")
+                raise KeyboardInterrupt
+        self.assertIs(signal.getsignal(signal.SIGTERM), previous)
+        self.assertFalse(self.conn.in_transaction)
+        self.assertEqual(get_page_from_db(self.conn, "page_id_1")[2], "c1")
+    
+    def test_init_db_profile_and_migrations(self):
+        self.make_db(init=False)
+        
+        # A database created by an older version: tables only, no indexes, user_version 0
+        legacy = sqlite3.connect(self.db_path)
+        legacy.execute('''CREATE TABLE pages (id TEXT PRIMARY KEY, parent_id TEXT, created_time TEXT,
+                          last_edited_time TEXT, content TEXT, content_length INTEGER)''')
+        legacy.execute("INSERT INTO pages VALUES ('p1', NULL, 'c', 'e', 'text', 4)")
+        legacy.commit()
+        legacy.close()
+        
+        conn = init_db()
+        self.addCleanup(conn.close)
+        c = conn.cursor()
+        c.execute("PRAGMA journal_mode")
+        self.assertEqual(c.fetchone()[0], "wal")
+        c.execute("PRAGMA synchronous")
+        self.assertEqual(c.fetchone()[0], 1)  # NORMAL
+        c.execute("PRAGMA user_version")
+        self.assertGreaterEqual(c.fetchone()[0], 1)
+        c.execute("SELECT name FROM sqlite_master WHERE type='index' AND tbl_name='pages'")
+        indexes = {row[0] for row in c.fetchall()}
+        self.assertTrue({"idx_pages_parent_id", "idx_pages_last_edited_time", "idx_pages_created_time"} <= indexes)
+        c.execute("EXPLAIN QUERY PLAN SELECT id FROM pages WHERE parent_id = 'x'")
+        self.assertIn("idx_pages_parent_id", " ".join(str(row) for row in c.fetchall()))
+        self.assertEqual(get_page_from_db(conn, "p1")[4], "text")
+    
+    def test_integrate_exports_uses_manifest(self):
+        self.make_db(init=False)
+        exports = os.path.join(self.tmp_dir, "notion_notes")
+        parent_dir = os.path.join(exports, "Parent " + "a" * 32)
+        nested_dir = os.path.join(parent_dir, "Child " + "b" * 32)
+        os.makedirs(nested_dir)
+        files = {
+            os.path.join(parent_dir, "Top note " + "c" * 32 + ".md"): "top content",
+            os.path.join(nested_dir, "Deep note " + "d" * 32 + ".md"): "deep content",
+        }
+        for path, text in files.items():
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(text)
+        
+        read_export = cli.notion_cli.read_export
+        with patch('cli.notion_cli.EXPORTS_DIR', exports), \
+             patch('cli.notion_cli.read_export', side_effect=read_export) as mock_read:
+            integrate_exports()
+            self.assertEqual(mock_read.call_count, 2)
+            conn = sqlite3.connect(self.db_path)
+            self.addCleanup(conn.close)
+            # Nested exports are found and linked to their folder's page
+            self.assertEqual(get_page_from_db(conn, "d" * 32)[1:], ("b" * 32, None, None, "deep content"))
+            self.assertEqual(get_page_from_db(conn, "b" * 32)[1], "a" * 32)
+            self.assertEqual(get_page_from_db(conn, "c" * 32)[1], "a" * 32)
+            
+            # Unchanged files are not opened again
+            mock_read.reset_mock()
+            integrate_exports()
+            mock_read.assert_not_called()
+            
+            # A modified export is re-read and replaces the stored content
+            deep_path = os.path.join(nested_dir, "Deep note " + "d" * 32 + ".md")
+            with open(deep_path, "w", encoding="utf-8") as f:
+                f.write("deep content, edited")
+            os.utime(deep_path, ns=(1, 1))
+            integrate_exports()
+            self.assertEqual(mock_read.call_count, 1)
+            self.assertEqual(get_page_from_db(conn, "d" * 32)[4], "deep content, edited")
+    
+    def test_integrate_exports_from_zip(self):
+        import zipfile
+        self.make_db(init=False)
+        zip_path = os.path.join(self.tmp_dir, "Export-workspace.zip")
+        with zipfile.ZipFile(zip_path, "w", zipfile.ZIP_DEFLATED) as archive:
+            archive.writestr("Parent " + "a" * 32 + "/Note " + "c" * 32 + ".md", "zipped content")
+            archive.writestr("Parent " + "a" * 32 + "/image.png", b"not markdown")
+        
+        with patch('cli.notion_cli.zipfile.ZipFile.extractall') as mock_extract, \
+             patch('cli.notion_cli.EXPORTS_DIR', os.path.join(self.tmp_dir, "missing")):
+            integrate_exports(zip_path)
+            mock_extract.assert_not_called()
+            conn = sqlite3.connect(self.db_path)
+            self.addCleanup(conn.close)
+            self.assertEqual(get_page_from_db(conn, "c" * 32)[1:], ("a" * 32, None, None, "zipped content"))
+            self.assertIsNotNone(get_page_from_db(conn, "a" * 32))
+            # Members are fingerprinted by the archive path, size and CRC
+            c = conn.cursor()
+            c.execute("SELECT path, note_id FROM export_manifest")
+            self.assertEqual(c.fetchall(), [(os.path.realpath(zip_path) + "!/Parent " + "a" * 32 + "/Note " + "c" * 32 + ".md",
+                                             "c" * 32)])
+            
+            # Integrating the exports directory afterwards leaves the archive's manifest rows alone
+            integrate_exports()
+            c.execute("SELECT COUNT(*) FROM export_manifest")
+            self.assertEqual(c.fetchone()[0], 1)
+    
+    def test_export_manifest_is_scoped_per_source(self):
+        import zipfile
+        self.make_db(init=False)
+        sources = []
+        for name, note_id in (("first", "a" * 32), ("second", "b" * 32)):
+            export_dir = os.path.join(self.tmp_dir, name, "notion_notes")
+            os.makedirs(export_dir)
+            with open(os.path.join(export_dir, f"Note {note_id}.md"), "w", encoding="utf-8") as f:
+                f.write(f"{name} content")
+            # Archives with the same file name in different folders
+            zip_path = os.path.join(self.tmp_dir, name, "Export.zip")
+            with zipfile.ZipFile(zip_path, "w") as archive:
+                archive.writestr(f"Zipped {note_id[:1] * 31}c.md", f"{name} zipped")
+            sources += [export_dir, zip_path]
+        
+        read_export = cli.notion_cli.read_export
+        with patch('cli.notion_cli.read_export', side_effect=read_export) as mock_read:
+            for source in sources:
+                integrate_exports(source)
+            conn = sqlite3.connect(self.db_path)
+            self.addCleanup(conn.close)
+            c = conn.cursor()
+            c.execute("SELECT COUNT(*) FROM export_manifest")
+            self.assertEqual(c.fetchone()[0], 4)
+            
+            # Switching back to the first directory skips its unchanged files
+            mock_read.reset_mock()
+            integrate_exports(sources[0])
+            mock_read.assert_not_called()
+    
+    def test_analyze_notes_content_hash_cache(self):
+        conn = self.make_db()
+        outputs_dir = os.path.join(self.tmp_dir, "outputs")
+        save_page_to_db(conn, "n1", None, "2024-01-01T00:00:00.000Z", "2024-01-01T00:00:00.000Z", "Same text")
+        save_page_to_db(conn, "n2", None, "2024-01-01T00:00:00.000Z", "2024-01-01T00:00:00.000Z", "Same   text\n")
+        save_page_to_db(conn, "n3", None, "2024-01-01T00:00:00.000Z", "2024-01-01T00:00:00.000Z", "Other text")
+        
+        questions = MagicMock()
+        questions.load_questions.return_value = ("Instructions", ["Q1"], "v1")
+        def analyze(content, questions_version, question_indices=None, controller=None):
+            indices = question_indices if question_indices is not None else [0]
+            result = {f"q{i+1}": f"answer {i+1} for {' '.join(content.split())}" for i in indices}
+            result.update({"questions_version": "v1", "model": "gemini-2.0-flash"})
+            return result
+        
+        def run(mirror_json=False):
+            with patch('cli.notion_cli.OUTPUTS_DIR', outputs_dir), \
+                 patch('cli.notion_cli.load_questions', questions.load_questions), \
+                 patch('cli.notion_cli.question_versions', return_value=["1"]), \
+                 patch('cli.notion_cli.estimate_tokens', side_effect=lambda text: len(text) // 4 + 1), \
+                 patch('cli.notion_cli.call_gemini_api', side_effect=analyze) as mock_api:
+                analyze_notes(questions_version="1", mirror_json=mirror_json)
+            self.calls = mock_api.call_args_list
+            return [call.args[0] for call in mock_api.call_args_list]
+        
+        # Whitespace-only differences share one Gemini call
+        self.assertEqual(sorted(" ".join(content.split()) for content in run()), ["Other text", "Same text"])
+        # Results go straight into gemini_analysis; no JSON files unless mirrored
+        for note_id in ("n1", "n2"):
+            self.assertEqual(self._stored_answers(conn, note_id, "v1")["q1"], "answer 1 for Same text")
+        self.assertFalse(os.path.exists(outputs_dir))
+        
+        # Nothing changed: nothing is sent
+        self.assertEqual(run(), [])
+        
+        # Only the edited note is re-analyzed
+        save_page_to_db(conn, "n3", None, "2024-01-01T00:00:00.000Z", "2024-02-01T00:00:00.000Z", "Other text, edited")
+        self.assertEqual(run(), ["Other text, edited"])
+        
+        # An added question is asked on its own, once per distinct content; Q1 answers carry forward
+        questions.load_questions.return_value = ("Instructions", ["Q1", "Q2"], "v1")
+        self.assertEqual(len(run(mirror_json=True)), 2)
+        self.assertEqual([call.kwargs["question_indices"] for call in self.calls], [[1], [1]])
+        answers = self._stored_answers(conn, "n3", "v1")
+        self.assertEqual((answers["q1"], answers["q2"]), ("answer 1 for Other text, edited", "answer 2 for Other text, edited"))
+        with open(os.path.join(outputs_dir, "gemini_n3_v1_gemini-2.0-flash.json"), encoding="utf-8") as f:
+            self.assertEqual(json.load(f)["q2"], "answer 2 for Other text, edited")
+    
+    def _stored_answers(self, conn, note_id, questions_version):
+        c = conn.cursor()
+        c.execute('''SELECT answers_json FROM gemini_analysis
+                     WHERE note_id = ? AND questions_version = ? AND model = ?''',
+                  (note_id, questions_version, "gemini-2.0-flash"))
+        row = c.fetchone()
+        return json.loads(row[0]) if row else None
+    
+    def test_analyze_notes_retries_notes_missed_by_a_batch(self):
+        conn = self.make_db()
+        for note_id in ("n1", "n2"):
+            save_page_to_db(conn, note_id, None, "2024-01-01T00:00:00.000Z", "2024-01-01T00:00:00.000Z", f"Text of {note_id}")
+        
+        def batch(notes, questions_version):
+            # The reply only answers the first note
+            return {notes[0][0]: {"q1": "batched", "questions_version": "v1"}}
+        # The single-note retry first hits the quota, then succeeds
+        single = [{"error": "API quota exceeded", "status_code": 429, "retry_delay": 0},
+                  {"q1": "single", "questions_version": "v1"}]
+        
+        with patch('cli.notion_cli.load_questions', return_value=("Instructions", ["Q1"], "v1")), \
+             patch('cli.notion_cli.question_versions', return_value=["1"]), \
+             patch('cli.notion_cli.estimate_tokens', side_effect=lambda text: len(text) // 4 + 1), \
+             patch('cli.notion_cli.pack_batches', side_effect=lambda notes, token_budget: [list(notes)]), \
+             patch('cli.notion_cli.call_gemini_api_batch', side_effect=batch) as mock_batch, \
+             patch('cli.notion_cli.call_gemini_api', side_effect=single) as mock_single:
+            analyze_notes(questions_version="1", batch_tokens=1000)
+        
+        mock_batch.assert_called_once()
+        self.assertEqual(mock_single.call_count, 2)
+        answers = {note_id: self._stored_answers(conn, note_id, "v1")["q1"] for note_id in ("n1", "n2")}
+        self.assertEqual(sorted(answers.values()), ["batched", "single"])
+    
+    def test_analyze_notes_selects_candidates_in_sql(self):
+        conn = self.make_db()
+        save_page_to_db(conn, "old", None, "2023-01-01T00:00:00.000Z", "2023-06-01T00:00:00.000Z", "Old note, long enough to go first")
+        save_page_to_db(conn, "new", None, "2024-03-01T00:00:00.000Z", "2024-03-01T00:00:00.000Z", "New note")
+        save_page_to_db(conn, "edited", None, "2023-01-01T00:00:00.000Z", "2024-05-01T09:30:00.000Z", "Edited note, the longest one of all")
+        # Pages whose metadata fetch failed carry 'NA' timestamps and never match a date filter
+        save_page_to_db(conn, "failed", None, "NA", "NA", "Failed note")
+        
+        def run(from_date=None):
+            with patch('cli.notion_cli.OUTPUTS_DIR', os.path.join(self.tmp_dir, "outputs")), \
+                 patch('cli.notion_cli.load_questions', return_value=("Instructions", ["Q1"], "v1")), \
+                 patch('cli.notion_cli.question_versions', return_value=["1"]), \
+                 patch('cli.notion_cli.content_hash', wraps=cli.notion_cli.content_hash) as mock_hash, \
+                 patch('cli.notion_cli.call_gemini_api', return_value={"q1": "A", "questions_version": "v1"}) as mock_api:
+                analyze_notes(questions_version="1", from_date=from_date)
+            self.hashed = mock_hash.call_count
+            return [call.args[0] for call in mock_api.call_args_list]
+        
+        # Date filter on either timestamp, longest note first
+        self.assertEqual(run("01/03/2024"), ["Edited note, the longest one of all", "New note"])
+        c = conn.cursor()
+        c.execute("SELECT id FROM pages WHERE content_hash IS NOT NULL ORDER BY id")
+        self.assertEqual(c.fetchall(), [("edited",), ("new",)])
+        
+        # Finished notes are skipped by the query without being read or hashed again
+        self.assertEqual(run(), ["Old note, long enough to go first", "Failed note"])
+        self.assertEqual(self.hashed, 2)
+        self.assertEqual(run(), [])
+        self.assertEqual(self.hashed, 0)
+        
+        # Changing the content clears the stored hash
+        save_page_to_db(conn, "new", None, "2024-03-01T00:00:00.000Z", "2024-03-02T00:00:00.000Z", "New note, edited")
+        c.execute("SELECT content_hash FROM pages WHERE id = 'new'")
+        self.assertIsNone(c.fetchone()[0])
+        self.assertEqual(run(), ["New note, edited"])
+    
+    def test_analyze_notes_carries_answers_across_question_versions(self):
+        conn = self.make_db()
+        outputs_dir = os.path.join(self.tmp_dir, "outputs")
+        os.makedirs(outputs_dir)
+        save_page_to_db(conn, "n1", None, "2024-01-01T00:00:00.000Z", "2024-01-01T00:00:00.000Z", "Note text")
+        # An output for version 3 written before answers were stored per question
+        with open(os.path.join(outputs_dir, "gemini_n1_v3_gemini-2.0-flash.json"), "w", encoding="utf-8") as f:
+            json.dump({"q1": "A", "q2": "B", "q3": "C", "q4": "D", "q5": "E",
+                       "questions_version": "v3", "model": "gemini-2.0-flash", "date_executed": "2024-01-02T00:00:00"}, f)
+        
+        question_sets = {
+            "3": ("Instructions", ["Q1", "Q2", "Q3", "Q4", "Q5"], "v3"),
+            "4": ("Instructions", ["Q1", "Q2 reworded", "Q3", "Q4", "Q5", "Q6"], "v4"),
+        }
+        questions = MagicMock()
+        questions.load_questions.side_effect = lambda version: question_sets[version]
+        with patch('cli.notion_cli.OUTPUTS_DIR', outputs_dir), \
+             patch('cli.notion_cli.load_questions', questions.load_questions), \
+             patch('cli.notion_cli.question_versions', return_value=["3", "4"]), \
+             patch('cli.notion_cli.estimate_tokens', side_effect=lambda text: len(text) // 4 + 1), \
+             patch('cli.notion_cli.call_gemini_api', return_value={"q2": "B2", "q6": "F", "questions_version": "v4"}) as mock_api:
+            analyze_notes(questions_version="4")
+        
+        # Only the reworded and the new question are sent
+        mock_api.assert_called_once_with("Note text", "4", question_indices=[1, 5], controller=ANY)
+        answers = self._stored_answers(conn, "n1", "v4")
+        self.assertEqual(answers, {"q1": "A", "q2": "B2", "q3": "C", "q4": "D", "q5": "E", "q6": "F"})
+    
+    def test_analyze_notes_adopts_only_current_untracked_results(self):
+        conn = self.make_db()
+        # Results stored before the cache existed, so there is no record of what they were computed from
+        for note_id, answers, date_executed in (("complete", {"q1": "A", "q2": "B"}, "2024-01-03T00:00:00"),
+                                                ("partial", {"q1": "A"}, "2024-01-03T00:00:00"),
+                                                ("stale", {"q1": "A", "q2": "B"}, "2023-12-01T00:00:00")):
+            save_page_to_db(conn, note_id, None, "2023-11-01T00:00:00.000Z", "2024-01-02T00:00:00.000Z", f"Text of {note_id}")
+            conn.execute("INSERT INTO gemini_analysis VALUES (?, 'v1', 'gemini-2.0-flash', ?, ?)",
+                         (note_id, date_executed, json.dumps(answers)))
+        conn.commit()
+        
+        with patch('cli.notion_cli.load_questions', return_value=("Instructions", ["Q1", "Q2"], "v1")), \
+             patch('cli.notion_cli.question_versions', return_value=["1"]), \
+             patch('cli.notion_cli.estimate_tokens', side_effect=lambda text: len(text) // 4 + 1), \
+             patch('cli.notion_cli.call_gemini_api', return_value={"q1": "new", "q2": "new", "questions_version": "v1"}) as mock_api:
+            analyze_notes(questions_version="1")
+        
+        self.assertEqual(sorted(call.args[0] for call in mock_api.call_args_list), ["Text of partial", "Text of stale"])
+        self.assertEqual(self._stored_answers(conn, "complete", "v1"), {"q1": "A", "q2": "B"})
+        self.assertEqual(self._stored_answers(conn, "stale", "v1"), {"q1": "new", "q2": "new"})
+    
+    def test_load_gemini_outputs_skips_unchanged_files(self):
+        self.make_db(init=False)
+        outputs_dir = os.path.join(self.tmp_dir, "outputs")
+        os.makedirs(outputs_dir)
+        def write(note_id, answer, date_executed="2024-01-01"):
+            with open(os.path.join(outputs_dir, f"gemini_{note_id}_v2_gemini-2.0-flash.json"), "w", encoding="utf-8") as f:
+                json.dump({"q1": answer, "questions_version": "v2", "model": "gemini-2.0-flash",
+                           "date_executed": date_executed}, f)
+        write("n1", "A")
+        write("n2", "B")
+        with open(os.path.join(outputs_dir, "gemini_n3_v2_gemini-2.0-flash.json"), "w", encoding="utf-8") as f:
+            f.write("{not json")
+        
+        def load():
+            with patch('cli.notion_cli.OUTPUTS_DIR', outputs_dir), \
+                 patch('builtins.open', wraps=open) as mock_open:
+                load_gemini_outputs()
+            return sorted(os.path.basename(call.args[0]) for call in mock_open.call_args_list)
+        
+        self.assertEqual(load(), ["gemini_n1_v2_gemini-2.0-flash.json", "gemini_n2_v2_gemini-2.0-flash.json",
+                                  "gemini_n3_v2_gemini-2.0-flash.json"])
+        # Loaded files are not opened again; the malformed one is retried
+        self.assertEqual(load(), ["gemini_n3_v2_gemini-2.0-flash.json"])
+        
+        conn = sqlite3.connect(self.db_path)
+        self.addCleanup(conn.close)
+        c = conn.cursor()
+        # Analyses stored by analyze_notes after the files were written
+        c.execute("UPDATE gemini_analysis SET date_executed = '2024-03-01', answers_json = '{\"q1\": \"A, newer\"}' WHERE note_id = 'n1'")
+        c.executemany("INSERT INTO note_analysis_state VALUES (?, '2', 'gemini-2.0-flash', 'hash', 'qhash')", [("n1",), ("n2",)])
+        conn.commit()
+        
+        write("n1", "A, stale")
+        write("n2", "B, edited", "2024-02-01")
+        os.remove(os.path.join(outputs_dir, "gemini_n3_v2_gemini-2.0-flash.json"))
+        self.assertEqual(load(), ["gemini_n1_v2_gemini-2.0-flash.json", "gemini_n2_v2_gemini-2.0-flash.json"])
+        
+        c.execute("SELECT note_id, questions_version, model, date_executed, answers_json FROM gemini_analysis ORDER BY note_id")
+        self.assertEqual(c.fetchall(), [("n1", "v2", "gemini-2.0-flash", "2024-03-01", '{"q1": "A, newer"}'),
+                                        ("n2", "v2", "gemini-2.0-flash", "2024-02-01", '{"q1": "B, edited"}')])
+        # The overridden note no longer claims the cache state of the analysis it replaced
+        c.execute("SELECT note_id FROM note_analysis_state")
+        self.assertEqual(c.fetchall(), [("n1",)])
+        c.execute("SELECT filename FROM output_ledger ORDER BY filename")
+        self.assertEqual(c.fetchall(), [("gemini_n1_v2_gemini-2.0-flash.json",), ("gemini_n2_v2_gemini-2.0-flash.json",)])
+    
+    def test_search_index_follows_pages_and_answers(self):
+        conn = self.make_db()
+        
+        def search(term):
+            c = conn.cursor()
+            c.execute('''SELECT d.kind, d.note_id FROM search_index JOIN search_docs d ON d.docid = search_index.rowid
+                         WHERE search_index MATCH ? ORDER BY d.kind, d.note_id''', (term,))
+            return c.fetchall()
+        
+        save_page_to_db(conn, "n1", None, "c", "e", "Notes about sourdough")
+        save_page_to_db(conn, "n2", None, "c", "e", None)
+        self.assertEqual(search("sourdough"), [("note", "n1")])
+        
+        # Edits replace the indexed text
+        save_page_to_db(conn, "n1", None, "c", "e2", "Notes about rye")
+        self.assertEqual(search("sourdough"), [])
+        self.assertEqual(search("rye"), [("note", "n1")])
+        
+        # Answers are indexed by their values, and INSERT OR REPLACE leaves no stale entry
+        with WriteBuffer(conn) as writer:
+            writer.save_analysis("n2", "v1", "gemini-2.0-flash", "d", json.dumps({"q1": "Mentions rye flour", "q2": ["crumb"]}))
+        with WriteBuffer(conn) as writer:
+            writer.save_analysis("n2", "v1", "gemini-2.0-flash", "d", json.dumps({"q1": "Mentions rye", "q2": ["crust"]}))
+        self.assertEqual(search("rye"), [("answers", "n2"), ("note", "n1")])
+        self.assertEqual(search("crumb OR flour"), [])
+        self.assertEqual(search("crust"), [("answers", "n2")])
+        
+        conn.execute("DELETE FROM gemini_analysis")
+        conn.execute("DELETE FROM pages WHERE id = 'n1'")
+        self.assertEqual(search("rye"), [])
+        c = conn.cursor()
+        c.execute("SELECT COUNT(*) FROM search_docs")
+        self.assertEqual(c.fetchone()[0], 1)  # n2's (empty) note entry
+    
+    def test_page_closure_follows_parent_changes(self):
+        conn = self.make_db()
+        
+        def closure():
+            c = conn.cursor()
+            c.execute("SELECT ancestor, descendant, depth FROM page_closure WHERE depth > 0 ORDER BY ancestor, descendant")
+            return c.fetchall()
+        
+        # Children saved before their parent are attached once the parent arrives
+        save_page_to_db(conn, "g", "c", "c", "e", "grandchild")
+        save_page_to_db(conn, "c", "r", "c", "e", "child")
+        save_page_to_db(conn, "r", None, "c", "e", "root")
+        save_page_to_db(conn, "o", None, "c", "e", "other root")
+        self.assertEqual(closure(), [("c", "g", 1), ("r", "c", 1), ("r", "g", 2)])
+        
+        # Moving a page moves its whole subtree
+        save_page_to_db(conn, "c", "o", "c", "e2", "child")
+        self.assertEqual(closure(), [("c", "g", 1), ("o", "c", 1), ("o", "g", 2)])
+        
+        # Deleting a page detaches its descendants from its ancestors
+        conn.execute("DELETE FROM pages WHERE id = 'c'")
+        self.assertEqual(closure(), [("c", "g", 1)])
+        c = conn.cursor()
+        c.execute("SELECT descendant FROM page_closure WHERE depth = 0 ORDER BY descendant")
+        self.assertEqual(c.fetchall(), [("g",), ("o",), ("r",)])
+    
     def test_save_crawl_error(self):
         save_crawl_error(
             self.conn,
@@ -231,6 +735,253 @@ class TestNotionCLI(unittest.TestCase):
         self.assertEqual(error[3], "Test title")
         self.assertEqual(error[4], "Test content")
     
+    def _mock_workspace(self):
+        # root -> (child_a, db_1 -> (row_1, row_2))
+        metadata = {
+            "root": {"id": "root", "created_time": "c0", "last_edited_time": "e0"},
+            "child_a": {"id": "child_a", "created_time": "c1", "last_edited_time": "e1"},
+            "row_1": {"id": "row_1", "created_time": "c2", "last_edited_time": "e2"},
+        }
+        def get_metadata(page_id, id_type=None):
+            if page_id not in metadata:
+                raise ValueError(f"no access to {page_id}")
+            # These are all pages, which the page-first lookup fetches in one request
+            return dict(metadata[page_id], type=id_type or "page", requests=1)
+        children = {
+            "root": ([{"id": "child_a", "title": "A"}], [{"id": "db_1", "title": "DB"}]),
+        }
+        return {
+            'get_page_metadata': MagicMock(side_effect=get_metadata),
+            'get_child_pages_and_databases': MagicMock(side_effect=lambda pid: children.get(pid, ([], []))),
+            'is_valid_database_id': MagicMock(return_value=True),
+            'get_database_rows': MagicMock(return_value=["row_1", "row_2"]),
+        }
+    
+    def _crawl_snapshot(self):
+        c = self.conn.cursor()
+        c.execute('SELECT id, parent_id, created_time, last_edited_time FROM pages ORDER BY id')
+        pages = c.fetchall()
+        c.execute('SELECT id, parent_id, error_message FROM crawl_errors ORDER BY id')
+        return pages, c.fetchall()
+    
+    def test_crawl_metadata_concurrent_matches_serial(self):
+        with patch.multiple('cli.notion_cli', **self._mock_workspace()):
+            crawl_metadata(self.conn, "root")
+        serial = self._crawl_snapshot()
+        
+        self.conn.execute('DELETE FROM pages')
+        self.conn.execute('DELETE FROM crawl_errors')
+        
+        mocks = self._mock_workspace()
+        with patch.multiple('cli.notion_cli', **mocks):
+            crawl_metadata_concurrent(self.conn, [("root", None)], concurrency=3)
+        concurrent = self._crawl_snapshot()
+        
+        self.assertEqual(serial, concurrent)
+        pages, errors = concurrent
+        self.assertIn(("row_1", "db_1", "c2", "e2"), pages)
+        self.assertEqual(errors, [("row_2", "db_1", "no access to row_2")])
+        mocks['get_database_rows'].assert_called_once_with("db_1")
+    
+    def test_crawl_resumes_from_frontier(self):
+        mocks = self._mock_workspace()
+        list_children = mocks['get_child_pages_and_databases'].side_effect
+        interrupted = {"done": False}
+        def flaky_listing(page_id):
+            # Simulate Ctrl-C while child_a is being crawled
+            if page_id == "child_a" and not interrupted["done"]:
+                interrupted["done"] = True
+                raise KeyboardInterrupt
+            return list_children(page_id)
+        mocks['get_child_pages_and_databases'].side_effect = flaky_listing
+        
+        with patch.multiple('cli.notion_cli', **mocks):
+            with self.assertRaises(KeyboardInterrupt):
+                crawl_metadata(self.conn, "root")
+            counts = frontier_counts(self.conn)
+            self.assertEqual(counts["done"], 1)  # root
+            self.assertEqual(counts["in_progress"], 1)  # child_a
+            self.assertEqual(counts["pending"], 1)  # db_1
+            
+            mocks['get_page_metadata'].reset_mock()
+            self.assertTrue(run_crawl_frontier(self.conn))
+        
+        # Root was not requested again; the interrupted node and the rest were
+        fetched = [c[0][0] for c in mocks['get_page_metadata'].call_args_list]
+        self.assertEqual(fetched, ["child_a", "row_1", "row_2"])
+        self.assertEqual(get_page_from_db(self.conn, "row_1")[1], "db_1")
+        # A finished crawl leaves an empty frontier behind
+        self.assertEqual(sum(frontier_counts(self.conn).values()), 0)
+    
+    def test_crawl_uses_id_type_cache(self):
+        mocks = self._mock_workspace()
+        cache = IdTypeCache(self.conn)
+        with patch.multiple('cli.notion_cli', **mocks):
+            crawl_metadata(self.conn, "root", id_cache=cache)
+        
+        # Root was unknown; every listed child was fetched with its type known
+        calls = [c[0] for c in mocks['get_page_metadata'].call_args_list]
+        self.assertEqual(calls, [("root", None), ("child_a", "page"), ("row_1", "page"), ("row_2", "page")])
+        # root: 3 -> 1 request (page endpoint first), child_a and row_1: 3 -> 1 each (row_2 failed)
+        self.assertEqual(cache.requests_saved, 6)
+        
+        # Types survive in SQLite for the next run
+        fresh = IdTypeCache(self.conn)
+        self.assertEqual(fresh.get("db_1"), "database")
+        self.assertEqual(fresh.get("child_a"), "page")
+        self.assertIsNone(fresh.get("unknown"))
+    
+    @patch('cli.notion_cli.request_with_rate_limit')
+    def test_discover_via_search(self, mock_request):
+        # An exported note already in the DB under its undashed ID
+        save_page_to_db(self.conn, "aaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaa", None, None, None, "Exported content")
+        first = MagicMock()
+        first.json.return_value = {
+            "results": [
+                {"object": "page", "id": "aaaaaaaa-aaaa-aaaa-aaaa-aaaaaaaaaaaa",
+                 "parent": {"type": "workspace", "workspace": True},
+                 "created_time": "c1", "last_edited_time": "e1"},
+                {"object": "database", "id": "db-1",
+                 "parent": {"type": "page_id", "page_id": "aaaaaaaa-aaaa-aaaa-aaaa-aaaaaaaaaaaa"},
+                 "created_time": "c2", "last_edited_time": "e2"},
+            ],
+            "has_more": True,
+            "next_cursor": "cursor-2",
+        }
+        second = MagicMock()
+        second.json.return_value = {
+            "results": [
+                {"object": "page", "id": "row-1",
+                 "parent": {"type": "database_id", "database_id": "db-1"},
+                 "created_time": "c3", "last_edited_time": "e3"},
+            ],
+            "has_more": False,
+            "next_cursor": None,
+        }
+        payloads = []
+        def respond(url, headers, method="GET", json=None, params=None):
+            payloads.append(dict(json))
+            return first if len(payloads) == 1 else second
+        mock_request.side_effect = respond
+        
+        cache = IdTypeCache(self.conn)
+        found = discover_via_search(self.conn, id_cache=cache)
+        
+        self.assertEqual(found, 3)
+        self.assertEqual(payloads, [{"page_size": 100}, {"page_size": 100, "start_cursor": "cursor-2"}])
+        self.assertTrue(mock_request.call_args[0][0].endswith("/search"))
+        
+        exported = get_page_from_db(self.conn, "aaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaa")
+        self.assertEqual(exported, ("aaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaa", None, "c1", "e1", "Exported content"))
+        self.assertEqual(get_page_from_db(self.conn, "db-1")[1], "aaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaa")
+        self.assertEqual(get_page_from_db(self.conn, "row-1")[1], "db-1")
+        self.assertEqual(cache.get("db-1"), "database")
+        self.assertEqual(cache.get("row-1"), "page")
+    
+    def test_sync_metadata_uses_watermarks(self):
+        self.make_db(init=False)
+        
+        search_results = [
+            {"object": "database", "id": "db-1", "parent": {"type": "workspace", "workspace": True},
+             "created_time": "2024-01-01T00:00:00.000Z", "last_edited_time": "2024-03-01T00:00:00.000Z"},
+            {"object": "page", "id": "page-1", "parent": {"type": "workspace", "workspace": True},
+             "created_time": "2024-01-01T00:00:00.000Z", "last_edited_time": "2024-02-01T00:00:00.000Z"},
+        ]
+        db_rows = [
+            {"object": "page", "id": "row-1", "parent": {"type": "database_id", "database_id": "db-1"},
+             "created_time": "2024-01-05T00:00:00.000Z", "last_edited_time": "2024-02-15T00:00:00.000Z"},
+        ]
+        calls = []
+        def respond(url, headers, method="GET", json=None, params=None):
+            calls.append((url.rsplit("/v1/", 1)[1], dict(json)))
+            resp = MagicMock()
+            if url.endswith("/search"):
+                resp.json.return_value = {"results": search_results, "has_more": False, "next_cursor": None}
+            else:
+                resp.json.return_value = {"results": db_rows, "next_cursor": None}
+            return resp
+        
+        with patch('cli.notion_cli.request_with_rate_limit', side_effect=respond):
+            self.assertEqual(sync_metadata(), 3)
+            self.assertEqual(calls[0][1]["sort"], {"timestamp": "last_edited_time", "direction": "descending"})
+            self.assertNotIn("filter", calls[1][1])
+            
+            # Nothing changed: search stops at the watermark, the DB query is filtered
+            calls.clear()
+            search_results = [dict(search_results[1], last_edited_time="2024-01-20T00:00:00.000Z")]
+            db_rows = []
+            self.assertEqual(sync_metadata(), 0)
+        
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(calls[1][0], "databases/db-1/query")
+        self.assertEqual(calls[1][1]["filter"],
+                         {"timestamp": "last_edited_time", "last_edited_time": {"on_or_after": "2024-02-15T00:00:00.000Z"}})
+        conn = sqlite3.connect(self.db_path)
+        self.assertEqual(get_page_from_db(conn, "row-1")[1:4],
+                         ("db-1", "2024-01-05T00:00:00.000Z", "2024-02-15T00:00:00.000Z"))
+        conn.close()
+    
+    def test_sync_metadata_canonicalizes_database_rows_parent(self):
+        conn = self.make_db()
+        dashed = "aaaaaaaa-aaaa-aaaa-aaaa-aaaaaaaaaaaa"
+        
+        # The database was stored from an export (undashed) but typed from the API (dashed)
+        save_page_to_db(conn, dashed.replace("-", ""), None, "c", "e", "Database export")
+        conn.execute("INSERT INTO id_types (id, type) VALUES (?, 'database')", (dashed,))
+        conn.commit()
+        
+        db_rows = [{"object": "page", "id": "row-1", "parent": {"type": "database_id", "database_id": dashed},
+                    "created_time": "2024-01-05T00:00:00.000Z", "last_edited_time": "2024-02-15T00:00:00.000Z"}]
+        def respond(url, headers, method="GET", json=None, params=None):
+            resp = MagicMock()
+            if url.endswith("/search"):
+                resp.json.return_value = {"results": [], "has_more": False, "next_cursor": None}
+            else:
+                resp.json.return_value = {"results": db_rows, "next_cursor": None}
+            return resp
+        
+        with patch('cli.notion_cli.request_with_rate_limit', side_effect=respond):
+            self.assertEqual(sync_metadata(), 1)
+        
+        self.assertEqual(get_page_from_db(conn, "row-1")[1], dashed.replace("-", ""))
+        c = conn.cursor()
+        c.execute("SELECT ancestor FROM page_closure WHERE descendant = 'row-1' AND depth = 1")
+        self.assertEqual(c.fetchall(), [(dashed.replace("-", ""),)])
+    
+    @patch('requests.Session.request')
+    def test_get_page_metadata_single_request(self, mock_request):
+        ok = MagicMock()
+        ok.status_code = 200
+        ok.json.return_value = {"created_time": "c", "last_edited_time": "e"}
+        mock_request.return_value = ok
+        
+        meta = get_page_metadata("known_page", id_type="page")
+        
+        mock_request.assert_called_once()
+        self.assertTrue(mock_request.call_args[0][1].endswith("/pages/known_page"))
+        self.assertEqual(meta["last_edited_time"], "e")
+        self.assertEqual(meta["requests"], 1)
+        
+        # Unknown ID: the page endpoint is tried first, so a page still costs one request
+        mock_request.reset_mock()
+        meta = get_page_metadata("unknown_page")
+        
+        mock_request.assert_called_once()
+        self.assertTrue(mock_request.call_args[0][1].endswith("/pages/unknown_page"))
+        self.assertEqual((meta["type"], meta["requests"]), ("page", 1))
+        
+        # An unknown database falls back to the database endpoint
+        not_found = MagicMock()
+        not_found.status_code = 404
+        mock_request.reset_mock()
+        mock_request.side_effect = [not_found, ok]
+        
+        meta = get_page_metadata("unknown_database")
+        
+        self.assertEqual(mock_request.call_count, 2)
+        self.assertTrue(mock_request.call_args[0][1].endswith("/databases/unknown_database"))
+        self.assertEqual((meta["type"], meta["requests"]), ("database", 2))
+    
     def test_get_page_title(self):
         mock_title_function = MagicMock(return_value="Test Page Title")
         